@@ -1,8 +1,49 @@
 import os
 import sys
+
 import streamlit as st
-from openai import OpenAI
 import openai
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from coi_batch import BATCH_DIR, archive_path, batch_id, get_batch, read_intake, start_batch
+from coi_cache import get_response_cache
+from coi_directory import get_directory
+from coi_geo import validate_zip
+from coi_jobs import FAILED, QUEUED, get_job_runner
+from coi_metrics import ADMIN_PANEL, get_metrics
+from coi_prewarm import record_lookup
+from coi_ratelimit import get_rate_limiter, set_session
+from coi_similarity import get_intake_index
+from coi_store import get_result_store
+from coi_verify import PENDING_BADGE, contact_issue, get_verifier
+from coi_singleflight import get_single_flight
+from coi_records import (
+    COIExclusionIndex,
+    filter_records,
+    merge_records,
+    parse_coi_table,
+    record_zip_codes,
+    records_to_columns,
+    records_to_csv,
+    strip_coi_table,
+)
+from coi_engine import (
+    COI_TYPES,
+    FANOUT_MAX_CONCURRENCY,
+    FANOUT_MAX_QUERIES,
+    MAX_TOTAL_COIS,
+    NEXT_BATCH_SIZE,
+    PATH_A_SECTIONS,
+    cancellation_stats,
+    fanout_queries,
+    local_tables_token_savings,
+    parse_zip_list,
+    run_path_a_sections,
+    run_next_batch,
+    run_path_b_fanout,
+    run_path_b_model,
+    truncation_stats,
+)
 
 # =========================================
 # STREAMLIT CONFIG
@@ -14,11 +55,30 @@ st.set_page_config(
     layout="wide"
 )
 
+# Model calls from this run queue fairly against other sessions' (coi_ratelimit).
+# Fragment reruns and their callbacks run in a fresh context: they set it again.
+_script_ctx = get_script_run_ctx()
+SESSION_ID = _script_ctx.session_id if _script_ctx is not None else ""
+set_session(SESSION_ID)
+
 # --- Environment debug (safe to keep or remove later)
 st.sidebar.write("📦 Environment info")
 st.sidebar.write(f"Python version: {sys.version.split()[0]}")
 st.sidebar.write(f"OpenAI version: {openai.__version__}")
 
+stream_results = st.sidebar.toggle(
+    "Stream results as they are written",
+    value=True,
+    key="stream_results",
+)
+local_report_tables = st.sidebar.toggle(
+    "Render fixed report tables locally",
+    value=True,
+    key="local_report_tables",
+    help="Builds the Client Focus Overview and Priority COI Categories tables in the app "
+         "instead of asking the model to write them.",
+)
+
 # =========================================
 # CUSTOM CSS THEME
 # =========================================
@@ -93,239 +153,475 @@ textarea, input, select { border-radius: 6px !important; }
 st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # =========================================
-# SYSTEM PROMPT (FULL, CLEANED, FLUSH-LEFT)
+# RESULT RENDERING (BACKGROUND JOBS + TIMING)
 # =========================================
 
-SYSTEM_PROMPT = r"""
-You are Centers of Influence Coach GPT for New York Life advisors.
-Your mission is to:
-1) Help advisors quickly find real Centers of Influence (COIs) in their area using live web search.
-2) Guide advisors through a short, simple intake (Path A) to build a COI Intelligence Report and COI list.
-3) Run a Quick COI Lookup (Path B) when advisors want fast, specific search results.
-
-You must follow all logic, rules, workflows, formatting requirements, guardrails, and compliance guidelines
-from the internal file "COI System Rules.txt". This prompt is a compressed but complete version for API use.
-
-GENERAL SCOPE
-- You focus ONLY on COIs and COI strategy.
-- You do NOT provide scripts, full training, or role-plays.
-- You do NOT give product, underwriting, compensation, market, tax, legal, or investment advice.
-- Redirect questions about those topics to NYL internal resources or the Practice Development Team.
-
-TONE AND STYLE
-- Sound like a helpful, succinct colleague.
-- Use short sentences and simple language.
-- Avoid jargon, long paragraphs, and unnecessary detail.
-- Assume many advisors are new to COIs.
-- Use clean tables and clear section headings.
-
-MODES
-You operate in one overarching mode: "Find COIs in my area."
-Within that:
-- Path A — Personalized COI Strategy with COI List
-- Path B — Quick COI Lookup
-
-STREAMLIT CONTEXT
-- The UI already collected answers.
-- DO NOT re-ask questions.
-- Use provided values exactly as if gathered in conversation.
-
-WELCOME BLOCK (REFERENCE ONLY)
-"👋 Welcome. I can help you find Centers of Influence (COIs) in your area and build a tailored COI strategy…"
-
-PATH A — QUESTIONS (already collected by UI)
-Q1 – Main ZIP code
-Q2 – Target segments
-Q3 – Common life events
-Q4 – Communities / affinity groups
-Q5 – Advisor professional background
-Q6 – Warm networks already available
-
-SEGMENT GUIDANCE TABLE
-| Segment                      | Age Range | Typical triggers and needs                                      |
-|-----------------------------|-----------|------------------------------------------------------------------|
-| Young Childfree             | 24–44     | Jobs, relationships, cash-flow changes                          |
-| Young Families              | 25–44     | New baby, home purchase, childcare, education planning          |
-| Mid-Career Families         | 35–54     | Job changes, eldercare, education decisions                     |
-| Affluent Mid-Career Families| 35–54     | Stock comp, higher-value homes, complex taxes                   |
-| Affluent Pre-Retirees       | 55+       | Retirement readiness, downsizing                                |
-| Affluent Retirees           | 65+       | Income stability, healthcare, estate planning                   |
-
-COMMUNITIES / AFFINITIES
-Examples include NYL cultural markets (African American, Chinese, Korean, Latino, South Asian, Vietnamese),
-LGBTQ+, faith communities, immigrant communities, parent groups, alumni networks, civic organizations.
-
-COI INTELLIGENCE REPORT (Path A REQUIRED OUTPUT)
-You MUST output all of the following:
-
-1) CLIENT FOCUS OVERVIEW TABLE
-| Item        | Summary         |
-|-------------|-----------------|
-| Main Area   | [ZIP and area]  |
-| Segments    | [segments]      |
-| Life Events | [events]        |
-| Communities | [communities]   |
-| Background  | [background]    |
-| Networks    | [networks]      |
-
-2) OPPORTUNITY THEMES
-Write 3–5 concise themes linking:
-- Segments
-- Life events
-- Communities
-- Advisor background
-- Warm networks
-
-3) PRIORITY COI CATEGORIES TABLE
-| COI Category                | Why High Priority |
-|----------------------------|-------------------|
-| CPA / Tax Advisor          | Planning and major financial decisions |
-| Mortgage Lender / Broker   | Core during home purchase or relocation |
-| Realtor (family/relocation)| Life events tied to moving, families    |
-| Estate Planning Attorney   | Protection + long-term planning         |
-| Immigration Attorney       | Expats + relocation cases               |
-| Pediatrician / OB-GYN      | Young families + trust relationships    |
-| School Counselor / Principal| Parent networks + school transitions   |
-| Business Banker / RM       | Business owners + professionals         |
-| Business Consultant / Coach| Job changes + career shifts             |
-| Community / Cultural Leader| High-trust networks                     |
-
-4) OPPORTUNITY CHANNELS (2–3 short sentences)
-Describe:
-- Where introductions naturally occur (financial/tax, housing, family, community, profession).
-- How advisor background and networks enhance these opportunities.
-
-COI SEARCH (Path A & B)
-- Focus search on the advisor’s ZIP.
-- If <15 results → broaden geographically.
-- Use professional associations, local directories, schools, hospitals, small business clusters.
-
-FIRST BATCH RULE
-- ALWAYS attempt to deliver 20–25 COIs.
-- If you broaden twice and still have <10, state scarcity clearly.
-
-COI TABLE FORMAT (MANDATORY)
-| Name | Role/Specialty | Organization + Link | Public Contact | Why They Fit |
-
-Public Contact may include:
-- Business phone
-- Public business email
-- LinkedIn URL
-- Contact page
-
-NEVER include personal numbers or private emails.
-
-WHY THEY FIT must connect back to:
-- Segments
-- Life events
-- Communities
-- Advisor background
-- Warm networks
-
-ASK FOR MORE (MANDATORY)
-End every batch with:
-"**Would you like more COIs? I can add more (up to 125 total), or we can finish with your summary.**"
-
-PATH B (Quick Lookup)
-- Skip Intelligence Report.
-- Use ZIP + COI_TYPE + optional context.
-- Return ONLY first batch of 20–25 COIs.
-- Use the same COI table.
-
-FINAL SUMMARY (when advisor declines more COIs)
-- Summarize their focus.
-- Summarize priority COI categories.
-- Summarize intro channels.
-- Report total COIs identified.
-- Offer PDF summary (explain contents).
-
-COMPLIANCE
-- Only share public business information.
-- Avoid prohibited advice categories.
-- Encourage verification of COIs.
-
-END SYSTEM PROMPT.
-"""
+# Searches run as background jobs (coi_jobs); only job ids live in session state.
+# A running job is shown by a fragment that re-polls it this often, so the rest
+# of the page stays interactive and the search survives reruns and path switches.
+JOB_POLL_SECONDS = 0.5
+# How often the grid refreshes its link badges while checks are running.
+VERIFY_POLL_SECONDS = 1.0
 
-# =========================================
-# OPENAI CLIENT
-# =========================================
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def _result_card(text):
+    return f"<div class='result-card'>{text}</div>"
 
 
-# =========================================
-# CHAT COMPLETION HELPER (BROWSING-CAPABLE SEARCH MODEL)
-# =========================================
+def _queue_caption(job):
+    """
+    Where a running job stands: waiting for a search slot, in the rate-limiter queue, or working.
+    """
+    if job.status == QUEUED and job.elapsed() >= JOB_POLL_SECONDS:
+        st.caption("⏳ All search slots are busy — your search starts as soon as one frees up…")
+        return
+    status = get_rate_limiter().queue_status(job.session)
+    if status is None:
+        st.caption(f"⏱️ {job.elapsed():.0f}s elapsed")
+        return
+    position, eta = status
+    st.caption(f"⏳ High demand right now — you are #{position} in the queue, starting in about {eta:.0f}s…")
+
+
+def _start_job(slot, kind, streams, meta, max_concurrency=None):
+    """
+    Submit a search and remember its id (plus what finishing it needs) under slot.
+    A search already running in the slot is cancelled first: nobody will see it.
+    So are follow-up batches for a result set a new first batch replaces.
+    """
+    _cancel_job(slot)
+    if not slot.endswith("_more"):
+        _cancel_job(f"{slot}_more")
+    job = get_job_runner().submit(kind, streams, max_concurrency=max_concurrency)
+    st.session_state[f"{slot}_job"] = job.id
+    st.session_state[f"{slot}_job_meta"] = meta
+
+
+def _job_running(slot) -> bool:
+    return bool(st.session_state.get(f"{slot}_job"))
+
 
-def _run_chat_completion(user_input: str, max_completion_tokens: int) -> str:
+def _cancel_job(slot) -> bool:
     """
-    Wrapper for a web-search-capable model (gpt-4o-mini-search-preview).
-    This model is designed for web search via Chat Completions.
+    Cancel and forget the job in slot. Returns True if a running job was stopped.
     """
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-search-preview",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_input}
-            ],
-            max_completion_tokens=max_completion_tokens,
-        )
-        msg = response.choices[0].message
-        return msg.content or ""
-    except Exception as e:
-        return f"⚠️ Error while calling OpenAI: {e}"
+    runner = get_job_runner()
+    job = runner.get(st.session_state.get(f"{slot}_job"))
+    st.session_state[f"{slot}_job"] = None
+    st.session_state.pop(f"{slot}_job_meta", None)
+    if job is None:
+        return False
+    runner.drop(job.id)
+    return job.cancel()
+
+
+def _leave_path(prefix):
+    """
+    Switching paths cancels the searches of the path being left.
+    """
+    if any([_cancel_job(prefix), _cancel_job(f"{prefix}_more")]):
+        st.session_state[f"{prefix}_more_status"] = None
+        st.toast("🛑 Stopped the search on the path you left.")
+
+
+def _is_repeat_submit(slot, fingerprint) -> bool:
+    """
+    True for a repeat submit of the same form values while that search is still
+    running (a double click); it is ignored instead of starting the search again.
+    Once the search is done (however fast: cache and directory hits take
+    milliseconds), submitting again runs it again.
+    """
+    if st.session_state.get(f"{slot}_submitted") == fingerprint and _job_running(slot):
+        return True
+    st.session_state[f"{slot}_submitted"] = fingerprint
+    return False
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _job_panel(slot, render_live, finish):
+    """
+    Live view of the job in slot. Once it is done, finish(job, meta) stores the
+    result in session state and the whole page reruns to show it.
+    """
+    job = get_job_runner().get(st.session_state.get(f"{slot}_job"))
+    if job is None:
+        st.session_state[f"{slot}_job"] = None
+        st.warning("This search is no longer available — please run it again.")
+        return
+    if job.status == FAILED:
+        st.session_state[f"{slot}_job"] = None
+        get_job_runner().drop(job.id)
+        st.error(f"⚠️ Error while calling OpenAI: {job.error}")
+        return
+    if not job.done:
+        _queue_caption(job)
+        render_live(job)
+        return
+    finish(job, st.session_state.pop(f"{slot}_job_meta", {}))
+    # The result is in the session (coi_store) now; the job's copy is not needed.
+    st.session_state[f"{slot}_job"] = None
+    get_job_runner().drop(job.id)
+    st.rerun()
+
+
+def _live_sections(captions):
+    """
+    render_live for jobs with named sections: partial text when streaming is on,
+    otherwise each section's text once that section is done and a status line
+    (with COI rows found so far) until then.
+    """
+    def render(job):
+        texts = job.texts()
+        finished = job.finished_sections()
+        found_by_section = job.row_counts()
+        for name, caption in captions.items():
+            text = texts.get(name, "")
+            if text and (stream_results or name in finished):
+                st.markdown(_result_card(text), unsafe_allow_html=True)
+                continue
+            found = found_by_section.get(name, 0)
+            if name in finished:
+                st.caption(f"✅ {SECTION_LABELS.get(name, name)} ready")
+            elif found:
+                st.caption(f"🔎 {found} COIs found so far…")
+            else:
+                st.caption(caption)
+    return render
+
+
+def _savings_caption(saved_tokens):
+    if saved_tokens:
+        st.caption(f"🧮 Local report tables saved ~{saved_tokens} completion tokens on this run")
+
+
+def _coi_export(records, key):
+    """
+    Row count plus CSV download for a parsed, deduplicated COI list.
+    """
+    if not records:
+        return
+    st.caption(f"📇 {len(records)} unique COIs in this result")
+    st.download_button(
+        "⬇️ Download COIs (CSV)",
+        data=records_to_csv(records),
+        file_name=f"{key}.csv",
+        mime="text/csv",
+        key=f"{key}_csv",
+    )
 
 
 # =========================================
-# PATH A — Intelligence Report + First COI Batch
+# COI RESULTS GRID
 # =========================================
 
-def run_path_a_model(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks):
-    """
-    Build the COI Intelligence Report and return the first batch of real COIs.
-    """
-    user_input = (
-        "You are running PATH A — Personalized COI Strategy with COI List.\n\n"
-        f"Q1 – Main ZIP code: {q1_zip}\n"
-        f"Q2 – Target segments: {q2_segments}\n"
-        f"Q3 – Common life events: {q3_events}\n"
-        f"Q4 – Communities / affinity groups: {q4_comm}\n"
-        f"Q5 – Advisor background: {q5_background}\n"
-        f"Q6 – Warm networks: {q6_networks}\n\n"
-        "Follow the COI System Rules strictly:\n"
-        "1) Build the full COI Intelligence Report.\n"
-        "2) Then perform browsing and return the first batch of 20–25 real COIs.\n"
-        "3) Use required table format.\n"
-        "4) End with the required question."
+# Parsed COI rows are shown in a data grid instead of a markdown table: the browser
+# only draws the visible rows and sorts them itself, so 125 COIs cost about what 10 do.
+GRID_COLUMN_CONFIG = {
+    "Link": st.column_config.LinkColumn("Link", display_text=r"https?://(?:www\.)?([^/]+)"),
+    "Check": st.column_config.TextColumn(
+        "Check",
+        help="Link check: ✅ reachable · 🔒 site blocks bots · ❌ dead · ⚠️ not reachable right now · "
+             "⏳ checking. ☎️ flags a phone number that is almost certainly fictional.",
+    ),
+    "Why They Fit": st.column_config.TextColumn("Why They Fit", width="large"),
+}
+
+
+def _check_cell(record, checks) -> str:
+    check = checks.get(record.link)
+    parts = [PENDING_BADGE if record.link and check is None else check.badge if check else ""]
+    parts.append(contact_issue(record.contact))
+    return " · ".join(part for part in parts if part)
+
+
+def _coi_table(records, checks=None):
+    """
+    The grid; with checks ({link: LinkCheck or None}) a Check column follows Link.
+    """
+    columns = records_to_columns(records)
+    if checks is not None:
+        with_check = {}
+        for column, values in columns.items():
+            with_check[column] = values
+            if column == "Link":
+                with_check["Check"] = [_check_cell(record, checks) for record in records]
+        columns = with_check
+    st.dataframe(columns, column_config=GRID_COLUMN_CONFIG, hide_index=True)
+
+
+@st.fragment(run_every=VERIFY_POLL_SECONDS)
+def _coi_table_checking(records):
+    """
+    The grid while link checks are running: badges fill in as checks finish,
+    then one full rerun swaps in the static grid.
+    """
+    checks = get_verifier().check(record.link for record in records)
+    _coi_table(records, checks)
+    if all(check is not None for check in checks.values()):
+        st.rerun()
+
+
+def _narrative_card(text, records):
+    """
+    A result as a card. Once its COI rows are parsed they live in the grid, so only
+    the text around the table stays markdown (errors and unparsed output are shown whole).
+    """
+    if records:
+        text = strip_coi_table(text)
+    if text:
+        st.markdown(_result_card(text), unsafe_allow_html=True)
+
+
+@st.fragment
+def _coi_grid(prefix):
+    """
+    Every COI in a path's result set (first batch + follow-ups) with role, organization
+    and ZIP filters. A fragment, so changing a filter reruns only the grid.
+    """
+    records = _all_cois(prefix)
+    if not records:
+        return
+    role_col, org_col, zip_col = st.columns(3)
+    roles = role_col.multiselect(
+        "Role", sorted({record.role for record in records if record.role}), key=f"{prefix}_filter_roles"
+    )
+    organization = org_col.text_input("Organization contains", key=f"{prefix}_filter_org")
+    zip_codes = zip_col.multiselect(
+        "ZIP", sorted({z for record in records for z in record_zip_codes(record)}), key=f"{prefix}_filter_zips"
     )
+    shown = filter_records(records, roles, organization, zip_codes)
+    if len(shown) < len(records):
+        st.caption(f"Showing {len(shown)} of {len(records)} COIs")
+    verifier = get_verifier()
+    if verifier is None:
+        _coi_table(shown)
+        return
+    # Every link is scheduled (not just the filtered rows), so changing a filter finds them done.
+    checks = verifier.check(record.link for record in records)
+    if any(checks.get(record.link, True) is None for record in shown):
+        _coi_table_checking(shown)
+    else:
+        _coi_table(shown, checks)
+
+
+def _keep(slot, value):
+    """
+    Put a result in the shared store (coi_store); the session keeps only the returned ref.
+    """
+    if not value:
+        get_result_store().discard(SESSION_ID, slot)
+        return None
+    if isinstance(value, list):
+        return get_result_store().put_records(SESSION_ID, slot, value)
+    return get_result_store().put(SESSION_ID, slot, value)
 
-    return _run_chat_completion(user_input, max_completion_tokens=2000)
 
+def _kept(ref):
+    """
+    The text behind a ref from _keep, or None once the store has evicted it.
+    """
+    return get_result_store().get(SESSION_ID, ref)
+
+
+def _result_set(prefix):
+    """
+    (first batch, follow-up COIs) for a path, or None once the store has evicted them.
+    """
+    store = get_result_store()
+    records = store.get_records(SESSION_ID, st.session_state[f"{prefix}_records"])
+    more = store.get_records(SESSION_ID, st.session_state[f"{prefix}_more"])
+    if records is None or more is None:
+        return None
+    return records, more
+
+
+def _all_cois(prefix) -> list:
+    result_set = _result_set(prefix)
+    return result_set[0] + result_set[1] if result_set else []
+
+
+def _expired(prefix):
+    """
+    Forget a path's result after the store evicted it (the session sat idle while others
+    needed the memory) and ask for the search again.
+    """
+    st.session_state[f"{prefix}_result"] = None
+    _start_result_set(prefix, [], {})
+    st.info("🧹 These results were cleared to free server memory after a while idle — run the search again.")
+
+
+def _start_result_set(prefix, records, context):
+    """
+    Reset a path's result set after a fresh first batch.
+    context is what follow-up batches search for (the submitted inputs, not the live form).
+    """
+    st.session_state[f"{prefix}_context"] = context
+    st.session_state[f"{prefix}_records"] = _keep(f"{prefix}_records", records)
+    st.session_state[f"{prefix}_more"] = _keep(f"{prefix}_more", [])
+    st.session_state[f"{prefix}_more_status"] = None
+    for name in ("roles", "org", "zips"):
+        st.session_state.pop(f"{prefix}_filter_{name}", None)
 
-# =========================================
-# PATH B — Quick COI Lookup
-# =========================================
 
-def run_path_b_model(zip_code, coi_type, extra_context):
-    """
-    Return ONLY the first batch of 20–25 COIs for the chosen type.
-    """
-    user_input = (
-        "You are running PATH B — Quick COI Lookup.\n\n"
-        f"ZIP code: {zip_code}\n"
-        f"COI type(s): {coi_type}\n"
-        f"Extra context: {extra_context}\n\n"
-        "Follow the COI System Rules.\n"
-        "Skip the Intelligence Report.\n"
-        "Immediately perform browsing and return ONLY:\n"
-        "- First COI batch (20–25 results)\n"
-        "- Required COI table format\n\n"
-        "End with the required line about adding more COIs."
+def _finish_more(job, meta):
+    """
+    Dedupe a finished "next batch" against the session index and append the new COIs.
+    """
+    prefix = meta["prefix"]
+    result_set = _result_set(prefix)
+    if result_set is None:
+        return
+    records, more = result_set
+    text = job.texts()["cois"]
+    parsed = parse_coi_table(text)
+    for record in parsed:
+        record.zip_code = meta["zip_code"]
+    new = COIExclusionIndex(records + more).add(parsed)[:meta["remaining"]]
+    st.session_state[f"{prefix}_more"] = _keep(f"{prefix}_more", more + new)
+    if parsed:
+        status = ("caption", f"➕ Added {len(new)} new COIs · {len(parsed) - len(new)} repeats skipped")
+    elif text.startswith("⚠️"):
+        status = ("warning", text)
+    else:
+        status = ("caption", "No new COIs found in this batch.")
+    st.session_state[f"{prefix}_more_status"] = status
+
+
+def _remaining_cois(prefix) -> int:
+    result_set = _result_set(prefix)
+    if result_set is None:
+        return 0
+    return MAX_TOTAL_COIS - len(result_set[0]) - len(result_set[1])
+
+
+def _load_next_batch(prefix):
+    """
+    on_click for "Load next batch". Callbacks run before the rerun, so the job is
+    already running (and the button disabled) when the section renders.
+    """
+    set_session(SESSION_ID)
+    # Read once: the store may evict the result set at any point (then there is nothing to extend).
+    result_set = _result_set(prefix)
+    if result_set is None or _job_running(f"{prefix}_more"):
+        return
+    records, more = result_set
+    remaining = MAX_TOTAL_COIS - len(records) - len(more)
+    if remaining <= 0:
+        return
+    context = st.session_state[f"{prefix}_context"]
+    digest = COIExclusionIndex(records + more).digest()
+    _start_job(
+        f"{prefix}_more", "more",
+        {"cois": run_next_batch(context, digest, min(NEXT_BATCH_SIZE, remaining), stream=True)},
+        {"prefix": prefix, "remaining": remaining, "zip_code": context.get("ZIP code", "")},
+    )
+
+
+def _more_cois_section(prefix):
+    """
+    "Load next batch" for a path: asks only for NEW COIs (exclusion digest from the
+    session index), dedupes them server-side and appends them to the result set
+    (shown in the path's grid).
+    """
+    slot = f"{prefix}_more"
+
+    if _job_running(slot):
+        _job_panel(slot, _live_sections({"cois": "🔎 Searching for more COIs…"}), _finish_more)
+    elif st.session_state[f"{prefix}_more_status"]:
+        kind, message = st.session_state[f"{prefix}_more_status"]
+        getattr(st, kind)(message)
+
+    st.button(
+        f"➕ Load next batch (up to {MAX_TOTAL_COIS} COIs total)",
+        key=f"{prefix}_more_btn",
+        disabled=_remaining_cois(prefix) <= 0 or _job_running(slot),
+        on_click=_load_next_batch,
+        args=(prefix,),
+    )
+
+
+def _fanout_label(query):
+    zip_code, coi_type = query
+    return f"{zip_code} · {coi_type}"
+
+
+def _merged_fanout(records, total):
+    """
+    Merge {query: records} of the finished lookups into one list, plus its heading.
+    """
+    merged = merge_records((query[0], found) for query, found in records.items())
+    return merged, f"#### Merged COI list — {len(merged)} unique from {len(records)}/{total} lookups"
+
+
+def _live_fanout(job):
+    """
+    render_live for a Path B fan-out: one status line per lookup, plus the merged,
+    deduplicated grid of every lookup finished so far.
+    """
+    texts = job.texts()
+    timing = job.timing()["sections"]
+    counts = job.row_counts()
+    finished = [query for query in texts if query in timing]
+    for query, text in texts.items():
+        rows = counts[query]
+        if query in timing:
+            icon = "⚠️" if text.startswith("⚠️") else "✅"
+            st.caption(f"{icon} {_fanout_label(query)} — {rows} COIs ({timing[query]:.1f}s)")
+        elif rows:
+            st.caption(f"🔎 {_fanout_label(query)} — {rows} COIs so far…")
+        else:
+            st.caption(f"⏳ {_fanout_label(query)}")
+    if finished:
+        merged, heading = _merged_fanout({query: job.records(query) for query in finished}, len(texts))
+        st.markdown(heading)
+        _coi_table(merged)
+
+
+def _finish_path_a(job, meta):
+    sections = job.texts()
+    inputs = meta["inputs"]
+    st.session_state.path_a_result = {name: _keep(f"path_a_{name}", text) for name, text in sections.items()}
+    _start_result_set(
+        "path_a",
+        merge_records([(inputs["ZIP code"], parse_coi_table(sections.get("cois")))]),
+        inputs,
+    )
+    st.session_state.path_a_timing = job.timing()
+    st.session_state.path_a_saved_tokens = meta["saved_tokens"]
+
+
+def _finish_path_b(job, meta):
+    result = job.texts()["cois"]
+    st.session_state.path_b_result = _keep("path_b_result", result)
+    _start_result_set(
+        "path_b", merge_records([(meta["inputs"]["ZIP code"], parse_coi_table(result))]), meta["inputs"]
     )
+    st.session_state.path_b_timing = job.timing()
+
+
+def _finish_fanout(job, meta):
+    texts = job.texts()
+    merged, heading = _merged_fanout({query: parse_coi_table(text) for query, text in texts.items()}, len(texts))
+    st.session_state.path_b_result = _keep("path_b_result", heading)
+    _start_result_set("path_b", merged, meta["inputs"])
+    # Per-lookup seconds were on the live status lines; keep the caption to the totals.
+    timing = job.timing()
+    timing.pop("sections")
+    st.session_state.path_b_timing = timing
+
+
+SECTION_LABELS = {
+    "report": "Intelligence Report",
+    "cois": "COI search",
+}
 
-    return _run_chat_completion(user_input, max_completion_tokens=1500)
+
+def _timing_caption(timing):
+    if timing:
+        caption = f"⏱️ First token in {timing['ttft']:.1f}s · total {timing['total']:.1f}s"
+        for name, seconds in (timing.get("sections") or {}).items():
+            caption += f" · {SECTION_LABELS.get(name, name)} {seconds:.1f}s"
+        st.caption(caption)
 
 # =========================================
 # SESSION STATE
@@ -337,6 +633,78 @@ if "path_a_result" not in st.session_state:
     st.session_state.path_a_result = None
 if "path_b_result" not in st.session_state:
     st.session_state.path_b_result = None
+for _prefix in ("path_a", "path_b"):
+    if f"{_prefix}_records" not in st.session_state:
+        _start_result_set(_prefix, [], {})
+if "path_a_timing" not in st.session_state:
+    st.session_state.path_a_timing = None
+if "path_a_saved_tokens" not in st.session_state:
+    st.session_state.path_a_saved_tokens = None
+if "path_b_timing" not in st.session_state:
+    st.session_state.path_b_timing = None
+
+# Operational counters are for whoever runs the app, not for advisors (COI_ADMIN_PANEL).
+if ADMIN_PANEL:
+    _cache_stats = get_response_cache().stats()
+    st.sidebar.write(
+        f"🗄️ Cache: {_cache_stats['hits']} hits · {_cache_stats['misses']} misses · "
+        f"{_cache_stats['evictions']} evictions"
+    )
+    _flight_stats = get_single_flight().stats()
+    st.sidebar.write(
+        f"🔁 Coalesced calls: {_flight_stats['coalesced']} "
+        f"(of {_flight_stats['leaders'] + _flight_stats['coalesced']} · {_flight_stats['in_flight']} in flight)"
+    )
+    _rate_stats = get_rate_limiter().stats()
+    st.sidebar.write(
+        f"🚦 Rate limiter: {_rate_stats['in_flight']}/{_rate_stats['limit']} in flight · "
+        f"{_rate_stats['waiting']} waiting · {_rate_stats['rate_limited']} × 429"
+    )
+    _job_stats = get_job_runner().stats()
+    st.sidebar.write(f"🧵 Searches: {_job_stats['running']} running · {_job_stats['queued']} queued")
+    _cancel_stats = cancellation_stats()
+    st.sidebar.write(
+        f"🛑 Cancelled calls: {_cancel_stats['cancelled']} · saved up to ~{_cancel_stats['tokens_saved']} tokens, "
+        f"~{_cancel_stats['seconds_saved']:.0f}s"
+    )
+    _directory = get_directory()
+    if _directory is not None:
+        _directory_stats = _directory.stats()
+        st.sidebar.write(
+            f"📚 COI directory: {_directory_stats['entries']} COIs · "
+            f"{_directory_stats['rows_served']} rows served without a search"
+        )
+    _intake_stats = get_intake_index().stats()
+    if _intake_stats["similar"]:
+        st.sidebar.write(
+            f"🧩 Rephrased intakes matched to an earlier one: {_intake_stats['similar']} "
+            f"(of {_intake_stats['lookups']} Path A searches)"
+        )
+    _verifier = get_verifier()
+    if _verifier is not None:
+        _verify_stats = _verifier.stats()
+        if _verify_stats["checked"]:
+            st.sidebar.write(
+                f"🔗 Links checked: {_verify_stats['checked']} · {_verify_stats['dead'] + _verify_stats['invalid']} dead · "
+                f"{_verify_stats['in_flight']} checking"
+            )
+    _store_stats = get_result_store().stats()
+    if _store_stats["sessions"]:
+        st.sidebar.write(
+            f"🗃️ Results held: {_store_stats['bytes'] / 1024:.0f} KB for {_store_stats['sessions']} sessions "
+            f"({_store_stats['raw_bytes'] / 1024:.0f} KB uncompressed) · {_store_stats['evicted_sessions']} idle cleared"
+        )
+    _truncation_stats = truncation_stats()
+    st.sidebar.write(
+        f"✂️ Cut-off answers continued: {_truncation_stats['truncated']} · "
+        f"{_truncation_stats['rows_recovered']} rows recovered"
+    )
+    with st.sidebar.expander("📈 Model calls by path (recent)"):
+        _metric_rows = get_metrics().summary()
+        if _metric_rows:
+            st.dataframe(_metric_rows, hide_index=True)
+        else:
+            st.caption("No model calls yet.")
 
 
 # =========================================
@@ -383,6 +751,8 @@ c1, c2 = st.columns(2)
 
 with c1:
     if st.button("1️⃣ Personalized COI Strategy with COI List", key="select_A"):
+        if st.session_state.selected_path == "B":
+            _leave_path("path_b")
         st.session_state.selected_path = "A"
 
     st.markdown("""
@@ -397,6 +767,8 @@ with c1:
 
 with c2:
     if st.button("2️⃣ Quick COI Lookup", key="select_B"):
+        if st.session_state.selected_path == "A":
+            _leave_path("path_a")
         st.session_state.selected_path = "B"
 
     st.markdown("""
@@ -416,7 +788,12 @@ st.markdown("<div class='section-divider'></div>", unsafe_allow_html=True)
 # PATH A — FULL-WIDTH UI
 # =========================================
 
-if st.session_state.selected_path == "A":
+# Each path section is a fragment: submitting its form, polling its job or
+# loading more COIs reruns only that section, not the CSS, header and path picker.
+
+@st.fragment
+def _path_a_section():
+    set_session(SESSION_ID)
 
     st.markdown("### 1️⃣ Path A — Personalized COI Strategy & First COI Batch")
 
@@ -562,45 +939,165 @@ if st.session_state.selected_path == "A":
         # SUBMIT BUTTON — PATH A
         # ========================
         submit_A = st.form_submit_button("Generate Intelligence Report & First COI Batch")
+        refresh_A = st.form_submit_button("🔄 Refresh (skip cache)")
 
 
     # ====== PROCESS PATH A SUBMISSION ======
-    if submit_A:
+    if submit_A or refresh_A:
         if not q1:
             st.warning("Please enter your main ZIP code before continuing.")
+        elif validate_zip(q1):
+            st.warning(validate_zip(q1))
+        elif _is_repeat_submit("path_a", (q1, q2, q3, q4, q5, q6, refresh_A, local_report_tables)):
+            st.caption("⏳ Already working on this exact request.")
         else:
-            with st.spinner("Generating Intelligence Report and searching for real COIs…"):
-                st.session_state.path_a_result = run_path_a_model(
-                    q1, q2, q3, q4, q5, q6
-                )
+            _start_job(
+                "path_a", "path_a",
+                run_path_a_sections(
+                    q1, q2, q3, q4, q5, q6,
+                    stream=True, use_cache=not refresh_A, local_tables=local_report_tables,
+                ),
+                {
+                    "inputs": {
+                        "ZIP code": q1, "Target segments": q2, "Life events": q3,
+                        "Communities": q4, "Advisor background": q5, "Warm networks": q6,
+                    },
+                    "saved_tokens": (
+                        local_tables_token_savings(q1, q2, q3, q4, q5, q6) if local_report_tables else None
+                    ),
+                },
+            )
+
+    # ====== RUNNING PATH A JOB ======
+    if _job_running("path_a"):
+        st.markdown("### 🧠 Intelligence Report & First COI Batch")
+        _job_panel(
+            "path_a",
+            _live_sections({
+                "report": "🧠 Writing Intelligence Report…",
+                "cois": "🔎 Searching for real COIs…",
+            }),
+            _finish_path_a,
+        )
 
     # ====== DISPLAY PATH A RESULT ======
-    if st.session_state.path_a_result:
-        st.markdown("### 🧠 Intelligence Report & First COI Batch")
-        st.markdown(f"<div class='result-card'>{st.session_state.path_a_result}</div>", unsafe_allow_html=True)
+    elif st.session_state.path_a_result:
+        sections = {name: _kept(ref) for name, ref in st.session_state.path_a_result.items() if ref}
+        result_set = _result_set("path_a")
+        if None in sections.values() or result_set is None:
+            _expired("path_a")
+        else:
+            st.markdown("### 🧠 Intelligence Report & First COI Batch")
+            for name in PATH_A_SECTIONS:
+                _narrative_card(sections.get(name), result_set[0] if name == "cois" else None)
+            _coi_grid("path_a")
+            _timing_caption(st.session_state.path_a_timing)
+            _savings_caption(st.session_state.path_a_saved_tokens)
+
+    # ====== MORE COIs + EXPORT ======
+    if st.session_state.path_a_result and not _job_running("path_a"):
+        _more_cois_section("path_a")
+        _coi_export(_all_cois("path_a"), "path_a_cois")
+
+    _batch_section()
+
+
+# =========================================
+# PATH A — Team batch (CSV)
+# =========================================
+
+def _batch_section():
+    """
+    Path A for a whole team: upload an intake CSV, generate every report in the
+    background (coi_batch), then download the reports and index as one zip.
+    """
+    with st.expander("👥 Reports for a whole team (CSV upload)"):
+        st.caption(
+            "One row per advisor with columns Advisor, ZIP code, Target segments, Life events, "
+            "Communities, Advisor background, Warm networks. Uploading the same file again "
+            "resumes an interrupted batch."
+        )
+        upload = st.file_uploader("Advisor intake CSV", type="csv", key="batch_csv")
+        if upload is None:
+            return
+        data = upload.getvalue()
+        try:
+            rows, problems = read_intake(data.decode("utf-8-sig"))
+        except ValueError as e:
+            st.warning(str(e))
+            return
+        if problems:
+            st.warning("Skipped: " + " ".join(problems))
+        out_dir = os.path.join(BATCH_DIR, batch_id(data))
+        batch = get_batch(out_dir)
+
+        if batch is not None and not batch.done:
+            _batch_progress(out_dir)
+            return
+        st.button(
+            f"Generate {len(rows)} reports",
+            key="batch_start",
+            disabled=not rows,
+            on_click=start_batch,
+            args=(rows, out_dir),
+        )
+        if batch is not None:
+            counts = batch.counts()
+            st.success(f"✅ {counts['done']} of {batch.total} reports ready · {counts['failed']} failed")
+        zip_path = archive_path(out_dir)
+        if zip_path:
+            # Written once when the batch finished; reruns only read it back.
+            with open(zip_path, "rb") as f:
+                st.download_button(
+                    "⬇️ Download reports + index (zip)",
+                    data=f,
+                    file_name=f"coi_reports_{os.path.basename(out_dir)}.zip",
+                    mime="application/zip",
+                    key="batch_zip",
+                )
+
 
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _batch_progress(out_dir):
+    batch = get_batch(out_dir)
+    counts = batch.counts()
+    finished = counts["done"] + counts["failed"]
+    st.progress(
+        finished / max(1, batch.total),
+        text=f"📝 {counts['done']}/{batch.total} reports written · {counts['failed']} failed",
+    )
+    if batch.done:
+        st.rerun()
 
 
 # =========================================
 # PATH B — Quick COI Lookup
 # =========================================
 
-elif st.session_state.selected_path == "B":
+@st.fragment
+def _path_b_section():
+    set_session(SESSION_ID)
 
     st.markdown("### 2️⃣ Path B — Quick COI Lookup")
 
+    multi_b = st.toggle(
+        "Multi-lookup: several COI types and/or ZIP codes at once",
+        key="qb_multi",
+    )
+
     with st.form("path_b_form"):
 
         # ZIP
-        st.markdown("""
+        st.markdown(f"""
         <div class="qblock">
-            <div class="qblock-title">ZIP code</div>
+            <div class="qblock-title">{"ZIP codes" if multi_b else "ZIP code"}</div>
+            {'<div class="qblock-help">Separate ZIP codes with commas or spaces.</div>' if multi_b else ""}
         </div>
         """, unsafe_allow_html=True)
 
         zip_b = st.text_input(
             "",
-            placeholder="e.g., 07302",
+            placeholder="e.g., 07302, 07310, 07030" if multi_b else "e.g., 07302",
             key="qb_zip"
         )
 
@@ -608,30 +1105,26 @@ elif st.session_state.selected_path == "B":
 
 
         # COI TYPE
-        st.markdown("""
+        st.markdown(f"""
         <div class="qblock">
-            <div class="qblock-title">COI Type</div>
+            <div class="qblock-title">{"COI Types" if multi_b else "COI Type"}</div>
+            {f'<div class="qblock-help">Up to {FANOUT_MAX_QUERIES} lookups (ZIP codes × types) run at the same time.</div>' if multi_b else ""}
         </div>
         """, unsafe_allow_html=True)
 
-        coi_type = st.selectbox(
-            "",
-            [
-                "CPA / Tax Advisor",
-                "Estate Planning Attorney",
-                "Immigration Attorney",
-                "Family Law / Divorce Attorney",
-                "Realtor",
-                "Mortgage Lender / Broker",
-                "Pediatrician / OB-GYN",
-                "School / Education Professional",
-                "Business Banker / RM",
-                "Business Consultant / Career Coach",
-                "Community / Cultural Organization",
-                "Other / Mixed COIs",
-            ],
-            key="qb_type"
-        )
+        if multi_b:
+            coi_types_b = st.multiselect(
+                "",
+                COI_TYPES,
+                default=[COI_TYPES[0]],
+                key="qb_types"
+            )
+        else:
+            coi_type = st.selectbox(
+                "",
+                COI_TYPES,
+                key="qb_type"
+            )
 
         st.markdown('<div class="qsep"></div>', unsafe_allow_html=True)
 
@@ -651,28 +1144,88 @@ elif st.session_state.selected_path == "B":
         )
 
         submit_B = st.form_submit_button("Find COIs Now")
+        refresh_B = st.form_submit_button("🔄 Refresh (skip cache)")
 
 
     # ====== PROCESS PATH B SUBMISSION ======
-    if submit_B:
+    if (submit_B or refresh_B) and multi_b:
+        zips_b = parse_zip_list(zip_b)
+        queries = fanout_queries(zips_b, coi_types_b)
+        zip_problems = [problem for problem in map(validate_zip, zips_b) if problem]
+        if not zips_b or not coi_types_b:
+            st.warning("Please enter at least one ZIP code and choose at least one COI type.")
+        elif zip_problems:
+            st.warning(" ".join(zip_problems))
+        elif _is_repeat_submit("path_b", (tuple(queries), ctx, refresh_B)):
+            st.caption("⏳ Already working on this exact request.")
+        else:
+            if len(zips_b) * len(coi_types_b) > len(queries):
+                st.warning(f"Only the first {FANOUT_MAX_QUERIES} ZIP × type lookups will run.")
+            for query_zip, query_type in queries:
+                record_lookup(query_zip, query_type, ctx)
+            _start_job(
+                "path_b", "fanout",
+                run_path_b_fanout(zips_b, coi_types_b, ctx, stream=True, use_cache=not refresh_B),
+                {
+                    "inputs": {
+                        "ZIP code": ", ".join(zips_b),
+                        "COI type(s)": ", ".join(coi_types_b),
+                        "Extra context": ctx,
+                    },
+                },
+                max_concurrency=FANOUT_MAX_CONCURRENCY,
+            )
+    elif submit_B or refresh_B:
         if not zip_b:
             st.warning("Please enter a ZIP code.")
+        elif validate_zip(zip_b):
+            st.warning(validate_zip(zip_b))
+        elif _is_repeat_submit("path_b", (((zip_b, coi_type),), ctx, refresh_B)):
+            st.caption("⏳ Already working on this exact request.")
         else:
-            with st.spinner("Searching for real COIs…"):
-                st.session_state.path_b_result = run_path_b_model(
-                    zip_b, coi_type, ctx
-                )
+            record_lookup(zip_b, coi_type, ctx)
+            _start_job(
+                "path_b", "path_b",
+                {"cois": run_path_b_model(zip_b, coi_type, ctx, stream=True, use_cache=not refresh_B)},
+                {"inputs": {"ZIP code": zip_b, "COI type(s)": coi_type, "Extra context": ctx}},
+            )
+
+    # ====== RUNNING PATH B JOB ======
+    if _job_running("path_b"):
+        job = get_job_runner().get(st.session_state.path_b_job)
+        if job is not None and job.kind == "fanout":
+            st.markdown("### 📋 COI List — Multi Lookup")
+            _job_panel("path_b", _live_fanout, _finish_fanout)
+        else:
+            st.markdown("### 📋 COI List — First Batch")
+            _job_panel("path_b", _live_sections({"cois": "🔎 Searching for real COIs…"}), _finish_path_b)
 
     # ====== DISPLAY PATH B RESULT ======
-    if st.session_state.path_b_result:
-        st.markdown("### 📋 COI List — First Batch")
-        st.markdown(f"<div class='result-card'>{st.session_state.path_b_result}</div>", unsafe_allow_html=True)
+    elif st.session_state.path_b_result:
+        result = _kept(st.session_state.path_b_result)
+        result_set = _result_set("path_b")
+        if result is None or result_set is None:
+            _expired("path_b")
+        else:
+            st.markdown("### 📋 COI List — First Batch")
+            _narrative_card(result, result_set[0])
+            _coi_grid("path_b")
+            _timing_caption(st.session_state.path_b_timing)
+
+    # ====== MORE COIs + EXPORT ======
+    if st.session_state.path_b_result and not _job_running("path_b"):
+        _more_cois_section("path_b")
+        _coi_export(_all_cois("path_b"), "path_b_cois")
 
 
 
 # =========================================
-# DEFAULT VIEW IF NO PATH SELECTED
+# ACTIVE PATH (DEFAULT VIEW IF NO PATH SELECTED)
 # =========================================
 
+if st.session_state.selected_path == "A":
+    _path_a_section()
+elif st.session_state.selected_path == "B":
+    _path_b_section()
 else:
     st.write("Choose **Path 1** or **Path 2** above to begin.")
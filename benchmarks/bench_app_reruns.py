@@ -0,0 +1,272 @@
+"""
+Per-interaction cost of the Streamlit UI: script time and bytes sent to the browser.
+
+Starts the app under `streamlit run` against a local OpenAI-compatible stub,
+drives it over the real websocket protocol (the same BackMsg / ForwardMsg
+protobufs the browser exchanges) and, for each interaction, records:
+
+- seconds from sending the rerun request to the server's script_finished
+- bytes of ForwardMsg frames the server sent for it (uncompressed)
+- whether the server reran the whole script or a single fragment
+
+Compare two versions of the app by pointing --app at an older copy, e.g.
+
+    git show <rev>:app.py > /tmp/app_before.py   (copy the coi_*.py / data next to it)
+    python benchmarks/bench_app_reruns.py --app /tmp/app_before.py
+    python benchmarks/bench_app_reruns.py
+
+Needs the `websockets` package (installed with Streamlit's server dependencies).
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from websockets.sync.client import connect
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from stub_openai import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FINISHED = ForwardMsg.ScriptFinishedStatus
+DONE_STATUSES = (
+    FINISHED.FINISHED_SUCCESSFULLY,
+    FINISHED.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+    FINISHED.FINISHED_WITH_COMPILE_ERROR,
+)
+
+
+# =========================================
+# APP SERVER + WEBSOCKET CLIENT
+# =========================================
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch_app(app_path, base_url):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=base_url,
+        COI_CACHE_DB="",
+        COI_DIRECTORY_DB="",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", app_path,
+         "--server.headless", "true", "--server.port", str(port),
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+        cwd=os.path.dirname(os.path.abspath(app_path)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("streamlit did not start")
+
+
+class AppClient:
+    """
+    Just enough of the browser side of the protocol: widget state and reruns.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}        # widget id -> (element type, label, fragment id)
+        self.values = {}         # widget id -> WidgetState with its current value
+        self.fragments = set()   # fragments that asked to be auto-rerun
+
+    def widget(self, key=None, label=None):
+        for widget_id, (_kind, widget_label, fragment_id) in self.widgets.items():
+            if (key and widget_id.endswith(f"-{key}")) or (label and widget_label == label):
+                return widget_id, fragment_id
+        raise KeyError(key or label)
+
+    def set_text(self, key, value):
+        widget_id, _fragment = self.widget(key=key)
+        state = self.values.setdefault(widget_id, BackMsg().rerun_script.widget_states.widgets.add())
+        state.id = widget_id
+        state.string_value = value
+
+    def rerun(self, trigger=None, fragment_id="", auto=False):
+        """
+        Send one rerun and read until it finishes. Returns (seconds, bytes, kind).
+        """
+        msg = BackMsg()
+        client = msg.rerun_script
+        client.query_string = ""
+        client.page_script_hash = ""
+        client.fragment_id = fragment_id
+        client.is_auto_rerun = auto
+        for state in self.values.values():
+            client.widget_states.widgets.add().CopyFrom(state)
+        if trigger is not None:
+            state = client.widget_states.widgets.add()
+            state.id = trigger
+            state.trigger_value = True
+
+        start = time.perf_counter()
+        self.ws.send(msg.SerializeToString())
+        received = 0
+        full = False
+        while True:
+            frame = self.ws.recv()
+            received += len(frame)
+            forward = ForwardMsg()
+            forward.ParseFromString(frame)
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                # A rerun requested mid-run (st.rerun) starts a new one; report the last.
+                full = not forward.new_session.fragment_ids_this_run
+            elif kind == "delta":
+                self._register(forward.delta)
+            elif kind == "auto_rerun":
+                self.fragments.add(forward.auto_rerun.fragment_id)
+            elif kind == "script_finished" and forward.script_finished in DONE_STATUSES:
+                return time.perf_counter() - start, received, "full" if full else "fragment"
+
+    def _register(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind, None)
+        widget_id = getattr(proto, "id", "")
+        if widget_id:
+            self.widgets[widget_id] = (kind, getattr(proto, "label", ""), delta.fragment_id)
+
+    def wait_for_jobs(self, fragment_id, timeout=60):
+        """
+        Poll a running-job fragment the way the browser does, until the app reruns in full.
+        Returns the per-poll samples and the final full run.
+        """
+        polls = []
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            sample = self.rerun(fragment_id=fragment_id, auto=True)
+            if sample[2] == "full":
+                return polls, sample
+            polls.append(sample)
+        raise TimeoutError("search job did not finish")
+
+
+# =========================================
+# SCENARIO
+# =========================================
+
+def _job_fragment(client, before):
+    new = client.fragments - before
+    return next(iter(new)) if new else ""
+
+
+def run_scenario(app_path, base_url):
+    process, port = launch_app(app_path, base_url)
+    results = []
+    try:
+        with connect(
+            f"ws://127.0.0.1:{port}/_stcore/stream",
+            subprotocols=["streamlit"],
+            origin=f"http://127.0.0.1:{port}",
+            max_size=None,
+        ) as ws:
+            _drive(AppClient(ws), results)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return results
+
+
+def _drive(client, results):
+    """
+    Select Path B, submit a lookup, wait for it, then load the next batch.
+    """
+    def record(name, sample):
+        seconds, size, kind = sample
+        results.append({"interaction": name, "seconds": seconds, "bytes": size, "rerun": kind})
+
+    record("initial load", client.rerun())
+    select_b, frag = client.widget(key="select_B")
+    record("select Path B", client.rerun(trigger=select_b, fragment_id=frag))
+
+    client.set_text("qb_zip", "07302")
+    submit, frag = client.widget(label="Find COIs Now")
+    known = set(client.fragments)
+    record("submit Path B", client.rerun(trigger=submit, fragment_id=frag))
+    polls, final = client.wait_for_jobs(_job_fragment(client, known))
+    for poll in polls:
+        record("job poll", poll)
+    record("show result", final)
+
+    more, frag = client.widget(key="path_b_more_btn")
+    known = set(client.fragments)
+    record("load next batch", client.rerun(trigger=more, fragment_id=frag))
+    job_fragment = _job_fragment(client, known)
+    if job_fragment:
+        polls, final = client.wait_for_jobs(job_fragment)
+        for poll in polls:
+            record("job poll", poll)
+        record("show next batch", final)
+
+
+def summarize(results):
+    rows = {}
+    for result in results:
+        rows.setdefault(result["interaction"], []).append(result)
+    summary = []
+    for name, samples in rows.items():
+        summary.append({
+            "interaction": name,
+            "count": len(samples),
+            "rerun": samples[-1]["rerun"],
+            "median_ms": round(statistics.median(s["seconds"] for s in samples) * 1000, 1),
+            "median_bytes": int(statistics.median(s["bytes"] for s in samples)),
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--repeat", type=int, default=3, help="fresh sessions to run the scenario in")
+    parser.add_argument("--rows", type=int, default=25, help="COI rows per stub response")
+    parser.add_argument("--json", help="also write the raw samples here")
+    args = parser.parse_args()
+
+    base_url = StubServer(tokens_per_second=400, rows=args.rows).start().base_url
+    results = []
+    for _ in range(args.repeat):
+        results.extend(run_scenario(args.app, base_url))
+
+    print(f"{'interaction':<18} {'n':>3} {'rerun':>9} {'median ms':>10} {'median bytes':>13}")
+    for row in summarize(results):
+        print(
+            f"{row['interaction']:<18} {row['count']:>3} {row['rerun']:>9} "
+            f"{row['median_ms']:>10.1f} {row['median_bytes']:>13,}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"app": args.app, "samples": results, "summary": summarize(results)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
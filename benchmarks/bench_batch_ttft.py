@@ -0,0 +1,166 @@
+"""
+Benchmark an advisor's time to first token while a batch upload runs.
+
+    python benchmarks/bench_batch_ttft.py [--rows 40] [--advisors 6] [--searches 3] [--ttft 1] [--tokens-per-second 150]
+
+A --rows intake batch runs against the local stub (stub_openai.py) while
+--advisors advisors each submit --searches Path A searches through the job
+runner, one after another, as the app does (report and COI list streamed side
+by side). Time to first token is measured from submit to the first COI-list
+text the job receives (the report opens with locally rendered tables), so it
+includes any wait for a pool thread.
+
+1. Shared pool (as before): the batch rows call run_path_a_model without an
+   executor, so their report and COI calls take coi_engine's shared pool.
+2. Batch pool (now): coi_batch.BatchRun, whose calls run on its own pool.
+
+Rate limits and the limiter's concurrency are set high so what is measured is
+the wait for threads, not for the limiter; the batch runs 8 rows at a time
+(COI_BATCH_CONCURRENCY). Every search has its own answers, so none is a cache hit.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_openai import StubServer  # noqa: E402
+
+ADVISOR_ZIPS = ("07302", "10001", "07030", "11201", "08540", "19103", "02139", "60614", "94105", "30301")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=40, help="intake rows in the batch")
+    parser.add_argument("--advisors", type=int, default=6, help="advisors searching during the batch")
+    parser.add_argument("--searches", type=int, default=3, help="Path A searches per advisor")
+    parser.add_argument("--ttft", type=float, default=1.0)
+    parser.add_argument("--tokens-per-second", type=float, default=150.0)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+WORKDIR = tempfile.mkdtemp(prefix="coi-bench-")
+STUB = StubServer(ttft=ARGS.ttft, tokens_per_second=ARGS.tokens_per_second).start()
+# Read at import by the app modules, so set before importing them.
+os.environ.update(
+    OPENAI_BASE_URL=STUB.base_url,
+    OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "bench"),
+    COI_CACHE_DB="",
+    COI_DIRECTORY_DB="",
+    COI_USAGE_DB="",
+    COI_METRICS_LOG="",
+    COI_RPM="100000",
+    COI_TPM="100000000",
+    COI_MAX_CONCURRENCY="64",
+    COI_BATCH_CONCURRENCY=os.getenv("COI_BATCH_CONCURRENCY", "8"),
+)
+
+from coi_batch import BATCH_CONCURRENCY, BatchRun, read_intake  # noqa: E402
+from coi_engine import MAX_WORKERS, run_path_a_model, run_path_a_sections  # noqa: E402
+from coi_jobs import get_job_runner  # noqa: E402
+from coi_metrics import percentile  # noqa: E402
+from coi_ratelimit import set_session  # noqa: E402
+
+
+def intake_rows(count, tag):
+    lines = ["Advisor,ZIP code,Target segments,Life events,Communities,Advisor background,Warm networks"]
+    lines += [
+        f"Advisor {tag}-{i},{ADVISOR_ZIPS[i % len(ADVISOR_ZIPS)]},Young families {tag}-{i},new baby,"
+        f"Parents group,Former CPA,Alumni {i}"
+        for i in range(count)
+    ]
+    rows, _problems = read_intake("\n".join(lines))
+    return rows
+
+
+def shared_pool_batch(rows, _out_dir):
+    """
+    The batch as it ran before: run_path_a_model on the shared pool.
+    """
+    set_session("batch:shared")
+
+    def run_row(row):
+        run_path_a_model(
+            row["zip"], row["segments"], row["events"], row["communities"], row["background"], row["networks"],
+        )
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+        list(pool.map(run_row, rows))
+
+
+def own_pool_batch(rows, out_dir):
+    BatchRun(rows, out_dir).run()
+
+
+def advisor_ttfts(advisor, tag, batch_thread, ttfts):
+    """
+    Path A searches by one advisor while the batch runs; appends their TTFTs.
+    """
+    set_session(f"advisor:{tag}-{advisor}")
+    runner = get_job_runner()
+    for i in range(ARGS.searches):
+        if not batch_thread.is_alive():
+            return
+        zip_code = ADVISOR_ZIPS[(advisor + i) % len(ADVISOR_ZIPS)]
+        streams = run_path_a_sections(
+            zip_code, f"Doctors {tag}-{advisor}-{i}", "relocation", "Alumni", "Former banker", "PTA", stream=True,
+        )
+        job = runner.submit("path_a", streams)
+        first = None
+        while not job.done:
+            if first is None and job.texts()["cois"]:
+                first = time.monotonic() - job.created
+            time.sleep(0.01)
+        if first is not None:
+            ttfts.append(first)
+
+
+def scenario(label, run_batch, tag):
+    rows = intake_rows(ARGS.rows, tag)
+    out_dir = os.path.join(WORKDIR, tag)
+    batch = threading.Thread(target=run_batch, args=(rows, out_dir), daemon=True)
+    started = time.monotonic()
+    batch.start()
+    time.sleep(ARGS.ttft + 0.5)  # let the batch fill its threads
+    ttfts = []
+    advisors = [
+        threading.Thread(target=advisor_ttfts, args=(advisor, tag, batch, ttfts)) for advisor in range(ARGS.advisors)
+    ]
+    for advisor in advisors:
+        advisor.start()
+    for advisor in advisors:
+        advisor.join()
+    batch.join()
+    seconds = time.monotonic() - started
+    if not ttfts:
+        print(f"  {label:<24} batch finished before any lookup ran; raise --rows")
+        return None
+    print(
+        f"  {label:<24} advisor TTFT p50 {percentile(ttfts, 0.5):5.2f}s · p95 {percentile(ttfts, 0.95):5.2f}s "
+        f"({len(ttfts)} searches) · batch of {len(rows)} took {seconds:5.1f}s"
+    )
+    return percentile(ttfts, 0.95)
+
+
+def main():
+    print(
+        f"Advisor Path A TTFT, {ARGS.advisors} advisors during a {ARGS.rows}-row batch (shared pool {MAX_WORKERS} threads, "
+        f"batch concurrency {BATCH_CONCURRENCY}, stub TTFT {ARGS.ttft}s):"
+    )
+    before = scenario("shared pool (as before)", shared_pool_batch, "shared")
+    after = scenario("batch pool (now)", own_pool_batch, "own")
+    if before and after:
+        print(f"  → advisor p95 TTFT {before / after:.1f}x faster")
+    STUB.stop()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
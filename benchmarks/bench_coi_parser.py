@@ -0,0 +1,102 @@
+"""
+Benchmark the COI table parser on a large (125-row) model response.
+
+    python benchmarks/bench_coi_parser.py [--rows 125] [--repeat 200]
+
+Reports full-text and streamed parse time, and memory per record
+(slots-based COIRecord vs. a plain dict per row).
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coi_records import COITableParser, parse_coi_table  # noqa: E402
+
+
+def make_response(rows: int) -> str:
+    lines = [
+        "#### 2) Opportunity Themes",
+        "- Young families relocating for tech jobs.",
+        "",
+        "| Name | Role/Specialty | Organization + Link | Public Contact | Why They Fit |",
+        "|------|----------------|---------------------|----------------|--------------|",
+    ]
+    for i in range(rows):
+        lines.append(
+            f"| Jordan Example {i} | CPA, small business tax | "
+            f"[Example Tax Group {i}](https://www.example-tax-{i}.com/team) | "
+            f"(201) 555-{i:04d} / linkedin.com/in/example{i} | "
+            "Serves young families and owners with stock comp near the advisor's ZIP |"
+        )
+    lines.append("")
+    lines.append("**Would you like more COIs? I can add more (up to 125 total), or we can finish with your summary.**")
+    return "\n".join(lines)
+
+
+def deltas(text: str, size: int = 4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def stream_parse(chunks):
+    parser = COITableParser()
+    for delta in chunks:
+        parser.feed(delta)
+    parser.close()
+    return parser.records
+
+
+def memory_per_row(build, rows: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size / rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=125)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    text = make_response(args.rows)
+    chunks = deltas(text)
+    assert len(parse_coi_table(text)) == args.rows
+    assert len(stream_parse(chunks)) == args.rows
+
+    full = bench(lambda: parse_coi_table(text), args.repeat)
+    streamed = bench(lambda: stream_parse(chunks), args.repeat)
+
+    slots_bytes = memory_per_row(lambda: parse_coi_table(text), args.rows)
+    dict_bytes = memory_per_row(
+        lambda: [
+            dict(zip(("name", "role", "organization", "link", "contact", "why"), r.to_row()))
+            for r in parse_coi_table(text)
+        ],
+        args.rows,
+    )
+
+    print(f"rows:                 {args.rows} ({len(text):,} chars, {len(chunks):,} stream deltas)")
+    print(f"full parse:           {full * 1000:.3f} ms  ({args.rows / full:,.0f} rows/s)")
+    print(f"stream parse:         {streamed * 1000:.3f} ms  ({args.rows / streamed:,.0f} rows/s)")
+    print(f"memory / row (slots): {slots_bytes:,.0f} B (incl. strings)")
+    print(f"memory / row (dict):  {dict_bytes:,.0f} B (incl. strings)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Load test: N concurrent simulated advisors against the local OpenAI stub.
+
+    python benchmarks/bench_load.py --advisors 20
+    python benchmarks/bench_load.py --mode ui --advisors 8
+    python benchmarks/bench_load.py --advisors 50 --ttft 1 --tokens-per-second 150 --rate-limit-fraction 0.05
+
+engine mode calls the model layer directly: each advisor is one thread with
+its own rate-limiter session that runs Path B (run_path_b_model) or Path A
+(run_path_a_model), then --more follow-up batches. ui mode runs the whole app
+per advisor through Streamlit's AppTest: pick the path, fill in the form,
+submit, rerun every --poll seconds until the background job has finished,
+then load the next batch the same way. AppTest swaps a process-wide mock
+runtime in for each script run, so script runs take turns under one lock
+(under the GIL a real server's reruns mostly take turns too); the model calls
+behind them still run side by side in the app's job threads. The time of
+every script run is reported as "script run".
+
+Every advisor sends its own query (no cache hits, no coalescing) unless
+--same-query is given. The COI directory is off unless --directory names a
+SQLite file for it; advisors share 8 ZIPs, so with it on later searches in a
+ZIP are answered from what earlier ones found. The app's own knobs (COI_RPM, COI_MAX_CONCURRENCY,
+COI_JOB_WORKERS, ...) are read from the environment as usual.
+
+Reports throughput, p50/p95/p99 latency per call (total and time to first
+text; ui mode times whole steps, so there the two match), errors, the stub's 429s, the rate limiter's counters and memory per
+session (RSS growth while all sessions are alive, divided by N). Each run is
+saved as JSON under benchmarks/results/ and compared with the last saved run
+that used the same settings.
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set before the app modules read their config: memory-only response cache, no COI
+# directory (every lookup reaches the stub), no metrics log.
+os.environ["COI_CACHE_DB"] = ""
+os.environ["COI_DIRECTORY_DB"] = ""
+os.environ["COI_METRICS_LOG"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from coi_metrics import percentile  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+ERROR_MARK = "⚠️ Error while calling OpenAI"
+# Samples that stand for a model-backed step (the rest are page loads and script runs).
+MODEL_CALLS = ("A", "B", "more")
+
+ZIP_CODES = ("07302", "10001", "07030", "11201", "08540", "19103", "02139", "60614")
+COI_TYPE = "CPA / Tax Advisor"
+PATH_A_ANSWERS = (
+    "Young Families; small business owners", "new baby, relocation",
+    "French expat community", "Former CPA", "alumni association; daycare parents",
+)
+
+# Run settings that must match for two runs to be compared.
+SETTINGS = (
+    "mode", "advisors", "rounds", "scenario", "more", "stream", "same_query", "directory",
+    "ttft", "tokens_per_second", "rate_limit_fraction", "capacity",
+)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _path_for(advisor, args) -> str:
+    if args.scenario == "mixed":
+        return "B" if advisor % 2 == 0 else "A"
+    return args.scenario.upper()
+
+
+def _query(advisor, round_no, args):
+    """
+    (zip, extra context) for one advisor's search; identical for everyone with --same-query.
+    """
+    if args.same_query:
+        return ZIP_CODES[0], "load test"
+    return ZIP_CODES[advisor % len(ZIP_CODES)], f"load test advisor {advisor} round {round_no}"
+
+
+# =========================================
+# ENGINE MODE
+# =========================================
+
+def _timed_call(samples, advisor, call, produce, stream):
+    """
+    Run one model call and append its sample; returns the answer text.
+    """
+    from coi_engine import interleave_streams, join_path_a_sections
+
+    started = time.perf_counter()
+    first = None
+    if stream:
+        streams = produce()
+        if isinstance(streams, dict):
+            # Path A sections, drained side by side as the app's job runner does.
+            parts = {name: [] for name in streams}
+            for name, delta in interleave_streams(streams):
+                if delta is None:
+                    continue
+                if first is None and delta:
+                    first = time.perf_counter() - started
+                parts[name].append(delta)
+            text = join_path_a_sections({name: "".join(texts) for name, texts in parts.items()})
+        else:
+            parts = []
+            for delta in streams:
+                if first is None and delta:
+                    first = time.perf_counter() - started
+                parts.append(delta)
+            text = "".join(parts)
+    else:
+        text = produce()
+    seconds = time.perf_counter() - started
+    samples.append({
+        "advisor": advisor, "call": call, "seconds": seconds,
+        "ttft": seconds if first is None else first,
+        "chars": len(text), "error": ERROR_MARK in text,
+    })
+    return text
+
+
+def engine_advisor(advisor, args, samples, held):
+    from coi_engine import run_next_batch, run_path_a_model, run_path_a_sections, run_path_b_model
+    from coi_ratelimit import set_session
+    from coi_records import COIExclusionIndex, parse_coi_table
+
+    set_session(f"advisor-{advisor}")
+    for round_no in range(args.rounds):
+        zip_code, context = _query(advisor, round_no, args)
+        path = _path_for(advisor, args)
+        if path == "B":
+            text = _timed_call(samples, advisor, "B", lambda: run_path_b_model(
+                zip_code, COI_TYPE, context, stream=args.stream,
+            ), args.stream)
+        else:
+            answers = (zip_code, *PATH_A_ANSWERS[:-1], f"{PATH_A_ANSWERS[-1]}; {context}")
+            text = _timed_call(samples, advisor, "A", lambda: (
+                run_path_a_sections(*answers, stream=True) if args.stream else run_path_a_model(*answers)
+            ), args.stream)
+        index = COIExclusionIndex(parse_coi_table(text))
+        for _ in range(args.more):
+            text = _timed_call(samples, advisor, "more", lambda: run_next_batch(
+                {"ZIP code": zip_code, "COI type(s)": COI_TYPE, "Extra context": context},
+                index.digest(), stream=args.stream,
+            ), args.stream)
+            index.add(parse_coi_table(text))
+        # What a session keeps between requests: the records found so far.
+        held.append(index)
+
+
+# =========================================
+# UI MODE (AppTest)
+# =========================================
+
+def _wait_for_job(at, slot, args):
+    """
+    Rerun like the app's auto-refresh until the slot's job is gone; returns the number of polls.
+    """
+    polls = 0
+    deadline = time.monotonic() + args.timeout
+    while at.session_state[f"{slot}_job"] if f"{slot}_job" in at.session_state else False:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{slot} job still running after {args.timeout}s")
+        time.sleep(args.poll)
+        at.run()
+        polls += 1
+    return polls
+
+
+_SCRIPT_LOCK = threading.Lock()
+
+
+def _serial_app_test(script_path, timeout, samples, advisor):
+    """
+    An AppTest whose script runs take turns and are each recorded in samples.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    class SerialAppTest(AppTest):
+        def _run(self, widget_state=None, timeout=None):
+            with _SCRIPT_LOCK:
+                started = time.perf_counter()
+                try:
+                    return super()._run(widget_state, timeout)
+                finally:
+                    seconds = time.perf_counter() - started
+                    samples.append({
+                        "advisor": advisor, "call": "script run", "seconds": seconds, "ttft": seconds,
+                        "error": False,
+                    })
+
+    return SerialAppTest(script_path, default_timeout=timeout)
+
+
+def _submit(at):
+    next(b for b in at.button if "FormSubmitter" in str(b.key)).click().run()
+
+
+def ui_advisor(advisor, args, samples, held):
+    # The app's empty widget labels log a warning with a stack trace on every run.
+    logging.disable(logging.WARNING)
+
+    def step(call, action, slot):
+        started = time.perf_counter()
+        action()
+        polls = _wait_for_job(at, slot, args) if slot else 0
+        seconds = time.perf_counter() - started
+        samples.append({
+            "advisor": advisor, "call": call, "seconds": seconds, "ttft": seconds, "polls": polls,
+            "error": bool(at.exception) or any(ERROR_MARK in str(e.value) for e in at.error),
+        })
+
+    at = _serial_app_test(os.path.join(ROOT, "app.py"), args.timeout, samples, advisor)
+    step("page load", at.run, None)
+    if not args.stream:
+        at.sidebar.toggle[0].set_value(False).run()
+    for round_no in range(args.rounds):
+        zip_code, context = _query(advisor, round_no, args)
+        if _path_for(advisor, args) == "B":
+            slot = "path_b"
+            at.button(key="select_B").click().run()
+            at.text_input(key="qb_zip").set_value(zip_code)
+            at.text_area(key="qb_ctx").set_value(context)
+        else:
+            slot = "path_a"
+            at.button(key="select_A").click().run()
+            at.text_input(key="qa_zip").set_value(zip_code)
+            at.text_area(key="qa_networks").set_value(f"{PATH_A_ANSWERS[-1]}; {context}")
+        step(slot[-1].upper(), lambda: _submit(at), slot)
+        for _ in range(args.more):
+            step("more", lambda: at.button(key=f"{slot}_more_btn").click().run(), f"{slot}_more")
+    held.append(at)
+
+
+# =========================================
+# RUN + REPORT
+# =========================================
+
+def run(args):
+    stub = StubServer(
+        ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+        rate_limit_fraction=args.rate_limit_fraction, capacity=args.capacity,
+        retry_after=args.retry_after, jitter=args.jitter, seed=1,
+    ).start()
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+    advisor_fn = ui_advisor if args.mode == "ui" else engine_advisor
+
+    # Warm up imports, the client and (ui) the first script compile outside the measurement.
+    warm_args = argparse.Namespace(**dict(vars(args), rounds=1, more=0, same_query=False))
+    advisor_fn(-1, warm_args, [], [])
+    from coi_ratelimit import get_rate_limiter
+    stub_before = dict(stub.stats)
+    limiter_before = get_rate_limiter().stats()
+    samples, held, failures = [], [], []
+    rss_before = _rss_bytes()
+
+    def advisor_thread(advisor):
+        try:
+            advisor_fn(advisor, args, samples, held)
+        except Exception as e:
+            failures.append(f"advisor {advisor}: {type(e).__name__}: {e}")
+
+    threads = [
+        threading.Thread(target=advisor_thread, args=(i,), name=f"advisor-{i}") for i in range(args.advisors)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    rss_after = _rss_bytes()
+
+    stub_stats = {key: value - stub_before.get(key, 0) for key, value in stub.stats.items()}
+    stub_stats["max_in_flight"] = stub.stats["max_in_flight"]
+    stub.stop()
+    limiter_stats = get_rate_limiter().stats()
+    for key in ("granted", "queued", "rate_limited", "wait_seconds"):
+        limiter_stats[key] = round(limiter_stats[key] - limiter_before[key], 3)
+    return {
+        "run": {
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "settings": {name: getattr(args, name) for name in SETTINGS},
+        },
+        "wall_seconds": round(wall, 3),
+        "advisors_completed": args.advisors - len(failures),
+        "failures": failures,
+        "throughput": {
+            "advisors_per_second": round((args.advisors - len(failures)) / wall, 3),
+            "calls_per_second": round(sum(1 for s in samples if s["call"] in MODEL_CALLS) / wall, 3),
+            "upstream_requests_per_second": round(stub_stats["requests"] / wall, 3),
+            "completion_tokens_per_second": round(stub_stats["completion_tokens"] / wall, 1),
+        },
+        "calls": summarize(samples),
+        "memory": {
+            "rss_before_mb": round(rss_before / 2**20, 1),
+            "rss_after_mb": round(rss_after / 2**20, 1),
+            "per_session_kb": round(max(0, rss_after - rss_before) / max(1, len(held)) / 1024, 1),
+        },
+        "stub": stub_stats,
+        "rate_limiter": limiter_stats,
+    }
+
+
+def summarize(samples) -> list:
+    by_call = {}
+    for sample in samples:
+        by_call.setdefault(sample["call"], []).append(sample)
+    rows = []
+    for call, items in by_call.items():
+        seconds = [s["seconds"] for s in items]
+        ttfts = [s["ttft"] for s in items]
+        row = {
+            "call": call,
+            "count": len(items),
+            "errors": sum(1 for s in items if s["error"]),
+            "p50_s": percentile(seconds, 0.5, 3),
+            "p95_s": percentile(seconds, 0.95, 3),
+            "p99_s": percentile(seconds, 0.99, 3),
+            "p50_ttft_s": percentile(ttfts, 0.5, 3),
+            "p95_ttft_s": percentile(ttfts, 0.95, 3),
+        }
+        if "polls" in items[0]:
+            row["mean_polls"] = round(sum(s["polls"] for s in items) / len(items), 1)
+        rows.append(row)
+    return rows
+
+
+def save(result, results_dir) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    settings = result["run"]["settings"]
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(results_dir, f"load-{stamp}-{settings['mode']}-n{settings['advisors']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def previous_run(result, results_dir):
+    """
+    The newest saved run with the same settings, or None.
+    """
+    for path in sorted(glob.glob(os.path.join(results_dir, "load-*.json")), reverse=True):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved["run"]["settings"] == result["run"]["settings"]:
+            return path, saved
+    return None
+
+
+def _change(before, after) -> str:
+    if not before or after is None:
+        return ""
+    return f"{(after - before) / before:+.0%}"
+
+
+def report(result, previous=None):
+    settings = result["run"]["settings"]
+    throughput = result["throughput"]
+    print(
+        f"{settings['mode']} mode, {settings['advisors']} advisors x {settings['rounds']} rounds "
+        f"in {result['wall_seconds']:.1f}s ({result['advisors_completed']} completed)"
+    )
+    for failure in result["failures"][:5]:
+        print(f"  FAILED {failure}")
+    print(
+        f"throughput: {throughput['advisors_per_second']:.2f} advisors/s, "
+        f"{throughput['calls_per_second']:.2f} calls/s, "
+        f"{throughput['upstream_requests_per_second']:.2f} upstream req/s, "
+        f"{throughput['completion_tokens_per_second']:.0f} completion tok/s"
+    )
+    previous_calls = {row["call"]: row for row in previous[1]["calls"]} if previous else {}
+    print(f"\n{'call':<10} {'n':>5} {'err':>4} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'p50 ttft':>9} {'p95 ttft':>9}"
+          + ("  p95 vs last" if previous else ""))
+    for row in result["calls"]:
+        line = (
+            f"{row['call']:<10} {row['count']:>5} {row['errors']:>4} {row['p50_s']:>7.3f} {row['p95_s']:>7.3f} "
+            f"{row['p99_s']:>7.3f} {row['p50_ttft_s']:>9.3f} {row['p95_ttft_s']:>9.3f}"
+        )
+        if previous:
+            line += f"  {_change(previous_calls.get(row['call'], {}).get('p95_s'), row['p95_s']):>12}"
+        print(line)
+    memory = result["memory"]
+    print(
+        f"\nmemory: {memory['per_session_kb']:.0f} KB per session "
+        f"(RSS {memory['rss_before_mb']:.0f} -> {memory['rss_after_mb']:.0f} MB)"
+    )
+    stub, limiter = result["stub"], result["rate_limiter"]
+    print(
+        f"stub: {stub['requests']} requests, {stub['rate_limited']} answered 429, "
+        f"{stub['truncated']} truncated, max {stub['max_in_flight']} in flight"
+    )
+    print("rate limiter: " + ", ".join(f"{key}={value}" for key, value in limiter.items()))
+    if previous:
+        before = previous[1]["throughput"]["calls_per_second"]
+        print(
+            f"\nvs {os.path.basename(previous[0])} ({previous[1]['run']['revision'] or 'no revision'}): "
+            f"calls/s {_change(before, throughput['calls_per_second'])}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("engine", "ui"), default="engine")
+    parser.add_argument("--advisors", type=int, default=20, help="concurrent simulated advisors")
+    parser.add_argument("--rounds", type=int, default=1, help="searches per advisor")
+    parser.add_argument("--scenario", choices=("a", "b", "mixed"), default="mixed",
+                        help="path per advisor (mixed: even advisors B, odd A)")
+    parser.add_argument("--more", type=int, default=1, help="follow-up batches after each search")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="non-streaming calls")
+    parser.add_argument("--same-query", action="store_true", help="every advisor sends the same (cacheable) query")
+    parser.add_argument("--directory", default="", help="COI directory SQLite file (default: directory off)")
+    parser.add_argument("--poll", type=float, default=0.25, help="ui mode: seconds between reruns while a job runs")
+    parser.add_argument("--timeout", type=float, default=300, help="ui mode: per-step limit in seconds")
+    stub_args = parser.add_argument_group("stub")
+    stub_args.add_argument("--ttft", type=float, default=0.5, help="seconds before the first token")
+    stub_args.add_argument("--tokens-per-second", type=float, default=300.0, help="0 = as fast as possible")
+    stub_args.add_argument("--rate-limit-fraction", type=float, default=0.0, help="share of requests answered 429")
+    stub_args.add_argument("--capacity", type=int, default=0, help="429 above this many requests in flight")
+    stub_args.add_argument("--retry-after", type=float, default=1.0)
+    stub_args.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--no-save", dest="save", action="store_false")
+    args = parser.parse_args()
+    os.environ["COI_DIRECTORY_DB"] = args.directory
+
+    result = run(args)
+    previous = previous_run(result, args.results_dir)
+    report(result, previous)
+    if args.save:
+        print(f"\nsaved {save(result, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Prompt tokens per call: the full SYSTEM_PROMPT on every call (before) vs the
+per-call prompts from coi_prompts (after).
+
+    python benchmarks/bench_prompt_tokens.py
+
+Runs each kind of model call once against the local stub (stub_openai) with
+request recording on, so the user messages are exactly what the app sends.
+"before" is the same user message with the full SYSTEM_PROMPT as the system
+message (every section composed; about 20 tokens longer than the original block).
+Also reports how much of each system prompt is a prefix shared with the
+other search calls (what provider-side prompt caching can reuse).
+
+Counts use tiktoken (o200k_base, the gpt-4o family encoding) when it is
+installed, otherwise the app's own ~4 characters per token estimate.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set before the app modules read their config: no response cache, COI directory or metrics log.
+os.environ["COI_CACHE_DB"] = ""
+os.environ["COI_DIRECTORY_DB"] = ""
+os.environ["COI_METRICS_LOG"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from coi_report import estimate_tokens  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+STUB = StubServer(record=True)
+
+
+def count_tokens(text):
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    return estimate_tokens(text)
+
+
+def record_calls():
+    """
+    Run every kind of call once; returns [(label, system prompt, user message)].
+    """
+    from coi_engine import REPORT_MODEL, SEARCH_MODEL, run_next_batch, run_path_a_sections, run_path_b_model
+
+    answers = (
+        "07302", "Young Families; small business owners", "new baby, relocation",
+        "French expat community", "Former CPA at Deloitte", "alumni association; daycare parents",
+    )
+
+    def path_a(**kwargs):
+        for future in run_path_a_sections(*answers, use_cache=False, **kwargs).values():
+            future.result()
+
+    # (label, call, model of the request to keep)
+    calls = [
+        ("Path A report (local tables)", path_a, REPORT_MODEL),
+        ("Path A report (model tables)", lambda: path_a(local_tables=False), REPORT_MODEL),
+        ("Path A COI list", path_a, SEARCH_MODEL),
+        ("Path B lookup",
+         lambda: run_path_b_model("07302", "CPA / Tax Advisor", "new parents", use_cache=False), SEARCH_MODEL),
+        ("Next batch", lambda: run_next_batch(
+            {"ZIP code": "07302", "COI type(s)": "CPA / Tax Advisor"},
+            "Jordan Example @ example.com",
+        ), SEARCH_MODEL),
+    ]
+    recorded = []
+    for label, call, model in calls:
+        del STUB.requests[:]
+        call()
+        request = next(r for r in STUB.requests if r["model"] == model)
+        messages = {message["role"]: message["content"] for message in request["messages"]}
+        recorded.append((label, messages["system"], messages["user"]))
+    return recorded
+
+
+def shared_prefix(a, b) -> str:
+    size = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        size += 1
+    return a[:size]
+
+
+def main():
+    os.environ["OPENAI_BASE_URL"] = STUB.start().base_url
+    from coi_prompts import PATH_B_PROMPT, SYSTEM_PROMPT
+
+    recorded = record_calls()
+    full = count_tokens(SYSTEM_PROMPT)
+    print(f"token counts: {'tiktoken o200k_base' if tiktoken else '~4 chars/token estimate'}")
+    print(f"full SYSTEM_PROMPT: {full} tokens\n")
+    print(f"{'call':<30} {'user':>6} {'system':>7} {'before':>7} {'after':>7} {'saved':>7} {'shared prefix':>14}")
+    for label, system, user in recorded:
+        user_tokens = count_tokens(user)
+        system_tokens = count_tokens(system)
+        before = full + user_tokens
+        after = system_tokens + user_tokens
+        prefix = count_tokens(shared_prefix(system, PATH_B_PROMPT))
+        print(
+            f"{label:<30} {user_tokens:>6} {system_tokens:>7} {before:>7} {after:>7} "
+            f"{(before - after) / before:>6.0%} {prefix:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
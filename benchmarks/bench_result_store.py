@@ -0,0 +1,192 @@
+"""
+Benchmark per-session result memory: session_state as it was vs. coi_store.
+
+    python benchmarks/bench_result_store.py [--sessions 500] [--shared 0.6] [--budget-mb 0.5]
+
+Every simulated session holds a Path A result (report + first COI batch, with
+follow-up batches for some) and a Path B result. A --shared fraction of them
+show one of a few popular results (cache hits: the same ZIP and intake or COI
+type as another advisor), the rest unique ones.
+
+1. Memory: tracemalloc of what the sessions held before (result strings, parsed
+   COIRecord lists, one COIExclusionIndex per path) against the refs they hold
+   now plus the store, and the store's compressed and uncompressed bytes.
+2. Budget: the same sessions against a --budget-mb store, touched in random
+   order; reports the store's size, how many idle sessions were cleared, and
+   checks that the most recently active ones still read back whole.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coi_records import COI_COLUMNS, COIExclusionIndex, parse_coi_table  # noqa: E402
+from coi_store import ResultStore  # noqa: E402
+
+FIRST = ["Priya", "Daniel", "Maria", "James", "Wei", "Aisha", "Robert", "Elena", "Kevin", "Fatima", "Luis", "Grace"]
+LAST = ["Shah", "Cohen", "Garcia", "O'Neil", "Chen", "Okafor", "Kim", "Rossi", "Nguyen", "Patel", "Brooks", "Levy"]
+ROLES = ["CPA", "Estate Attorney", "Mortgage Broker", "Realtor", "Pediatrician", "HR Director", "Insurance Agent"]
+POPULAR = 12
+
+
+def coi_table(rng, rows, zip_code):
+    lines = ["| " + " | ".join(COI_COLUMNS) + " |", "|" + "---|" * len(COI_COLUMNS)]
+    for _ in range(rows):
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)} {rng.randrange(1000)}"
+        firm = f"{rng.choice(LAST)} & {rng.choice(LAST)} {rng.choice(['LLP', 'Group', 'Partners'])}"
+        domain = firm.split()[0].lower().replace("'", "") + f"{rng.randrange(10000)}.com"
+        lines.append(
+            f"| {name} | {rng.choice(ROLES)} | [{firm}](https://www.{domain}/team) | "
+            f"(201) {rng.randrange(200, 999)}-{rng.randrange(10000):04d} | "
+            f"Serves {rng.choice(['young families', 'business owners', 'retirees'])} near {zip_code}; "
+            f"active in the local chamber and refers clients to planners. |"
+        )
+    return "\n".join(lines)
+
+
+def report(rng, zip_code):
+    paragraphs = [
+        f"**{heading}** — " + " ".join(
+            f"Households around {zip_code} show {rng.choice(['rising', 'steady', 'mixed'])} demand for "
+            f"{rng.choice(['college savings', 'retirement income', 'equity compensation', 'estate planning'])}."
+            for _ in range(6)
+        )
+        for heading in ("Snapshot", "Life events", "Cultural notes", "Where to find them", "Talking points")
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def make_result(seed):
+    rng = random.Random(seed)
+    zip_code = f"{rng.randrange(10000, 99999)}"
+    cois = coi_table(rng, 25, zip_code)
+    more = parse_coi_table(coi_table(rng, rng.choice([0, 0, 25, 50, 100]), zip_code))
+    return {
+        "sections": {"report": report(rng, zip_code), "cois": "Verify every contact before reaching out.\n\n" + cois},
+        "path_a_records": parse_coi_table(cois),
+        "path_a_more": more,
+        "path_b_result": coi_table(rng, 25, zip_code),
+    }
+
+
+def session_results(count, shared, seed=7):
+    rng = random.Random(seed)
+    return [
+        make_result(f"popular-{rng.randrange(POPULAR)}" if rng.random() < shared else f"unique-{i}")
+        for i in range(count)
+    ]
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held, size
+
+
+def old_layout(results):
+    """
+    What session_state held per session before coi_store.
+    """
+    sessions = []
+    for result in results:
+        sections = {name: "".join(text) for name, text in result["sections"].items()}
+        path_a_records = [r.__class__.from_row(r.to_row()) for r in result["path_a_records"]]
+        path_a_more = [r.__class__.from_row(r.to_row()) for r in result["path_a_more"]]
+        path_b_result = "".join(result["path_b_result"])
+        path_b_records = parse_coi_table(path_b_result)
+        sessions.append({
+            "path_a_sections": sections,
+            "path_a_result": "\n\n".join(sections.values()),
+            "path_a_records": path_a_records,
+            "path_a_more": path_a_more,
+            "path_a_index": COIExclusionIndex(path_a_records + path_a_more),
+            "path_b_result": path_b_result,
+            "path_b_records": path_b_records,
+            "path_b_more": [],
+            "path_b_index": COIExclusionIndex(path_b_records),
+        })
+    return sessions
+
+
+def store_session(store, session, result):
+    """
+    What app.py now keeps for a session: refs only (the payloads go to the store).
+    """
+    state = {"path_a_result": {
+        name: store.put(session, f"path_a_{name}", "".join(text)) for name, text in result["sections"].items()
+    }}
+    state["path_a_records"] = store.put_records(session, "path_a_records", result["path_a_records"])
+    state["path_a_more"] = store.put_records(session, "path_a_more", result["path_a_more"]) if result["path_a_more"] else None
+    path_b_result = "".join(result["path_b_result"])
+    state["path_b_result"] = store.put(session, "path_b_result", path_b_result)
+    state["path_b_records"] = store.put_records(session, "path_b_records", parse_coi_table(path_b_result))
+    state["path_b_more"] = None
+    return state
+
+
+def new_layout(results, store):
+    return store, [store_session(store, f"session-{i}", result) for i, result in enumerate(results)]
+
+
+def intact(store, session, state, result):
+    sections = {name: store.get(session, ref) for name, ref in state["path_a_result"].items()}
+    more = store.get_records(session, state["path_a_more"])
+    return sections == result["sections"] and more is not None and len(more) == len(result["path_a_more"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--shared", type=float, default=0.6, help="fraction of sessions showing a popular result")
+    parser.add_argument("--budget-mb", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = session_results(args.sessions, args.shared)
+    old, old_bytes = measure(lambda: old_layout(results))
+    del old
+    (store, states), new_bytes = measure(lambda: new_layout(results, ResultStore(budget_bytes=1 << 40)))
+    stats = store.stats()
+    print(f"Memory, {args.sessions} sessions ({args.shared:.0%} showing one of {POPULAR} popular results):")
+    print(f"  session_state as before: {old_bytes / 2**20:7.1f} MB · {old_bytes / args.sessions / 1024:6.1f} KB per session")
+    print(f"  refs + result store:     {new_bytes / 2**20:7.1f} MB · {new_bytes / args.sessions / 1024:6.1f} KB per session")
+    print(
+        f"  store: {stats['payloads']} payloads for {stats['puts']} puts ({stats['shared']} shared) · "
+        f"{stats['bytes'] / 2**20:.1f} MB compressed of {stats['raw_bytes'] / 2**20:.1f} MB "
+        f"({stats['raw_bytes'] / max(stats['bytes'], 1):.1f}x)"
+    )
+    failures = sum(not intact(store, f"session-{i}", state, results[i]) for i, state in enumerate(states))
+    del store, states
+
+    budget = int(args.budget_mb * 2**20)
+    store = ResultStore(budget_bytes=budget)
+    rng = random.Random(11)
+    states = {}
+    order = list(range(args.sessions))
+    rng.shuffle(order)
+    peak = 0
+    for i in order:
+        states[i] = store_session(store, f"session-{i}", results[i])
+        peak = max(peak, store.stats()["bytes"])
+    recent = order[-20:]
+    kept = sum(intact(store, f"session-{i}", states[i], results[i]) for i in recent)
+    cleared = sum(store.get(f"session-{i}", states[i]["path_b_result"]) is None for i in order)
+    stats = store.stats()
+    print(f"\nBudget {args.budget_mb:g} MB, sessions active in random order:")
+    print(
+        f"  store peak {peak / 2**20:.2f} MB · now {stats['bytes'] / 2**20:.2f} MB for {stats['sessions']} sessions · "
+        f"{stats['evicted_sessions']} idle sessions cleared ({cleared} would be asked to search again)"
+    )
+    print(f"  {kept}/{len(recent)} most recently active sessions read back whole")
+    failures += kept != len(recent) or peak > budget
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Benchmark near-duplicate intake detection (coi_similarity).
+
+    python benchmarks/bench_similarity.py [--entries 50000] [--zips 200] [--lookups 10000]
+
+1. Precision / recall on the labelled pairs in fixtures/intake_pairs.json,
+   through the LSH index (so LSH misses count against recall), at a range of
+   thresholds with the configured one marked.
+2. Lookup latency with --entries synthetic intakes spread over --zips ZIPs
+   (--zips 1 is the worst case: every intake in one ZIP), for rephrased and
+   novel intakes, plus index memory per entry.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coi_similarity import SIMILARITY_THRESHOLD, IntakeIndex  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "intake_pairs.json")
+
+SEGMENTS = [
+    "young families", "small business owners", "tech professionals", "doctors", "dentists", "nurses",
+    "pre-retirees", "retirees", "teachers", "corporate executives", "military families", "realtors",
+    "gig workers", "recent graduates", "women in transition", "first generation immigrants", "attorneys",
+]
+EVENTS = [
+    "new baby", "relocation", "home purchase", "IPO", "job change", "retirement", "inheritance",
+    "divorce", "business sale", "college funding", "marriage", "promotion", "pension rollover",
+]
+COMMUNITIES = [
+    "", "Indian-American community", "Chinese community", "Korean community", "Hispanic community",
+    "Jewish community", "Nigerian community", "Vietnamese community", "Haitian community", "Veterans",
+]
+BACKGROUNDS = [
+    "Former CPA", "Former teacher", "Ex-banker", "Software engineer", "Former nurse", "HR background",
+    "Army veteran", "Real estate agent", "Paralegal", "MBA, ex-consultant", "Career coach",
+]
+NETWORKS = [
+    "Rotary", "PTA", "Chamber of Commerce", "Alumni network", "Church", "BNI", "Golf club",
+    "Medical society", "Toastmasters", "Soccer league", "LinkedIn",
+]
+
+
+def precision_recall(pairs, threshold):
+    tp = fp = fn = 0
+    for i, pair in enumerate(pairs):
+        index = IntakeIndex(threshold=threshold)
+        zip_code = f"{i:05d}"
+        index.add(zip_code, pair["a"])
+        matched = index.find(zip_code, pair["b"]) is not None
+        tp += matched and pair["same"]
+        fp += matched and not pair["same"]
+        fn += not matched and pair["same"]
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    return precision, recall
+
+
+def random_intake(rng):
+    return [
+        ", ".join(rng.sample(SEGMENTS, rng.randint(1, 3))),
+        ", ".join(rng.sample(EVENTS, rng.randint(1, 3))),
+        rng.choice(COMMUNITIES),
+        rng.choice(BACKGROUNDS),
+        ", ".join(rng.sample(NETWORKS, rng.randint(1, 3))),
+    ]
+
+
+def rephrase(answers, rng):
+    """
+    Same intake, different wording: parts reordered, case and separators changed.
+    """
+    out = []
+    for answer in answers:
+        parts = [part.strip() for part in answer.split(",")]
+        rng.shuffle(parts)
+        text = rng.choice(["; ", ", ", " & "]).join(parts)
+        out.append(text.lower() if rng.random() < 0.5 else text)
+    return out
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def time_lookups(index, queries):
+    samples = []
+    matched = 0
+    for zip_code, answers in queries:
+        start = time.perf_counter()
+        matched += index.find(zip_code, answers) is not None
+        samples.append(time.perf_counter() - start)
+    return samples, matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--zips", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with open(FIXTURE, encoding="utf-8") as f:
+        pairs = json.load(f)
+    positives = sum(pair["same"] for pair in pairs)
+    print(f"Fixture: {len(pairs)} pairs ({positives} near-duplicates, {len(pairs) - positives} distinct)")
+    print(f"{'threshold':>10} {'precision':>10} {'recall':>8}")
+    for threshold in sorted({0.5, 0.6, 0.7, 0.75, 0.8, 0.9, SIMILARITY_THRESHOLD}):
+        precision, recall = precision_recall(pairs, threshold)
+        marker = "  <- COI_SIMILARITY_THRESHOLD" if threshold == SIMILARITY_THRESHOLD else ""
+        print(f"{threshold:>10.2f} {precision:>10.2f} {recall:>8.2f}{marker}")
+
+    rng = random.Random(args.seed)
+    zip_codes = [f"{7000 + i:05d}" for i in range(args.zips)]
+    intakes = [(rng.choice(zip_codes), random_intake(rng)) for _ in range(args.entries)]
+
+    index = IntakeIndex(max_entries=args.entries)
+    start = time.perf_counter()
+    for zip_code, answers in intakes:
+        index.add(zip_code, answers)
+    build = time.perf_counter() - start
+
+    # Memory on a separate, smaller index: tracemalloc slows every allocation down.
+    sample = intakes[:min(len(intakes), 10000)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sized = IntakeIndex(max_entries=len(sample))
+    for zip_code, answers in sample:
+        sized.add(zip_code, answers)
+    memory = (tracemalloc.get_traced_memory()[0] - before) / max(len(sized), 1)
+    tracemalloc.stop()
+
+    rephrased = [(zip_code, rephrase(answers, rng)) for zip_code, answers in rng.sample(intakes, args.lookups // 2)]
+    novel = [(rng.choice(zip_codes), random_intake(rng)) for _ in range(args.lookups // 2)]
+    print(
+        f"\nIndex: {len(index)} intakes over {args.zips} ZIPs · built in {build:.2f}s · "
+        f"~{memory:.0f} bytes per intake"
+    )
+    for label, queries in (("rephrased", rephrased), ("novel", novel)):
+        samples, matched = time_lookups(index, queries)
+        print(
+            f"{label:>10}: p50 {percentile(samples, 50) * 1e6:.0f}µs · p99 {percentile(samples, 99) * 1e6:.0f}µs · "
+            f"max {max(samples) * 1e6:.0f}µs · matched {matched}/{len(queries)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Exercise coi_verify against the local link stand-in (stub_links.py).
+
+    python benchmarks/bench_verify.py [--links 125] [--hosts 25] [--delay 0.2] [--per-host 2]
+
+1. Classification: one link per stand-in route (plus a non-resolving domain
+   and a non-web link) with the status each should get.
+2. Throughput: --links links spread over --hosts loopback hosts
+   (127.0.0.2, 127.0.0.3, ...), each answering after --delay seconds.
+   Reports time until the first and the last badge, how long check() took
+   to return (it must not block), the stand-in's peak per-host concurrency
+   (must stay within --per-host) and a second pass served from the cache.
+"""
+
+import argparse
+import os
+import sys
+import time
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coi_verify import BLOCKED, DEAD, INVALID, OK, UNREACHABLE, LinkVerifier, contact_issue  # noqa: E402
+from stub_links import LinkServer  # noqa: E402
+
+EXPECTED = {
+    "/ok": OK,
+    "/redirect": OK,
+    "/no-head": OK,
+    "/forbidden": BLOCKED,
+    "/missing": DEAD,
+    "/gone": DEAD,
+    "/loop": DEAD,
+    "/error": UNREACHABLE,
+    "/slow?s=3": UNREACHABLE,
+}
+
+
+class OnlyLoopbackOne(LinkVerifier):
+    """
+    Refuses private addresses except 127.0.0.1, the stand-in's "public" site.
+    """
+
+    def _blocked(self, address) -> bool:
+        return address != "127.0.0.1"
+
+
+def classification(stub):
+    verifier = LinkVerifier(timeout=1.0, allow_private=True)
+    links = {stub.url(path): expected for path, expected in EXPECTED.items()}
+    links["https://no-such-coi-firm.invalid/team"] = DEAD
+    links["mailto:someone@example.com"] = INVALID
+    results = verifier.check_all(list(links), timeout=10)
+    failures = 0
+    for link, expected in links.items():
+        result = results[link]
+        status = result.status if result else "pending"
+        failures += status != expected
+        mark = "ok  " if status == expected else "FAIL"
+        print(f"  {mark} {link:<45} {result.badge if result else '⏳':<22} (expected {expected})")
+    # Private addresses are refused unless allowed.
+    guarded = LinkVerifier(timeout=1.0).check_all([stub.url("/ok")], timeout=5)[stub.url("/ok")]
+    failures += guarded.status != INVALID
+    print(f"  {'ok  ' if guarded.status == INVALID else 'FAIL'} loopback without allow_private -> {guarded.badge}")
+    # ... also when a permitted host redirects there (127.0.0.1 stands in for a public site).
+    away = stub.url("/away?to=" + quote(stub.url("/ok", host="127.0.0.2"), safe=""))
+    redirected = OnlyLoopbackOne(timeout=1.0).check_all([away], timeout=5)[away]
+    failures += redirected.status != INVALID or stub.stats["hosts"].get("127.0.0.2", 0) > 0
+    print(
+        f"  {'ok  ' if redirected.status == INVALID else 'FAIL'} redirect to a refused address -> {redirected.badge} "
+        f"({stub.stats['hosts'].get('127.0.0.2', 0)} requests reached it)"
+    )
+    for contact, expected in (("(201) 555-0142", True), ("(201) 555-1212", False), ("(201) 798-2231", False)):
+        flagged = bool(contact_issue(contact))
+        failures += flagged != expected
+        print(f"  {'ok  ' if flagged == expected else 'FAIL'} contact {contact!r} flagged={flagged}")
+    return failures
+
+
+def throughput(stub, links, per_host):
+    verifier = LinkVerifier(timeout=5.0, per_host=per_host, allow_private=True)
+    start = time.perf_counter()
+    first = verifier.check(links)
+    returned = time.perf_counter() - start
+    pending = sum(result is None for result in first.values())
+    first_badge = None
+    while True:
+        results = verifier.check(links)
+        done = sum(result is not None for result in results.values())
+        if done and first_badge is None:
+            first_badge = time.perf_counter() - start
+        if done == len(results):
+            break
+        time.sleep(0.01)
+    total = time.perf_counter() - start
+    start = time.perf_counter()
+    again = verifier.check(links)
+    cached = time.perf_counter() - start
+    print(
+        f"  check() returned in {returned * 1000:.1f}ms with {pending} pending · first badge {first_badge:.2f}s · "
+        f"all {len(results)} in {total:.2f}s"
+    )
+    print(
+        f"  stand-in: {stub.stats['requests']} requests · peak {stub.stats['max_host_in_flight']} per host "
+        f"(limit {per_host}) · peak {stub.stats['max_in_flight']} overall"
+    )
+    print(
+        f"  second pass: {sum(r is not None for r in again.values())}/{len(again)} from cache in "
+        f"{cached * 1000:.1f}ms · stats {verifier.stats()}"
+    )
+    return stub.stats["max_host_in_flight"] > per_host
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--links", type=int, default=125)
+    parser.add_argument("--hosts", type=int, default=25)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--per-host", type=int, default=2)
+    args = parser.parse_args()
+
+    stub = LinkServer().start()
+    print("Classification:")
+    failures = classification(stub)
+    stub.stop()
+
+    stub = LinkServer(delay=args.delay).start()
+    links = [stub.url(f"/ok?coi={i}", host=f"127.0.0.{2 + i % args.hosts}") for i in range(args.links)]
+    print(f"\nThroughput: {args.links} links over {args.hosts} hosts, {args.delay}s per response:")
+    failures += throughput(stub, links, args.per_host)
+    stub.stop()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Check that every session and rerun shares one OpenAI client and one connection pool.
+
+    python benchmarks/check_client_reuse.py
+
+1. get_client() / get_http_client() from 8 threads at once return the same objects.
+2. The app runs through Streamlit's AppTest as two sessions, each submitting a
+   Path B lookup against the local stub (stub_openai.py) and rerunning until
+   it is done: the client and pool are the objects from step 1 after every
+   run, and the pool holds one keep-alive connection for both lookups.
+
+Exits non-zero on any failure.
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_openai import StubServer  # noqa: E402
+
+STUB = StubServer(rows=5).start()
+# Read at import by the app modules, so set before importing them.
+os.environ.update(
+    OPENAI_BASE_URL=STUB.base_url,
+    OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "stub"),
+    COI_CACHE_DB="",
+    COI_DIRECTORY_DB="",
+    COI_USAGE_DB="",
+    COI_VERIFY_LINKS="0",
+)
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from coi_client import get_client, get_http_client  # noqa: E402
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def expect(label, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    return not ok
+
+
+def from_threads(count=8):
+    found = []
+    barrier = threading.Barrier(count)
+
+    def grab():
+        barrier.wait()
+        found.append((get_client(), get_http_client()))
+
+    threads = [threading.Thread(target=grab) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return found
+
+
+def pool_connections(http_client):
+    return len(http_client._transport._pool.connections)
+
+
+def session_lookup(zip_code, client, http_client):
+    """
+    One app session: pick Path B, submit a lookup, rerun until it finishes.
+    Returns how many script runs saw a different client or pool.
+    """
+    changed = 0
+    at = AppTest.from_file(APP, default_timeout=30).run()
+    at.button(key="select_B").click().run()
+    at.text_input(key="qb_zip").input(zip_code)
+    at.button[[button.label for button in at.button].index("Find COIs Now")].click().run()
+    for _ in range(60):
+        changed += get_client() is not client or get_http_client() is not http_client
+        if not at.session_state["path_b_job"]:
+            break
+        time.sleep(0.25)
+        at.run()
+    return changed, bool(at.session_state["path_b_result"])
+
+
+def main():
+    print("Threads:")
+    found = from_threads()
+    client, http_client = found[0]
+    failures = expect(
+        f"{len(found)} threads got one client and one pool",
+        all(c is client and h is http_client for c, h in found),
+    )
+    print("App sessions (AppTest):")
+    for number, zip_code in enumerate(("07302", "94105"), 1):
+        changed, finished = session_lookup(zip_code, client, http_client)
+        failures += expect(f"session {number}: lookup finished", finished)
+        failures += expect(f"session {number}: every run used the same client and pool ({changed} changed)", not changed)
+    connections = pool_connections(http_client)
+    failures += expect(
+        f"{STUB.stats['requests']} upstream requests over {connections} pooled connection(s)",
+        STUB.stats["requests"] >= 2 and connections == 1,
+    )
+    STUB.stop()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
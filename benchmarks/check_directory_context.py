@@ -0,0 +1,81 @@
+"""
+Check that a Path B lookup with extra context is not answered from the COI directory.
+
+    python benchmarks/check_directory_context.py
+
+Runs Path B lookups against the local stub (stub_openai.py) with throwaway
+cache and directory files:
+
+1. No context: the first lookup calls the model and files its COIs; the same
+   lookup again is answered from the directory without a model call.
+2. With context ("French-speaking expats"), same ZIP and COI type: the model
+   is called and its answer returned, not the directory's generic rows; the
+   same lookup again is a cache hit.
+
+Exits non-zero on any failure.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_openai import StubServer  # noqa: E402
+
+WORKDIR = tempfile.mkdtemp(prefix="coi-check-")
+STUB = StubServer().start()
+# Read at import by the app modules, so set before importing them.
+os.environ.update(
+    OPENAI_BASE_URL=STUB.base_url,
+    OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "stub"),
+    COI_CACHE_DB=os.path.join(WORKDIR, "cache.sqlite3"),
+    COI_DIRECTORY_DB=os.path.join(WORKDIR, "directory.sqlite3"),
+    COI_USAGE_DB="",
+    COI_METRICS_LOG="",
+)
+
+from coi_engine import directory_covers, run_path_b_model  # noqa: E402
+
+ZIP_CODE, COI_TYPE, CONTEXT = "07302", "CPAs", "French-speaking expats"
+FROM_DIRECTORY = "From the COI directory"
+
+
+def expect(label, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    return not ok
+
+
+def lookup(context):
+    """
+    (answer, upstream requests it made).
+    """
+    before = STUB.stats["requests"]
+    text = run_path_b_model(ZIP_CODE, COI_TYPE, context)
+    return text, STUB.stats["requests"] - before
+
+
+def main():
+    print("No extra context:")
+    _text, calls = lookup("")
+    failures = expect(f"first lookup calls the model ({calls} requests)", calls >= 1)
+    text, calls = lookup("")
+    failures += expect(f"repeat is served from the directory ({calls} requests)", calls == 0 and FROM_DIRECTORY in text)
+    failures += expect("directory_covers() says so", directory_covers(ZIP_CODE, COI_TYPE))
+
+    print(f"Extra context “{CONTEXT}”:")
+    failures += expect("directory_covers() is False", not directory_covers(ZIP_CODE, COI_TYPE, CONTEXT))
+    text, calls = lookup(CONTEXT)
+    failures += expect(
+        f"lookup calls the model ({calls} requests), not the directory", calls >= 1 and FROM_DIRECTORY not in text
+    )
+    _text, calls = lookup(CONTEXT)
+    failures += expect(f"repeat is a cache hit ({calls} requests)", calls == 0)
+    STUB.stop()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
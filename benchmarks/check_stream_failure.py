@@ -0,0 +1,81 @@
+"""
+Check that an answer which fails partway is neither cached nor filed in the COI directory.
+
+    python benchmarks/check_stream_failure.py
+
+Runs Path B lookups against the local stub (stub_openai.py) with throwaway
+cache and directory files:
+
+1. The stub drops every stream after a few chunks: the lookup must end in
+   the error warning, leave no cache entry and add no directory rows.
+2. Control, stub healthy (a ZIP far from the first): the answer is cached
+   and its COIs filed.
+
+Exits non-zero on any failure.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_openai import StubServer  # noqa: E402
+
+WORKDIR = tempfile.mkdtemp(prefix="coi-check-")
+STUB = StubServer(drop_after=40).start()
+# Read at import by the app modules, so set before importing them.
+os.environ.update(
+    OPENAI_BASE_URL=STUB.base_url,
+    OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "stub"),
+    COI_CACHE_DB=os.path.join(WORKDIR, "cache.sqlite3"),
+    COI_DIRECTORY_DB=os.path.join(WORKDIR, "directory.sqlite3"),
+    COI_USAGE_DB="",
+    COI_MAX_RETRIES="0",
+)
+
+from coi_cache import get_response_cache  # noqa: E402
+from coi_directory import get_directory  # noqa: E402
+from coi_engine import path_b_cache_key, run_path_b_model  # noqa: E402
+
+ERROR = "⚠️ Error while calling OpenAI"
+
+
+def expect(label, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    return not ok
+
+
+def check(zip_code, healthy):
+    before = get_directory().stats()["entries"]
+    text = "".join(run_path_b_model(zip_code, "CPAs", "", stream=True))
+    cached = get_response_cache().get(path_b_cache_key(zip_code, "CPAs", "")) is not None
+    added = get_directory().stats()["entries"] - before
+    if healthy:
+        return sum((
+            expect("healthy: complete answer", ERROR not in text),
+            expect("healthy: cached", cached),
+            expect(f"healthy: {added} COIs filed in the directory", added > 0),
+        ))
+    return sum((
+        expect(f"cut mid-answer: ends in the error warning ({len(text)} chars)", ERROR in text),
+        expect("cut mid-answer: not cached", not cached),
+        expect(f"cut mid-answer: nothing filed in the directory (added {added})", added == 0),
+    ))
+
+
+def main():
+    print("Answers cut off mid-stream:")
+    failures = check("07302", healthy=False)
+    print(f"  (stub dropped {STUB.stats['dropped']} streams)")
+    STUB.drop_after = None
+    print("Healthy answers:")
+    failures += check("94105", healthy=True)
+    STUB.stop()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
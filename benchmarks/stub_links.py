@@ -0,0 +1,141 @@
+"""
+Local stand-in for the web sites behind COI links, for testing coi_verify offline.
+
+Listens on every loopback address, so http://127.0.0.2:PORT/..., 127.0.0.3, ...
+act as separate hosts. The path picks the behaviour:
+
+    /ok             200
+    /missing        404
+    /gone           410
+    /forbidden      403 (a site that blocks bots)
+    /error          500
+    /no-head        405 to HEAD, 200 to GET
+    /redirect       301 to /ok
+    /loop           302 to itself
+    /away?to=URL    302 to URL
+    /slow?s=2       200 after s seconds (also /slow-anything for the default delay)
+
+Counters (requests, per-host peak concurrency, requests per address
+connected to) are in .stats.
+
+    stub = LinkServer(delay=0.05).start()
+    url = stub.url("/ok", host="127.0.0.2")
+"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROUTES = ("/ok", "/missing", "/gone", "/forbidden", "/error", "/no-head", "/redirect", "/loop", "/away", "/slow")
+_CODES = {"/ok": 200, "/missing": 404, "/gone": 410, "/forbidden": 403, "/error": 500}
+
+
+class LinkServer:
+    """
+    The stand-in on a background thread. Every response waits `delay` seconds first.
+    """
+
+    def __init__(self, delay=0.0, slow=2.0, port=0):
+        self.delay = delay
+        self.slow = slow
+        self.port = port
+        self.stats = {"requests": 0, "head": 0, "get": 0, "max_in_flight": 0, "max_host_in_flight": 0, "hosts": {}}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def url(self, path, host="127.0.0.1"):
+        return f"http://{host}:{self._server.server_address[1]}{path}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("", self.port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="stub-links").start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _enter(self, host, method, address):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["hosts"][address] = self.stats["hosts"].get(address, 0) + 1
+            self.stats[method] += 1
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            self.stats["max_host_in_flight"] = max(self.stats["max_host_in_flight"], self._in_flight[host])
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], sum(self._in_flight.values()))
+
+    def _leave(self, host):
+        with self._lock:
+            self._in_flight[host] -= 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, location=None, body=b"ok\n"):
+                self.send_response(code)
+                if location:
+                    self.send_header("Location", location)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command == "GET":
+                    self.wfile.write(body)
+
+            def _serve(self):
+                host = self.headers.get("Host", "").split(":")[0]
+                stub._enter(host, self.command.lower(), self.connection.getsockname()[0])
+                try:
+                    url = urlparse(self.path)
+                    if stub.delay:
+                        time.sleep(stub.delay)
+                    if url.path.startswith("/slow"):
+                        time.sleep(float(parse_qs(url.query).get("s", [stub.slow])[0]))
+                        self._reply(200)
+                    elif url.path == "/no-head":
+                        self._reply(405 if self.command == "HEAD" else 200)
+                    elif url.path == "/redirect":
+                        self._reply(301, location="/ok")
+                    elif url.path == "/loop":
+                        self._reply(302, location="/loop")
+                    elif url.path == "/away":
+                        self._reply(302, location=parse_qs(url.query)["to"][0])
+                    else:
+                        self._reply(_CODES.get(url.path, 404))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the checker gave up (timeout)
+                finally:
+                    stub._leave(host)
+
+            do_GET = _serve
+            do_HEAD = _serve
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for COI link targets.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds before every response")
+    args = parser.parse_args()
+    stub = LinkServer(delay=args.delay, port=args.port).start()
+    print(f"stand-in listening on {stub.url('/ok')} (routes: {', '.join(ROUTES)})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Local OpenAI-compatible stub for offline benchmarks and load tests.
+
+Answers POST /v1/chat/completions in both forms the app uses:
+
+- non-streaming: one chat.completion with usage
+- streaming: chat.completion.chunk SSE events, a final finish_reason chunk,
+  a usage chunk when stream_options.include_usage is set, then [DONE]
+
+Calls whose system prompt has the COI table rules get a COI table in the
+app's format: the rows asked for ("next N" for follow-up batches, 25
+otherwise, or a fixed `rows`), with names unique per request so dedupe does
+not collapse them, and the closing question. Other calls (the Path A report)
+get a short report. Latency is
+time-to-first-token plus completion tokens at a fixed token rate. Answers
+longer than max_completion_tokens are cut there with finish_reason
+"length", as the API does.
+
+429s can be injected at random (rate_limit_fraction) and/or whenever more
+than `capacity` requests are in flight, with a Retry-After header. With
+drop_after=N every stream is cut (connection closed, no final chunk) after
+N content chunks, like an upstream failing mid-answer.
+
+Use from a benchmark:
+
+    stub = StubServer(ttft=0.2, tokens_per_second=400).start()
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+
+or run standalone:
+
+    python benchmarks/stub_openai.py --port 8765 --ttft 0.5 --tokens-per-second 200
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The app's estimate_tokens rule of thumb.
+CHARS_PER_TOKEN = 4
+DEFAULT_ROWS = 25
+CHUNK_TOKENS = 8
+
+ASK_FOR_MORE = (
+    "**Would you like more COIs? I can add more (up to 125 total), or we can finish with your summary.**"
+)
+_NEXT_ROWS = re.compile(r"next (\d+)")
+
+
+def coi_answer(request_no, rows=DEFAULT_ROWS):
+    header = (
+        "| Name | Role/Specialty | Organization + Link | Public Contact | Why They Fit |\n"
+        "|---|---|---|---|---|\n"
+    )
+    body = "\n".join(
+        f"| Person {request_no}-{i} | CPA | [Firm {request_no}-{i}](https://firm{request_no}-{i}.example.com) "
+        f"| (201) 555-{i:04d} | Serves young families near the advisor's ZIP |"
+        for i in range(rows)
+    )
+    return "#### Opportunity Themes\n- Young families relocating for new jobs.\n\n" + header + body + "\n\n" + ASK_FOR_MORE
+
+
+def report_answer():
+    return (
+        "#### 2) Opportunity Themes\n"
+        + "".join(f"- Theme {i}: young families relocating for new jobs need tax and housing help.\n" for i in range(4))
+        + "\n#### 4) Opportunity Channels\n"
+        "Introductions happen at closings, tax season and school events. "
+        "The advisor's CPA background makes tax professionals a natural first call.\n"
+    )
+
+
+def _wants_table(request):
+    return any(
+        message["role"] == "system" and "COI TABLE FORMAT" in (message.get("content") or "")
+        for message in request["messages"]
+    )
+
+
+def _requested_rows(request):
+    match = _NEXT_ROWS.search(request["messages"][-1]["content"])
+    return int(match.group(1)) if match else DEFAULT_ROWS
+
+
+class StubServer:
+    """
+    The stub on a background thread. Counters are in .stats; with record=True
+    every request body is kept in .requests.
+    """
+
+    def __init__(self, ttft=0.0, tokens_per_second=0.0, rate_limit_fraction=0.0, capacity=0,
+                 retry_after=1.0, jitter=0.0, rows=None, record=False, port=0, seed=None, drop_after=None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_fraction = rate_limit_fraction
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.jitter = jitter
+        self.rows = rows
+        self.drop_after = drop_after
+        self.record = record
+        self.port = port
+        self.requests = []
+        self.stats = {
+            "requests": 0, "streamed": 0, "rate_limited": 0, "truncated": 0, "max_in_flight": 0,
+            "completion_tokens": 0, "dropped": 0,
+        }
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="stub-openai").start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # ---------- Behaviour ----------
+
+    def _admit(self, request):
+        """
+        Count the request in; returns its number, or None to answer 429.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.record:
+                self.requests.append(request)
+            limited = (
+                (self.capacity and self._in_flight >= self.capacity)
+                or self._random.random() < self.rate_limit_fraction
+            )
+            if limited:
+                self.stats["rate_limited"] += 1
+                return None
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            return self.stats["requests"]
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _delay(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _answer(self, request, request_no):
+        if _wants_table(request):
+            text = coi_answer(request_no, self.rows or _requested_rows(request))
+        else:
+            text = report_answer()
+        finish_reason = "stop"
+        limit = request.get("max_completion_tokens") or request.get("max_tokens")
+        if limit and len(text) > limit * CHARS_PER_TOKEN:
+            text, finish_reason = text[:limit * CHARS_PER_TOKEN], "length"
+        with self._lock:
+            self.stats["truncated"] += finish_reason == "length"
+            self.stats["completion_tokens"] += len(text) // CHARS_PER_TOKEN
+        return text, finish_reason
+
+    def _usage(self, request, text):
+        prompt = sum(len(m.get("content") or "") for m in request["messages"]) // CHARS_PER_TOKEN
+        completion = len(text) // CHARS_PER_TOKEN
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, payload, headers=()):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                request_no = stub._admit(request)
+                if request_no is None:
+                    self._json(
+                        429,
+                        {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                        [("Retry-After", str(stub.retry_after))],
+                    )
+                    return
+                try:
+                    text, finish_reason = stub._answer(request, request_no)
+                    if request.get("stream"):
+                        self._stream(request, text, finish_reason)
+                    else:
+                        stub._delay(stub.ttft)
+                        if stub.tokens_per_second:
+                            stub._delay(len(text) / CHARS_PER_TOKEN / stub.tokens_per_second)
+                        self._json(200, {
+                            "id": f"stub-{request_no}", "object": "chat.completion", "created": int(time.time()),
+                            "model": request["model"],
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                         "finish_reason": finish_reason}],
+                            "usage": stub._usage(request, text),
+                        })
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client closed the stream (e.g. a cancelled search)
+                finally:
+                    stub._leave()
+
+            def _stream(self, request, text, finish_reason):
+                with stub._lock:
+                    stub.stats["streamed"] += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def event(data):
+                    frame = f"data: {data}\n\n".encode()
+                    self.wfile.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(delta, finish=None, usage=None):
+                    payload = {
+                        "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    }
+                    if usage:
+                        payload["usage"] = usage
+                    event(json.dumps(payload))
+
+                stub._delay(stub.ttft)
+                step = CHUNK_TOKENS * CHARS_PER_TOKEN
+                for number, start in enumerate(range(0, len(text), step)):
+                    if stub.drop_after is not None and number >= stub.drop_after:
+                        with stub._lock:
+                            stub.stats["dropped"] += 1
+                        self.close_connection = True
+                        return
+                    chunk({"content": text[start:start + step]})
+                    if stub.tokens_per_second:
+                        stub._delay(CHUNK_TOKENS / stub.tokens_per_second)
+                chunk({}, finish_reason)
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    chunk(None, usage=stub._usage(request, text))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub for load tests.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="0 = as fast as possible")
+    parser.add_argument("--rate-limit-fraction", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--capacity", type=int, default=0, help="429 above this many requests in flight (0 = off)")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="± fraction applied to every delay")
+    args = parser.parse_args()
+    stub = StubServer(
+        ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+        rate_limit_fraction=args.rate_limit_fraction, capacity=args.capacity,
+        retry_after=args.retry_after, jitter=args.jitter, port=args.port,
+    ).start()
+    print(f"stub listening on {stub.base_url}  (set OPENAI_BASE_URL to this)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Batch Path A: COI Intelligence Reports for a whole team from one intake CSV.
+
+    python coi_batch.py advisors.csv --out reports/ [--concurrency 8] [--refresh]
+
+One row per advisor with the Path A answers (INTAKE_COLUMNS). Headers are
+matched loosely, so the app's labels ("ZIP code", "Warm networks", ...) and
+"Q1".."Q6" work too. Rows run through run_path_a_model, BATCH_CONCURRENCY at a
+time, all under one rate-limiter session. A batch makes its model calls on a pool of its own
+(two threads per row), never on coi_engine's shared pool, so a large upload
+cannot take the threads interactive searches need. Each finished report is written to its own Markdown
+file and appended to checkpoint.jsonl in the output directory; running the
+same CSV into the same directory again skips every row already written, so
+a crash resumes where it stopped. index.csv lists every row with its status
+and report file, and reports.zip bundles the reports and index once the run
+ends.
+
+The app's batch upload (Path A) runs the same code on a background thread,
+where that session queues fairly behind advisors' searches. Starting an app
+batch deletes batch directories untouched for COI_BATCH_KEEP_DAYS. The CLI is a
+separate process with its own limiter: it shares the app's RPM/TPM buckets
+only when COI_RATE_DB points both at the same file (it warns when unset), and
+never its fair queue, so run large CSVs off-peak or with a low --concurrency.
+"""
+
+import argparse
+import contextvars
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from coi_engine import run_path_a_model
+from coi_geo import validate_zip
+from coi_ratelimit import MAX_CONCURRENCY, RATE_DB_PATH, SEPARATE_LIMITS_WARNING, set_session
+from coi_records import normalize_name, parse_coi_table
+
+# =========================================
+# CONFIG
+# =========================================
+
+# Each report makes two model calls at once (report + COI list).
+BATCH_CONCURRENCY = int(os.getenv("COI_BATCH_CONCURRENCY", str(max(1, MAX_CONCURRENCY // 2))))
+# Where the app writes uploaded batches (one subdirectory per CSV).
+BATCH_DIR = os.getenv("COI_BATCH_DIR", "batch_reports")
+# App batches older than this (no file written since) are deleted when a new one starts; 0 keeps them all.
+BATCH_KEEP_DAYS = float(os.getenv("COI_BATCH_KEEP_DAYS", "30"))
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+INDEX_FILE = "index.csv"
+ARCHIVE_FILE = "reports.zip"
+ERROR_MARK = "⚠️ Error while calling OpenAI"
+
+INTAKE_COLUMNS = ("advisor", "zip", "segments", "events", "communities", "background", "networks")
+INTAKE_LABELS = {
+    "advisor": "Advisor",
+    "zip": "ZIP code",
+    "segments": "Target segments",
+    "events": "Life events",
+    "communities": "Communities",
+    "background": "Advisor background",
+    "networks": "Warm networks",
+}
+# Accepted headers per column, after normalize_name().
+_ALIASES = {
+    "advisor": ("advisor", "advisor name", "name", "advisor id"),
+    "zip": ("zip", "zip code", "main zip", "main zip code", "q1"),
+    "segments": ("segments", "target segments", "q2"),
+    "events": ("events", "life events", "common life events", "q3"),
+    "communities": ("communities", "community", "affinity groups", "q4"),
+    "background": ("background", "advisor background", "professional background", "q5"),
+    "networks": ("networks", "warm networks", "q6"),
+}
+INDEX_COLUMNS = ("row", "advisor", "zip", "status", "cois", "seconds", "file", "error")
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+
+# =========================================
+# INTAKE
+# =========================================
+
+def _row_key(row) -> str:
+    """
+    Identity of a row for the checkpoint: its normalized answers.
+    """
+    raw = json.dumps([" ".join(row[column].split()).casefold() for column in INTAKE_COLUMNS])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def read_intake(text):
+    """
+    Parse intake CSV text into (rows, problems). Each row is a dict of
+    INTAKE_COLUMNS plus "row" (its line number) and "key"; rows with an unusable
+    ZIP are left out and described in problems. Raises ValueError without a ZIP column.
+    """
+    reader = csv.reader(io.StringIO(text.lstrip("\ufeff")))
+    header = next(reader, [])
+    positions = {}
+    for i, name in enumerate(header):
+        normalized = normalize_name(name)
+        for column, aliases in _ALIASES.items():
+            if normalized in aliases and column not in positions:
+                positions[column] = i
+    if "zip" not in positions:
+        raise ValueError("The CSV needs a ZIP code column (e.g. a header named “ZIP code”).")
+
+    rows, problems = [], []
+    for line_number, cells in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in cells):
+            continue
+        cells += [""] * (len(header) - len(cells))
+        row = {column: cells[positions[column]].strip() if column in positions else "" for column in INTAKE_COLUMNS}
+        problem = validate_zip(row["zip"])
+        if problem:
+            problems.append(f"Row {line_number}: {problem}")
+            continue
+        row["row"] = line_number
+        row["key"] = _row_key(row)
+        rows.append(row)
+    return rows, problems
+
+
+def batch_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _report_file(row) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", (row["advisor"] or row["zip"]).casefold()).strip("-")
+    return f"{row['row']:03d}-{slug or 'advisor'}.md"
+
+
+def _report_markdown(row, text) -> str:
+    answers = "\n".join(
+        f"| {INTAKE_LABELS[column]} | {row[column].replace('|', '/')} |"
+        for column in INTAKE_COLUMNS[1:] if row[column]
+    )
+    return (
+        f"# COI Intelligence Report — {row['advisor'] or row['zip']}\n\n"
+        "| Intake | Answer |\n|---|---|\n" + answers + "\n\n" + text.strip() + "\n"
+    )
+
+
+# =========================================
+# RUN
+# =========================================
+
+class BatchRun:
+    """
+    One batch writing into out_dir. Counters can be read from any thread while it runs.
+    """
+
+    def __init__(self, rows, out_dir, concurrency=BATCH_CONCURRENCY, use_cache=True):
+        self.rows = rows
+        self.out_dir = out_dir
+        self.concurrency = max(1, concurrency)
+        self.use_cache = use_cache
+        self.outcomes = {}       # key -> checkpoint entry
+        self.skipped = 0         # already done by an earlier run
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._sections = None    # the batch's own pool for the report and COI calls
+
+    # ---------- Progress ----------
+
+    @property
+    def total(self) -> int:
+        return len(self.rows)
+
+    def counts(self) -> dict:
+        with self._lock:
+            statuses = [entry["status"] for entry in self.outcomes.values()]
+        return {DONE: statuses.count(DONE), FAILED: statuses.count(FAILED), "skipped": self.skipped}
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def cancel(self):
+        """
+        Stop after the reports already running; a later run picks up the rest.
+        """
+        self._cancel.set()
+
+    # ---------- Checkpoint ----------
+
+    def _checkpoint_path(self):
+        return os.path.join(self.out_dir, CHECKPOINT_FILE)
+
+    def _load_checkpoint(self):
+        """
+        Rows finished by an earlier run (latest entry per row wins) whose report file still exists.
+        """
+        entries = {}
+        try:
+            with open(self._checkpoint_path(), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut off by a crash
+                    entries[entry["key"]] = entry
+        except FileNotFoundError:
+            return {}
+        return {
+            key: entry for key, entry in entries.items()
+            if entry["status"] == DONE and os.path.exists(os.path.join(self.out_dir, entry["file"]))
+        }
+
+    def _record(self, entry):
+        with self._lock:
+            self.outcomes[entry["key"]] = entry
+            with open(self._checkpoint_path(), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # ---------- Work ----------
+
+    def _run_row(self, row):
+        if self._cancel.is_set():
+            return
+        started = time.monotonic()
+        entry = {"key": row["key"], "row": row["row"], "advisor": row["advisor"], "zip": row["zip"]}
+        try:
+            text = run_path_a_model(
+                row["zip"], row["segments"], row["events"], row["communities"], row["background"],
+                row["networks"], use_cache=self.use_cache, executor=self._sections,
+            )
+        except Exception as e:
+            text = f"{ERROR_MARK}: {e}"
+        entry["seconds"] = round(time.monotonic() - started, 1)
+        if ERROR_MARK in text:
+            entry.update(status=FAILED, error=text[text.index(ERROR_MARK):][:300], file="", cois=0)
+        else:
+            entry.update(status=DONE, error="", file=_report_file(row), cois=len(parse_coi_table(text)))
+            path = os.path.join(self.out_dir, entry["file"])
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(_report_markdown(row, text))
+            os.replace(f"{path}.tmp", path)
+        self._record(entry)
+
+    def run(self):
+        """
+        Run every row not finished before, then write the index and archive. Blocks until done.
+        """
+        self.started = time.monotonic()
+        os.makedirs(self.out_dir, exist_ok=True)
+        # One fair-queueing session for the whole batch, named after its directory
+        # (fair against the app's sessions only when the batch runs inside the app).
+        set_session(f"batch:{os.path.basename(os.path.normpath(self.out_dir))}")
+        previous = self._load_checkpoint()
+        with self._lock:
+            self.outcomes.update((row["key"], previous[row["key"]]) for row in self.rows if row["key"] in previous)
+            self.skipped = len(self.outcomes)
+        # Identical intake rows share one report.
+        pending = list({row["key"]: row for row in self.rows if row["key"] not in previous}.values())
+        # Two calls per row (report + COI list), each on the batch's own thread.
+        self._sections = ThreadPoolExecutor(max_workers=2 * self.concurrency, thread_name_prefix="coi-batch-call")
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="coi-batch") as pool:
+                # Each task runs in a copy of this context, so it keeps the batch's session.
+                for row in pending:
+                    pool.submit(contextvars.copy_context().run, self._run_row, row)
+        finally:
+            self._sections.shutdown(wait=False)
+            self.write_index()
+            write_archive(self.out_dir)
+            self.finished = time.monotonic()
+        return self
+
+    def write_index(self):
+        with self._lock:
+            outcomes = dict(self.outcomes)
+        path = os.path.join(self.out_dir, INDEX_FILE)
+        with open(f"{path}.tmp", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(INDEX_COLUMNS)
+            for row in self.rows:
+                entry = outcomes.get(row["key"], {"status": PENDING})
+                writer.writerow((
+                    row["row"], row["advisor"], row["zip"], entry["status"], entry.get("cois", ""),
+                    entry.get("seconds", ""), entry.get("file", ""), entry.get("error", ""),
+                ))
+        os.replace(f"{path}.tmp", path)
+
+
+def write_archive(out_dir) -> str:
+    """
+    Zip a batch's reports and index into ARCHIVE_FILE in out_dir; returns its path.
+    """
+    path = os.path.join(out_dir, ARCHIVE_FILE)
+    with zipfile.ZipFile(f"{path}.tmp", "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in sorted(os.listdir(out_dir)):
+            if name.endswith(".md") or name == INDEX_FILE:
+                zf.write(os.path.join(out_dir, name), name)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def archive_path(out_dir):
+    """
+    Path of a finished batch's zip (for download), or None if the batch never finished.
+    Batches finished before the archive was written at the end of a run are zipped once here.
+    """
+    path = os.path.join(out_dir, ARCHIVE_FILE)
+    if os.path.exists(path):
+        return path
+    if not os.path.exists(os.path.join(out_dir, INDEX_FILE)):
+        return None
+    return write_archive(out_dir)
+
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+
+def prune_batches(batch_dir=BATCH_DIR, keep_days=BATCH_KEEP_DAYS) -> int:
+    """
+    Delete batch directories under batch_dir with nothing written for keep_days,
+    except batches still running here. Returns how many were deleted.
+    """
+    if keep_days <= 0:
+        return 0
+    cutoff = time.time() - keep_days * 86400
+    with _batches_lock:
+        running = {os.path.normpath(out_dir) for out_dir, batch in _batches.items() if not batch.done}
+    try:
+        names = os.listdir(batch_dir)
+    except FileNotFoundError:
+        return 0
+    pruned = 0
+    for name in names:
+        path = os.path.join(batch_dir, name)
+        if not os.path.isdir(path) or os.path.normpath(path) in running:
+            continue
+        try:
+            # A directory's mtime moves whenever a report, checkpoint or index lands in it.
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        with _batches_lock:
+            _batches.pop(path, None)
+        pruned += 1
+    return pruned
+
+
+def start_batch(rows, out_dir, concurrency=BATCH_CONCURRENCY, use_cache=True) -> BatchRun:
+    """
+    Run a batch on a background thread and return it. A batch already running
+    into out_dir is returned instead of starting a second one. Old batch
+    directories are pruned first (prune_batches).
+    """
+    prune_batches()
+    with _batches_lock:
+        batch = _batches.get(out_dir)
+        if batch is not None and not batch.done:
+            return batch
+        batch = BatchRun(rows, out_dir, concurrency, use_cache)
+        _batches[out_dir] = batch
+    threading.Thread(target=batch.run, daemon=True, name="coi-batch-run").start()
+    return batch
+
+
+def get_batch(out_dir):
+    with _batches_lock:
+        return _batches.get(out_dir)
+
+
+# =========================================
+# CLI
+# =========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="COI Intelligence Reports for every advisor in an intake CSV.")
+    parser.add_argument("csv", help="intake CSV: advisor, ZIP code, segments, events, communities, background, networks")
+    parser.add_argument("--out", default=None, help="output directory (default: batch_reports/<csv id>)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="reports generated at once")
+    parser.add_argument("--refresh", action="store_true", help="skip the response cache")
+    args = parser.parse_args(argv)
+
+    with open(args.csv, "rb") as f:
+        data = f.read()
+    try:
+        rows, problems = read_intake(data.decode("utf-8-sig"))
+    except ValueError as e:
+        sys.exit(str(e))
+    for problem in problems:
+        print(f"skipped — {problem}", file=sys.stderr)
+    out_dir = args.out or os.path.join(BATCH_DIR, batch_id(data))
+    if not RATE_DB_PATH:
+        print(SEPARATE_LIMITS_WARNING, file=sys.stderr)
+
+    batch = BatchRun(rows, out_dir, args.concurrency, use_cache=not args.refresh)
+    runner = threading.Thread(target=batch.run, daemon=True)
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(5)
+            counts = batch.counts()
+            print(
+                f"{counts[DONE]}/{batch.total} done ({counts['skipped']} from an earlier run), "
+                f"{counts[FAILED]} failed", file=sys.stderr,
+            )
+    except KeyboardInterrupt:
+        batch.cancel()
+        print("stopping after the reports in progress; run again to resume", file=sys.stderr)
+        runner.join()
+    print(os.path.join(out_dir, INDEX_FILE))
+    return 1 if batch.counts()[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Tiered response cache for COI model calls.
+
+Tier 1 is an in-process LRU with TTL. Streamlit imports this module once per
+process, so the LRU is shared by every session served by that process.
+Tier 2 is a SQLite file in WAL mode, shared by all worker processes
+(and replicas mounting the same volume). Expired rows are deleted on write,
+at most every CACHE_PURGE_SECONDS. If the file cannot be opened or created,
+the cache logs a warning and runs memory-only.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("coi.cache")
+
+# =========================================
+# CONFIG
+# =========================================
+
+CACHE_DB_PATH = os.getenv("COI_CACHE_DB", "coi_cache.sqlite3")
+CACHE_TTL_SECONDS = int(os.getenv("COI_CACHE_TTL_SECONDS", str(24 * 3600)))
+CACHE_MEMORY_ENTRIES = int(os.getenv("COI_CACHE_MEMORY_ENTRIES", "256"))
+# A write deletes expired rows from the SQLite tier when the last purge is older than this.
+CACHE_PURGE_SECONDS = float(os.getenv("COI_CACHE_PURGE_SECONDS", "600"))
+
+
+# =========================================
+# KEYS
+# =========================================
+
+def normalize_input(value) -> str:
+    """
+    Trim, collapse whitespace and case-fold so trivially different inputs share a key.
+    """
+    return " ".join(str(value or "").split()).casefold()
+
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(path: str, model: str, system_prompt: str, **inputs) -> str:
+    """
+    Build a stable key from the path, model, system prompt hash and normalized inputs.
+    """
+    payload = {
+        "path": path,
+        "model": model,
+        "prompt": prompt_hash(system_prompt),
+        "inputs": {name: normalize_input(value) for name, value in sorted(inputs.items())},
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# =========================================
+# CACHE
+# =========================================
+
+class ResponseCache:
+    """
+    Two-tier cache: in-process LRU (with TTL) in front of a shared SQLite file.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_memory_entries=CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._purged_at = 0.0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "writes": 0,
+            "purged": 0,
+        }
+        if self.db_path:
+            self._init_db()
+
+    # ---------- SQLite tier ----------
+
+    def _connect(self):
+        """
+        One connection per thread; SQLite connections must not be shared across threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        try:
+            conn = self._connect()
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at);
+                """
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("response cache %s unusable (%s); caching in memory only", self.db_path, e)
+            self._local.conn = None
+            self.db_path = ""
+
+    def _disk_get(self, key):
+        if not self.db_path:
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT value, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        value, stored_at = row
+        if time.time() - stored_at > self.ttl_seconds:
+            return None
+        return stored_at, value
+
+    def _disk_set(self, key, value, stored_at):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, value, stored_at),
+            )
+            if stored_at - self._purged_at >= CACHE_PURGE_SECONDS:
+                self._purged_at = stored_at
+                purged = conn.execute(
+                    "DELETE FROM responses WHERE stored_at < ?", (stored_at - self.ttl_seconds,)
+                ).rowcount
+                with self._lock:
+                    self._stats["purged"] += purged
+            conn.commit()
+        except sqlite3.Error:
+            # The disk tier is best effort; the memory tier still serves this process.
+            pass
+
+    # ---------- Memory tier ----------
+
+    def _memory_put(self, key, stored_at, value):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # ---------- Public API ----------
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._stats["evictions"] += 1
+
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            stored_at, value = entry
+            self._memory_put(key, stored_at, value)
+            self._stats["disk_hits"] += 1
+            return value
+
+    def set(self, key, value):
+        stored_at = time.time()
+        with self._lock:
+            self._memory_put(key, stored_at, value)
+            self._stats["writes"] += 1
+        self._disk_set(key, value, stored_at)
+
+    def stored_at(self, key):
+        """
+        When the entry for key was stored (epoch seconds, even if expired but not yet purged), or None.
+        Does not count as a hit or a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            return entry[0]
+        if not self.db_path:
+            return None
+        try:
+            row = self._connect().execute("SELECT stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Process-wide cache instance, created lazily on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,136 @@
+"""
+Process-wide OpenAI client.
+
+Streamlit re-executes app.py on every rerun, but imported modules are loaded
+once per process. Keeping the client here means every session and every rerun
+shares one client and one keep-alive httpx connection pool, so model calls
+skip the TCP/TLS handshake after the first request.
+"""
+
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+from openai import OpenAI
+
+# =========================================
+# CONFIG
+# =========================================
+
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("COI_CONNECT_TIMEOUT_SECONDS", "5"))
+# Search-model calls routinely take tens of seconds; the read timeout must cover them.
+READ_TIMEOUT_SECONDS = float(os.getenv("COI_READ_TIMEOUT_SECONDS", "120"))
+POOL_TIMEOUT_SECONDS = float(os.getenv("COI_POOL_TIMEOUT_SECONDS", "10"))
+
+MAX_CONNECTIONS = int(os.getenv("COI_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("COI_MAX_KEEPALIVE_CONNECTIONS", "16"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("COI_KEEPALIVE_EXPIRY_SECONDS", "90"))
+
+MAX_RETRIES = int(os.getenv("COI_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 20.0
+
+
+# =========================================
+# CLIENT
+# =========================================
+
+_client = None
+_http_client = None
+_client_lock = threading.Lock()
+
+
+def _build_http_client() -> httpx.Client:
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            READ_TIMEOUT_SECONDS,
+            connect=CONNECT_TIMEOUT_SECONDS,
+            pool=POOL_TIMEOUT_SECONDS,
+        ),
+    )
+
+
+def get_client() -> OpenAI:
+    """
+    Return the process-wide OpenAI client, creating it on first use.
+    SDK retries are disabled; create_with_retries owns the retry policy.
+    """
+    global _client, _http_client
+    with _client_lock:
+        if _client is None:
+            _http_client = _build_http_client()
+            _client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=_http_client,
+                max_retries=0,
+            )
+        return _client
+
+
+def get_http_client() -> httpx.Client:
+    """
+    The shared httpx pool behind get_client().
+    """
+    get_client()
+    return _http_client
+
+
+# =========================================
+# RETRIES (JITTERED EXPONENTIAL BACKOFF)
+# =========================================
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError)):
+        # APITimeoutError is a subclass of APIConnectionError.
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+def _retry_after_seconds(exc: Exception):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after=None) -> float:
+    """
+    Full-jitter exponential backoff, never shorter than a server-sent Retry-After.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_CAP_SECONDS))
+    return delay
+
+
+def create_with_retries(on_rate_limited=None, **kwargs):
+    """
+    client.chat.completions.create with retries on 429, 5xx and connection errors.
+    For stream=True only opening the stream is retried, never a half-read stream.
+    on_rate_limited() is called on every 429 (the rate limiter decides whether to back off).
+    """
+    client = get_client()
+    attempt = 0
+    while True:
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if on_rate_limited is not None and isinstance(e, openai.RateLimitError):
+                on_rate_limited()
+            if attempt >= MAX_RETRIES or not _is_retryable(e):
+                raise
+            time.sleep(backoff_delay(attempt, _retry_after_seconds(e)))
+            attempt += 1
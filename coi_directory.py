@@ -0,0 +1,220 @@
+"""
+Local directory of every COI the model has found.
+
+Parsed COIs are kept in a SQLite file (COI_DIRECTORY_DB) with the lookup ZIP,
+the COI type they were found under and first-seen / last-seen timestamps.
+An FTS5 index over name, role, organization, why-they-fit and type matches a
+lookup's COI type against what was stored, so Path B can answer from the
+directory for the ZIP and its neighbours before (or instead of) calling the
+search model. Entries not seen again within COI_DIRECTORY_STALE_DAYS are not
+served; the next search that finds them refreshes them.
+
+One row per (COI, ZIP): a COI found near several ZIPs is listed under each.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from coi_records import COIRecord, dedupe_records, normalize_name
+
+# =========================================
+# CONFIG
+# =========================================
+
+# Empty turns the directory off.
+DIRECTORY_DB_PATH = os.getenv("COI_DIRECTORY_DB", "coi_directory.sqlite3")
+DIRECTORY_STALE_SECONDS = float(os.getenv("COI_DIRECTORY_STALE_DAYS", "30")) * 24 * 3600
+
+# Lookup types that mean "any kind of COI": no type filter.
+ANY_TYPE_PREFIX = "other"
+
+
+def _type_query(coi_type) -> str:
+    """
+    FTS5 query matching a COI type's parts ("CPA / Tax Advisor" -> "cpa" OR "tax advisor")
+    against the stored role and type, or "" for no filter.
+    """
+    parts = [part.strip() for part in (coi_type or "").split("/") if part.strip()]
+    if not parts or normalize_name(coi_type).startswith(ANY_TYPE_PREFIX):
+        return ""
+    phrases = " OR ".join('"' + part.replace('"', '""') + '"' for part in parts)
+    return f"{{role coi_type}} : ({phrases})"
+
+
+# =========================================
+# DIRECTORY
+# =========================================
+
+class COIDirectory:
+    """
+    SQLite store of found COIs with an FTS5 index; safe to share across threads.
+    """
+
+    def __init__(self, db_path=DIRECTORY_DB_PATH, stale_seconds=DIRECTORY_STALE_SECONDS):
+        self.db_path = db_path
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "rows_served": 0, "added": 0, "refreshed": 0}
+        self._init_db()
+
+    def _connect(self):
+        """
+        One connection per thread; SQLite connections must not be shared across threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cois (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                zip_code TEXT NOT NULL,
+                coi_type TEXT NOT NULL DEFAULT '',
+                name TEXT NOT NULL,
+                role TEXT NOT NULL DEFAULT '',
+                organization TEXT NOT NULL DEFAULT '',
+                link TEXT NOT NULL DEFAULT '',
+                contact TEXT NOT NULL DEFAULT '',
+                why TEXT NOT NULL DEFAULT '',
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                UNIQUE (key, zip_code)
+            );
+            CREATE INDEX IF NOT EXISTS cois_zip_seen ON cois (zip_code, last_seen);
+            CREATE VIRTUAL TABLE IF NOT EXISTS cois_fts USING fts5(
+                name, role, organization, why, coi_type,
+                content='cois', content_rowid='id', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS cois_ai AFTER INSERT ON cois BEGIN
+                INSERT INTO cois_fts (rowid, name, role, organization, why, coi_type)
+                VALUES (new.id, new.name, new.role, new.organization, new.why, new.coi_type);
+            END;
+            CREATE TRIGGER IF NOT EXISTS cois_au AFTER UPDATE ON cois BEGIN
+                INSERT INTO cois_fts (cois_fts, rowid, name, role, organization, why, coi_type)
+                VALUES ('delete', old.id, old.name, old.role, old.organization, old.why, old.coi_type);
+                INSERT INTO cois_fts (rowid, name, role, organization, why, coi_type)
+                VALUES (new.id, new.name, new.role, new.organization, new.why, new.coi_type);
+            END;
+            CREATE TRIGGER IF NOT EXISTS cois_ad AFTER DELETE ON cois BEGIN
+                INSERT INTO cois_fts (cois_fts, rowid, name, role, organization, why, coi_type)
+                VALUES ('delete', old.id, old.name, old.role, old.organization, old.why, old.coi_type);
+            END;
+            """
+        )
+        conn.commit()
+
+    # ---------- Writes ----------
+
+    def add(self, records, zip_code, coi_type="") -> int:
+        """
+        Record COIs found by a lookup for zip_code: new ones are inserted, known
+        ones get the latest details and last_seen. Returns how many were new.
+        """
+        zip_code = (zip_code or "").strip()
+        records = [record for record in records if record.name]
+        if not zip_code or not records:
+            return 0
+        now = time.time()
+        added = 0
+        try:
+            conn = self._connect()
+            with conn:
+                for record in records:
+                    key = "|".join(record.key())
+                    updated = conn.execute(
+                        """
+                        UPDATE cois SET role = ?, organization = ?, link = ?, contact = ?, why = ?,
+                            coi_type = CASE WHEN ? = '' THEN coi_type ELSE ? END, last_seen = ?
+                        WHERE key = ? AND zip_code = ?
+                        """,
+                        (record.role, record.organization, record.link, record.contact, record.why,
+                         coi_type, coi_type, now, key, zip_code),
+                    ).rowcount
+                    if not updated:
+                        conn.execute(
+                            """
+                            INSERT INTO cois (key, zip_code, coi_type, name, role, organization, link,
+                                              contact, why, first_seen, last_seen)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            (key, zip_code, coi_type or "", record.name, record.role, record.organization,
+                             record.link, record.contact, record.why, now, now),
+                        )
+                        added += 1
+        except sqlite3.Error:
+            # Best effort: a failed write only means the next lookup calls the model.
+            return 0
+        with self._lock:
+            self._stats["added"] += added
+            self._stats["refreshed"] += len(records) - added
+        return added
+
+    # ---------- Reads ----------
+
+    def lookup(self, zip_codes, coi_type="", limit=25) -> list:
+        """
+        Fresh COIs of coi_type found for any of zip_codes, the earlier ZIPs first
+        (pass the lookup ZIP, then its neighbours nearest first), most recently
+        seen first within a ZIP, deduplicated. Each record's zip_code is the ZIP it
+        was found for.
+        """
+        zip_codes = [z for z in dict.fromkeys(z.strip() for z in zip_codes if z) if z]
+        if not zip_codes:
+            return []
+        query = _type_query(coi_type)
+        sql = (
+            "SELECT name, role, organization, link, contact, why, zip_code FROM cois "
+            f"WHERE zip_code IN ({', '.join('?' * len(zip_codes))}) AND last_seen >= ?"
+        )
+        params = [*zip_codes, time.time() - self.stale_seconds]
+        if query:
+            sql += " AND id IN (SELECT rowid FROM cois_fts WHERE cois_fts MATCH ?)"
+            params.append(query)
+        try:
+            rows = self._connect().execute(sql + " ORDER BY last_seen DESC", params).fetchall()
+        except sqlite3.Error:
+            return []
+        rank = {zip_code: i for i, zip_code in enumerate(zip_codes)}
+        rows.sort(key=lambda row: rank[row[6]])
+        records = dedupe_records(COIRecord.from_row(row) for row in rows)[:limit]
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["rows_served"] += len(records)
+        return records
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            stats["entries"] = self._connect().execute("SELECT COUNT(*) FROM cois").fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = 0
+        return stats
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """
+    Process-wide directory, created lazily on first use; None when COI_DIRECTORY_DB is empty.
+    """
+    global _directory
+    if not DIRECTORY_DB_PATH:
+        return None
+    with _directory_lock:
+        if _directory is None:
+            _directory = COIDirectory()
+        return _directory
@@ -0,0 +1,1061 @@
+"""
+Prompt and model-call layer for the COI Coach.
+
+Kept out of app.py so it is imported once per process and can be used
+without the Streamlit UI.
+"""
+
+import contextvars
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from coi_cache import get_response_cache, make_cache_key
+import openai
+
+from coi_client import create_with_retries
+from coi_directory import get_directory
+from coi_geo import nearby_areas_prompt, nearby_zips
+from coi_metrics import MISS, REFRESH, UNCACHED, CallTimer, record_cache_hit
+from coi_prompts import (
+    ASK_FOR_MORE_LINE,
+    NEXT_BATCH_PROMPT,
+    PATH_A_COIS_PROMPT,
+    PATH_B_PROMPT,
+    REPORT_LOCAL_PROMPT,
+    REPORT_PROMPT,
+    SYSTEM_PROMPT,
+)
+from coi_ratelimit import current_session, get_rate_limiter
+from coi_similarity import get_intake_index
+from coi_singleflight import CANCEL_POLL_SECONDS, Cancelled, get_single_flight
+from coi_records import COIExclusionIndex, parse_coi_row, parse_coi_table, records_to_markdown
+from coi_report import (
+    estimate_tokens,
+    render_client_focus_table,
+    render_priority_categories_table,
+    select_priority_categories,
+)
+
+# =========================================
+# MODELS
+# =========================================
+
+SEARCH_MODEL = "gpt-4o-mini-search-preview"
+# Fast non-search model for report sections that need reasoning but no browsing.
+REPORT_MODEL = os.getenv("COI_REPORT_MODEL", "gpt-4o-mini")
+
+
+# =========================================
+# CONCURRENCY
+# =========================================
+
+MAX_WORKERS = int(os.getenv("COI_MAX_WORKERS", "16"))
+
+# Process-wide pool for model calls that run side by side (e.g. Path A sections).
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="coi-model")
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Run fn on the shared model-call pool and return its Future.
+    The caller's context (e.g. the rate-limiter session) goes along with it.
+    """
+    return submit_on(_executor, fn, *args, **kwargs)
+
+
+def submit_on(executor, fn, *args, **kwargs):
+    """
+    Like submit(), on a pool of the caller's own (e.g. a batch's, so it cannot
+    take every thread of the shared pool).
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _bounded(slots, fn, *args, **kwargs):
+    with slots:
+        return fn(*args, **kwargs)
+
+
+def interleave_streams(streams: dict, max_concurrency=None, cancel=None):
+    """
+    Drain several delta generators concurrently on the shared pool.
+
+    Yields (name, delta) as deltas arrive from any stream, and (name, None)
+    once a stream is exhausted. Consumption happens on the caller's thread,
+    so it is safe to render from inside the loop.
+    max_concurrency bounds how many streams are open at once.
+    Setting the `cancel` event stops the loop; streams that have not started are
+    skipped and running ones stop at their next delta (or Cancelled).
+    """
+    events = queue.Queue()
+    slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def _drain(name, chunks):
+        if slots is not None:
+            slots.acquire()
+        try:
+            if cancel is not None and cancel.is_set():
+                return
+            for delta in chunks:
+                events.put((name, delta))
+                if cancel is not None and cancel.is_set():
+                    chunks.close()
+                    break
+        except Cancelled:
+            pass
+        except Exception as e:
+            events.put((name, CallFailed(f"⚠️ Error while calling OpenAI: {e}")))
+        finally:
+            if slots is not None:
+                slots.release()
+            events.put((name, None))
+
+    for name, chunks in streams.items():
+        submit(_drain, name, chunks)
+
+    remaining = len(streams)
+    poll = CANCEL_POLL_SECONDS if cancel is not None else None
+    while remaining:
+        if cancel is not None and cancel.is_set():
+            return
+        try:
+            name, delta = events.get(timeout=poll)
+        except queue.Empty:
+            continue
+        if delta is None:
+            remaining -= 1
+        yield name, delta
+
+
+# =========================================
+# CHAT COMPLETION HELPER (BROWSING-CAPABLE SEARCH MODEL)
+# =========================================
+
+def _messages(user_input, system_prompt=SYSTEM_PROMPT):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_input}
+    ]
+
+
+def _flight_key(model, messages, max_completion_tokens, rows=None):
+    """
+    Requests with the same model, prompt and (normalized) user input share one flight.
+    """
+    return make_cache_key(
+        "flight", model, messages[0]["content"],
+        user_input=messages[1]["content"], max_completion_tokens=max_completion_tokens, rows=rows,
+    )
+
+
+# Times a request that still hits 429 after its retries goes back to the end of
+# the rate-limiter queue (by then the limiter has cut concurrency) before failing.
+RATE_LIMIT_REQUEUES = int(os.getenv("COI_RATE_LIMIT_REQUEUES", "2"))
+
+
+def _request_tokens(messages, max_completion_tokens):
+    """
+    Tokens a request is charged up front: prompt estimate plus the completion budget.
+    """
+    return sum(estimate_tokens(message["content"]) for message in messages) + max_completion_tokens
+
+
+def _limited_create(session, messages, max_completion_tokens, model, cancel=None, **kwargs):
+    """
+    create_with_retries behind the process-wide rate limiter.
+    Returns (ticket, response); the caller releases the ticket when the call is done.
+    Raises Cancelled if `cancel` is set while the request waits in the queue.
+    """
+    limiter = get_rate_limiter()
+    tokens = _request_tokens(messages, max_completion_tokens)
+    for requeue in range(RATE_LIMIT_REQUEUES + 1):
+        ticket = limiter.acquire(tokens, session, cancel=cancel)
+        if ticket is None:
+            raise Cancelled()
+        try:
+            return ticket, create_with_retries(
+                model=model,
+                messages=messages,
+                max_completion_tokens=max_completion_tokens,
+                on_rate_limited=ticket.rate_limited,
+                **kwargs,
+            )
+        except openai.RateLimitError:
+            # A 429 uses no tokens: refund the reservation before queueing again.
+            ticket.release(actual_tokens=0, ok=False)
+            if requeue >= RATE_LIMIT_REQUEUES:
+                raise
+        except BaseException:
+            ticket.release(ok=False)
+            raise
+
+
+def _complete_deltas(session, messages, max_completion_tokens, model, cancel=None,
+                     path="", cache=UNCACHED):
+    """
+    One blocking call, shaped like _stream_deltas: yields the whole text once
+    and returns the finish_reason.
+    """
+    timer = CallTimer(path, model, cache)
+    try:
+        ticket, response = _limited_create(session, messages, max_completion_tokens, model)
+    except BaseException as e:
+        timer.finish(e)
+        raise
+    timer.granted(ticket.waited)
+    timer.first_token()
+    usage = getattr(response, "usage", None)
+    timer.usage(usage)
+    timer.finish()
+    ticket.release(actual_tokens=getattr(usage, "total_tokens", None))
+    choice = response.choices[0]
+    if choice.message.content:
+        yield choice.message.content
+    return choice.finish_reason
+
+
+def _complete(session, messages, max_completion_tokens, model, rows=None, path="", cache=UNCACHED):
+    request = partial(_complete_deltas, session, model=model, path=path, cache=cache)
+    return "".join(_continued(request, messages, max_completion_tokens, rows))
+
+
+# =========================================
+# CANCELLATION SAVINGS
+# =========================================
+
+_cancel_lock = threading.Lock()
+_cancel_stats = {"cancelled": 0, "tokens_saved": 0, "seconds_saved": 0.0}
+
+
+def _record_cancellation(max_completion_tokens, streamed_tokens, streaming_seconds):
+    """
+    Estimate what stopping a stream saved: the unused completion budget (an upper
+    bound), and the seconds it would have taken at the stream's own pace (or a
+    whole average call if it was cancelled before any output).
+    """
+    tokens_saved = max(0, max_completion_tokens - streamed_tokens)
+    if streamed_tokens and streaming_seconds > 0:
+        seconds_saved = tokens_saved * streaming_seconds / streamed_tokens
+    else:
+        seconds_saved = get_rate_limiter().average_call_seconds()
+    with _cancel_lock:
+        _cancel_stats["cancelled"] += 1
+        _cancel_stats["tokens_saved"] += tokens_saved
+        _cancel_stats["seconds_saved"] += seconds_saved
+
+
+def cancellation_stats() -> dict:
+    with _cancel_lock:
+        return dict(_cancel_stats)
+
+
+def _stream_deltas(session, messages, max_completion_tokens, model, cancel=None,
+                   path="", cache=UNCACHED):
+    """
+    Stream one upstream request. Setting `cancel` (the flight's event, set once
+    every consumer has gone) stops it: queued requests leave the rate-limiter
+    queue, streaming ones close the HTTP response.
+    Usage comes in the stream's last chunk (stream_options include_usage).
+    """
+    timer = CallTimer(path, model, cache)
+    try:
+        ticket, response = _limited_create(
+            session, messages, max_completion_tokens, model, cancel=cancel,
+            stream=True, stream_options={"include_usage": True},
+        )
+    except BaseException as e:
+        if isinstance(e, Cancelled):
+            _record_cancellation(max_completion_tokens, 0, 0.0)
+        timer.finish(e)
+        raise
+    timer.granted(ticket.waited)
+    prompt_tokens = ticket.tokens - max_completion_tokens
+    streamed = 0
+    first_delta = None
+    finish_reason = None
+    usage = None
+    with ticket:
+        try:
+            for chunk in response:
+                if cancel is not None and cancel.is_set():
+                    seconds = time.monotonic() - first_delta if first_delta is not None else 0.0
+                    _record_cancellation(max_completion_tokens, streamed, seconds)
+                    ticket.release(actual_tokens=prompt_tokens + streamed, ok=False)
+                    raise Cancelled()
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_delta is None:
+                        first_delta = time.monotonic()
+                        timer.first_token()
+                    streamed += estimate_tokens(delta)
+                    yield delta
+        except BaseException as e:
+            timer.usage(usage)
+            timer.finish(e)
+            raise
+        finally:
+            response.close()
+        timer.usage(usage)
+        timer.finish()
+        ticket.release(actual_tokens=getattr(usage, "total_tokens", None))
+    return finish_reason
+
+
+# =========================================
+# TRUNCATED COI TABLES (finish_reason == "length")
+# =========================================
+
+# Output budget per requested COI row (five cells, a link and a one-line reason
+# come to ~60–80 tokens), plus room for notes and the closing question.
+TOKENS_PER_COI_ROW = 80
+COI_BUDGET_OVERHEAD = 250
+FIRST_BATCH_ROWS = 25
+# Follow-up requests for the rows still missing when an answer hits its token limit.
+MAX_CONTINUATIONS = int(os.getenv("COI_MAX_CONTINUATIONS", "2"))
+
+_truncation_lock = threading.Lock()
+_truncation_stats = {"truncated": 0, "continuations": 0, "rows_recovered": 0}
+
+
+def coi_token_budget(rows) -> int:
+    """
+    max_completion_tokens for a COI table of `rows` rows.
+    """
+    return COI_BUDGET_OVERHEAD + rows * TOKENS_PER_COI_ROW
+
+
+def truncation_stats() -> dict:
+    with _truncation_lock:
+        return dict(_truncation_stats)
+
+
+def _count_truncation(key, amount=1):
+    with _truncation_lock:
+        _truncation_stats[key] += amount
+
+
+def _is_table_start(line) -> bool:
+    return line.lstrip().startswith("|")
+
+
+def _whole_rows(deltas, sent):
+    """
+    Pass on the deltas of a generator, except that a table line is held back until its newline
+    arrives, so a row cut off by the token limit never reaches the advisor.
+    Everything passed on is appended to `sent`.
+    Returns (finish_reason, the held-back unfinished line).
+    """
+    line = ""          # current line, while it is (or may still become) a table line
+    passing = False    # current line is prose and already being passed on
+    finish_reason = None
+    try:
+        while True:
+            try:
+                delta = next(deltas)
+            except StopIteration as stop:
+                finish_reason = stop.value
+                break
+            out = []
+            for piece in re.split(r"(\n)", delta):
+                if piece == "\n":
+                    if not passing:
+                        out.append(line)
+                    out.append(piece)
+                    line, passing = "", False
+                elif passing:
+                    out.append(piece)
+                elif piece:
+                    line += piece
+                    if line.strip() and not _is_table_start(line):
+                        out.append(line)
+                        line, passing = "", True
+            text = "".join(out)
+            if text:
+                sent.append(text)
+                yield text
+    finally:
+        deltas.close()
+    return finish_reason, line
+
+
+def _new_rows(deltas, index):
+    """
+    From a continuation answer pass on only COI rows that are not already in
+    the table (the model sometimes repeats the header or a row). Returns the finish_reason.
+    """
+    buffer = ""
+    try:
+        while True:
+            try:
+                buffer += next(deltas)
+            except StopIteration as stop:
+                finish_reason = stop.value
+                break
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                record = parse_coi_row(line)
+                if record is not None and index.add([record]):
+                    _count_truncation("rows_recovered")
+                    yield line.strip() + "\n"
+    finally:
+        deltas.close()
+    # A last line without a newline only counts if the row was closed (see COITableParser).
+    record = parse_coi_row(buffer) if buffer.strip().endswith("|") else None
+    if record is not None and finish_reason != "length" and index.add([record]):
+        _count_truncation("rows_recovered")
+        yield buffer.strip() + "\n"
+    return finish_reason
+
+
+def _continuation_messages(messages, answer_so_far, missing):
+    return messages + [
+        {"role": "assistant", "content": answer_so_far},
+        {"role": "user", "content": (
+            "Your answer was cut off. Continue the COI table with ONLY the next "
+            f"{missing} rows: no header, no rows already listed above, no text after the table."
+        )},
+    ]
+
+
+def _continued(request, messages, max_completion_tokens, rows=None):
+    """
+    Deltas of request(messages, max_completion_tokens) (a _stream_deltas or
+    _complete_deltas partial). For a COI table of `rows` rows that hits the
+    token limit, the unfinished last row is dropped, the missing rows are
+    asked for (up to MAX_CONTINUATIONS times) and stitched on, and the
+    closing question is added here instead of by the model.
+    """
+    if not rows:
+        finish_reason = yield from request(messages, max_completion_tokens)
+        return finish_reason
+    sent = []
+    finish_reason, unfinished = yield from _whole_rows(request(messages, max_completion_tokens), sent)
+    if finish_reason != "length":
+        if unfinished:
+            yield unfinished
+        return finish_reason
+    _count_truncation("truncated")
+    answer = "".join(sent)
+    if answer and not answer.endswith("\n"):
+        answer += "\n"
+        yield "\n"
+    index = COIExclusionIndex(parse_coi_table(answer))
+    for _ in range(MAX_CONTINUATIONS):
+        missing = rows - len(index)
+        if missing <= 0:
+            break
+        _count_truncation("continuations")
+        rows_before = len(index)
+        parts = []
+        for line in _new_rows(
+            request(_continuation_messages(messages, answer, missing), coi_token_budget(missing)), index
+        ):
+            parts.append(line)
+            yield line
+        answer += "".join(parts)
+        if len(index) == rows_before:
+            break
+    yield "\n" + ASK_FOR_MORE_LINE
+    return finish_reason
+
+
+def _run_chat_completion(user_input: str, max_completion_tokens: int, stream: bool = False,
+                         model: str = SEARCH_MODEL, system_prompt: str = SYSTEM_PROMPT, rows=None,
+                         path: str = "", cache: str = UNCACHED):
+    """
+    Wrapper for a web-search-capable model (gpt-4o-mini-search-preview).
+    This model is designed for web search via Chat Completions.
+
+    With stream=True, returns a generator of text deltas instead of the full string.
+    Pass model=REPORT_MODEL for prompts that need no browsing, and the call's own
+    system_prompt from coi_prompts (the full SYSTEM_PROMPT is the fallback).
+    For a COI table pass rows (the row count asked for): an answer cut off at
+    max_completion_tokens is then continued instead of returned short.
+    path and cache label the call's metrics (coi_metrics).
+    Identical concurrent requests are coalesced into one API call (coi_singleflight),
+    and every API call waits its turn in the rate limiter (coi_ratelimit).
+    """
+    if stream:
+        return _stream_chat_completion(
+            user_input, max_completion_tokens, model=model, system_prompt=system_prompt, rows=rows,
+            path=path, cache=cache,
+        )
+    messages = _messages(user_input, system_prompt)
+    try:
+        return get_single_flight().call(
+            _flight_key(model, messages, max_completion_tokens, rows),
+            partial(_complete, current_session(), messages, max_completion_tokens, model, rows, path, cache),
+        )
+    except Exception as e:
+        return CallFailed(f"⚠️ Error while calling OpenAI: {e}")
+
+
+def _stream_chat_completion(user_input: str, max_completion_tokens: int,
+                            model: str = SEARCH_MODEL, system_prompt: str = SYSTEM_PROMPT, rows=None,
+                            path: str = "", cache: str = UNCACHED):
+    """
+    Streaming variant of _run_chat_completion: returns a generator of text deltas.
+    Errors are yielded as the same warning string the blocking call returns.
+    The session is captured now, since the generator is usually drained on a pool thread.
+    """
+    messages = _messages(user_input, system_prompt)
+    session = current_session()
+
+    def produce(cancel):
+        request = partial(_stream_deltas, session, model=model, cancel=cancel, path=path, cache=cache)
+        return _continued(request, messages, max_completion_tokens, rows)
+
+    return _stream_flight(_flight_key(model, messages, max_completion_tokens, rows), produce)
+
+
+class CallFailed(str):
+    """
+    The warning that stands in for an answer when a call fails: returned by a
+    blocking call, or yielded as the last delta of a stream, after whatever
+    text had already arrived. Answers that end in one are never cached.
+    """
+
+
+def _stream_flight(key, produce):
+    try:
+        yield from get_single_flight().stream(key, produce)
+    except Cancelled:
+        raise
+    except Exception as e:
+        yield CallFailed(f"⚠️ Error while calling OpenAI: {e}")
+
+
+# =========================================
+# RESPONSE CACHE
+# =========================================
+
+def _is_cacheable(text) -> bool:
+    return bool(text) and not isinstance(text, CallFailed) and not text.startswith("⚠️ Error")
+
+
+def _completed(chunks):
+    """
+    Pass deltas through unchanged; returns the full text, or None if the call
+    failed (also partway, after some text had arrived).
+    """
+    parts = []
+    failed = False
+    for delta in chunks:
+        failed = failed or isinstance(delta, CallFailed)
+        parts.append(delta)
+        yield delta
+    return None if failed else "".join(parts)
+
+
+def _store_stream(cache, cache_key, chunks, remember=None):
+    """
+    Pass deltas through unchanged and cache the full text once the stream completes cleanly.
+    """
+    text = yield from _completed(chunks)
+    if text is not None and _is_cacheable(text):
+        cache.set(cache_key, text)
+        if remember is not None:
+            remember(text)
+
+
+def _cached_completion(cache_key, user_input, max_completion_tokens, stream, use_cache,
+                       model=SEARCH_MODEL, system_prompt=SYSTEM_PROMPT, rows=None, path="", remember=None):
+    """
+    Serve from the response cache when possible, otherwise call the model and store the result.
+    use_cache=False skips the lookup (refresh) but still stores the fresh answer.
+    remember(text) is called with every fresh answer (not cache hits), see _remember.
+    """
+    cache = get_response_cache()
+    if use_cache:
+        started = time.monotonic()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            record_cache_hit(path, model, time.monotonic() - started)
+            return iter([cached]) if stream else cached
+
+    status = MISS if use_cache else REFRESH
+    if stream:
+        return _store_stream(
+            cache, cache_key,
+            _stream_chat_completion(
+                user_input, max_completion_tokens, model=model, system_prompt=system_prompt, rows=rows,
+                path=path, cache=status,
+            ),
+            remember,
+        )
+
+    result = _run_chat_completion(
+        user_input, max_completion_tokens, model=model, system_prompt=system_prompt, rows=rows,
+        path=path, cache=status,
+    )
+    if _is_cacheable(result):
+        cache.set(cache_key, result)
+        if remember is not None:
+            remember(result)
+    return result
+
+
+# =========================================
+# COI DIRECTORY
+# =========================================
+
+# Path B answers from the directory alone when it holds at least this many fresh
+# COIs for the ZIP and its neighbours; fewer are topped up by the search model.
+DIRECTORY_MIN_ROWS = int(os.getenv("COI_DIRECTORY_MIN_ROWS", "20"))
+
+
+def _remember(zip_code, coi_type=""):
+    """
+    Callback that files the COIs of a finished answer in the directory (coi_directory),
+    or None when the directory is off or the answer is not for one ZIP (fan-outs).
+    """
+    directory = get_directory()
+    zip_codes = parse_zip_list(zip_code)
+    if directory is None or len(zip_codes) != 1:
+        return None
+    return lambda text: directory.add(parse_coi_table(text), zip_codes[0], coi_type)
+
+
+def _remember_stream(chunks, remember):
+    text = yield from _completed(chunks)
+    if text is not None and _is_cacheable(text):
+        remember(text)
+
+
+def _remembered(result, remember, stream):
+    """
+    Pass a model answer through, filing its COIs once it is complete.
+    """
+    if remember is None:
+        return result
+    if stream:
+        return _remember_stream(result, remember)
+    if _is_cacheable(result):
+        remember(result)
+    return result
+
+
+def _directory_rows(zip_code, coi_type) -> list:
+    """
+    Fresh COIs of coi_type already found for the ZIP, then for its neighbours (nearest first).
+    """
+    directory = get_directory()
+    if directory is None:
+        return []
+    zip_codes = [zip_code] + [z for z, _place, _miles in nearby_zips((zip_code or "").strip())]
+    return directory.lookup(zip_codes, coi_type, limit=FIRST_BATCH_ROWS)
+
+
+def _directory_table(records, zip_code) -> str:
+    return (
+        f"#### 📚 From the COI directory — {len(records)} COIs found by earlier searches near {zip_code}\n\n"
+        + records_to_markdown(records)
+    )
+
+
+def _after(head, deltas):
+    yield head
+    yield from deltas
+
+
+# =========================================
+# PATH A — Intelligence Report + First COI Batch
+# =========================================
+
+PATH_A_SECTIONS = ("report", "cois")
+
+
+def _geo_block(zip_code) -> str:
+    """
+    Precomputed nearby areas, so "broaden geographically" costs no extra browsing turns.
+    """
+    nearby = nearby_areas_prompt(zip_code)
+    if not nearby:
+        return ""
+    return (
+        f"{nearby}\n"
+        "If <15 results, broaden into these nearby areas (nearest first) "
+        "instead of working out the geography yourself.\n\n"
+    )
+
+
+def _path_a_intake(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks):
+    return (
+        "You are running PATH A — Personalized COI Strategy with COI List.\n\n"
+        f"Q1 – Main ZIP code: {q1_zip}\n"
+        f"Q2 – Target segments: {q2_segments}\n"
+        f"Q3 – Common life events: {q3_events}\n"
+        f"Q4 – Communities / affinity groups: {q4_comm}\n"
+        f"Q5 – Advisor background: {q5_background}\n"
+        f"Q6 – Warm networks: {q6_networks}\n\n"
+    )
+
+
+# The model writes sections 2 and 4; section 3 is spliced in before this heading.
+CHANNELS_HEADING = "#### 4)"
+
+
+def _splice_local_tables(chunks, overview, categories):
+    """
+    Wrap the model's themes/channels deltas with the locally rendered tables:
+    overview first (so the report shows instantly), categories before the
+    channels heading, or at the end if the heading never appears.
+    """
+    yield overview + "\n\n"
+    inserted = False
+    mid_line = False
+    buffer = ""
+    for delta in chunks:
+        if inserted:
+            yield delta
+            continue
+        buffer += delta
+        while buffer and not inserted:
+            if mid_line:
+                newline = buffer.find("\n")
+                if newline == -1:
+                    yield buffer
+                    buffer = ""
+                    break
+                yield buffer[:newline + 1]
+                buffer = buffer[newline + 1:]
+                mid_line = False
+            elif buffer.startswith(CHANNELS_HEADING):
+                yield categories + "\n\n"
+                inserted = True
+                yield buffer
+                buffer = ""
+            elif CHANNELS_HEADING.startswith(buffer):
+                break  # could still turn into the heading; wait for more text
+            else:
+                mid_line = True
+    if buffer:
+        yield buffer
+    if not inserted:
+        yield "\n\n" + categories
+
+
+def _local_report(user_input, max_completion_tokens, stream, use_cache, cache_key, overview, categories):
+    result = _cached_completion(
+        cache_key, user_input, max_completion_tokens, stream, use_cache,
+        model=REPORT_MODEL, system_prompt=REPORT_LOCAL_PROMPT, path="A-report",
+    )
+    if stream:
+        return _splice_local_tables(result, overview, categories)
+    return "".join(_splice_local_tables([result], overview, categories))
+
+
+def local_report_tables(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks):
+    """
+    The two deterministic report tables: (client focus overview, priority COI categories).
+    """
+    return (
+        render_client_focus_table(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks),
+        render_priority_categories_table(q2_segments, q3_events, q4_comm),
+    )
+
+
+def local_tables_token_savings(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks) -> int:
+    """
+    Estimated completion tokens the model no longer spends per Path A run
+    because sections 1 and 3 are rendered locally.
+    """
+    return sum(
+        estimate_tokens(table)
+        for table in local_report_tables(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks)
+    )
+
+
+def run_path_a_sections(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks,
+                        stream=False, use_cache=True, local_tables=True, executor=None):
+    """
+    Start the two Path A calls side by side:
+    - "report": the COI Intelligence Report, on the fast non-search model
+    - "cois": the first batch of real COIs, on the search model
+
+    With local_tables=True, report sections 1 and 3 are rendered locally and the
+    model only writes sections 2 and 4 (see coi_report).
+
+    With stream=True, returns {section: generator of deltas}; the generators are lazy,
+    drain them together with interleave_streams().
+    Otherwise returns {section: Future} already running on the shared pool, or on
+    `executor` if one is given.
+    """
+    intake = _path_a_intake(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks)
+    if local_tables:
+        overview, categories = local_report_tables(
+            q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks
+        )
+        chosen = ", ".join(
+            category for category, _why in select_priority_categories(q2_segments, q3_events, q4_comm)
+        )
+        report_input = intake + (
+            "This request covers ONLY sections 2 and 4 of the COI Intelligence Report. "
+            "The app already shows section 1 (Client Focus Overview) and "
+            "section 3 (Priority COI Categories); do NOT output them.\n"
+            f"Priority COI categories already chosen: {chosen}\n"
+            "Follow the COI System Rules strictly:\n"
+            "1) Start with the heading '#### 2) Opportunity Themes' and write 3–5 concise themes.\n"
+            f"2) Then the heading '{CHANNELS_HEADING} Opportunity Channels' and 2–3 short sentences.\n"
+            "3) Do NOT browse and do NOT list individual COIs.\n"
+            "4) Do NOT end with the question about more COIs."
+        )
+    else:
+        report_input = intake + (
+            "This request covers ONLY the COI Intelligence Report. "
+            "A separate search request returns the COI list.\n"
+            "Follow the COI System Rules strictly:\n"
+            "1) Build the full COI Intelligence Report (sections 1–4).\n"
+            "2) Do NOT browse and do NOT list individual COIs.\n"
+            "3) Do NOT end with the question about more COIs."
+        )
+    cois_input = intake + _geo_block(q1_zip) + (
+        "This request covers ONLY the COI list. "
+        "The Intelligence Report is produced separately.\n"
+        "Follow the COI System Rules strictly:\n"
+        "1) Skip the Intelligence Report.\n"
+        "2) Perform browsing and return the first batch of 20–25 real COIs.\n"
+        "3) Use required table format.\n"
+        "4) End with the required question."
+    )
+
+    # Rephrased answers for the same ZIP ("small biz owners, young families") share the
+    # cache entries of the first near-identical intake (coi_similarity); sections 1 and 3
+    # are still rendered from these answers. A refresh (use_cache=False) writes under the
+    # same shared key, so the next normal submit of either phrasing gets the fresh answer.
+    answers = (q2_segments, q3_events, q4_comm, q5_background, q6_networks)
+    intake_id = get_intake_index().canonical(q1_zip, answers)
+    if local_tables:
+        report_call = partial(
+            _local_report, report_input, 500, stream, use_cache,
+            make_cache_key("A-report-local", REPORT_MODEL, REPORT_LOCAL_PROMPT, intake=intake_id),
+            overview, categories,
+        )
+    else:
+        report_call = partial(
+            _cached_completion,
+            make_cache_key("A-report", REPORT_MODEL, REPORT_PROMPT, intake=intake_id),
+            report_input, 900, stream, use_cache, model=REPORT_MODEL, system_prompt=REPORT_PROMPT,
+            path="A-report",
+        )
+    cois_call = partial(
+        _cached_completion,
+        make_cache_key("A-cois", SEARCH_MODEL, PATH_A_COIS_PROMPT, intake=intake_id),
+        cois_input, coi_token_budget(FIRST_BATCH_ROWS), stream, use_cache,
+        system_prompt=PATH_A_COIS_PROMPT, rows=FIRST_BATCH_ROWS, path="A-cois", remember=_remember(q1_zip),
+    )
+
+    calls = {"report": report_call, "cois": cois_call}
+    if stream:
+        return {name: call() for name, call in calls.items()}
+    return {name: submit_on(executor or _executor, call) for name, call in calls.items()}
+
+
+def join_path_a_sections(sections: dict) -> str:
+    """
+    Combine section texts into the single Path A result, report first.
+    """
+    return "\n\n".join(sections[name] for name in PATH_A_SECTIONS if sections.get(name))
+
+
+def run_path_a_model(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks,
+                     use_cache=True, executor=None):
+    """
+    Build the COI Intelligence Report and return the first batch of real COIs.
+    The report and the COI search run concurrently (see run_path_a_sections; to
+    stream them, drain run_path_a_sections(..., stream=True) instead).
+    With use_cache=False, bypasses the response cache for this query.
+    With executor, the two calls run on that pool instead of the shared one.
+    """
+    sections = run_path_a_sections(
+        q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks,
+        use_cache=use_cache, executor=executor,
+    )
+    return join_path_a_sections({name: future.result() for name, future in sections.items()})
+
+
+# =========================================
+# PATH B — Quick COI Lookup
+# =========================================
+
+def path_b_cache_key(zip_code, coi_type, extra_context) -> str:
+    return make_cache_key(
+        "B", SEARCH_MODEL, PATH_B_PROMPT,
+        zip=zip_code, coi_type=coi_type, context=extra_context,
+    )
+
+
+def directory_covers(zip_code, coi_type, extra_context="") -> bool:
+    """
+    True when run_path_b_model would answer this lookup from the directory alone.
+    """
+    return not extra_context.strip() and len(_directory_rows(zip_code, coi_type)) >= DIRECTORY_MIN_ROWS
+
+
+def run_path_b_model(zip_code, coi_type, extra_context, stream=False, use_cache=True):
+    """
+    Return ONLY the first batch of 20–25 COIs for the chosen type.
+    With stream=True, returns a generator of text deltas.
+    With use_cache=False, bypasses the response cache and the directory for this query.
+
+    Without extra context, COIs earlier searches found for the ZIP and its
+    neighbours (coi_directory) come first: with DIRECTORY_MIN_ROWS of them no model
+    call is made, with fewer the model is asked only for the missing rows (unless
+    the response cache already has an answer for the lookup). The directory only
+    knows ZIP and COI type, so a lookup with extra context ("French-speaking
+    expats") goes to the cache and then the model. Every answer is filed back into
+    the directory, and the topped-up one is cached like a full answer.
+    """
+    cache_key = path_b_cache_key(zip_code, coi_type, extra_context)
+    if use_cache and not extra_context.strip():
+        started = time.monotonic()
+        known = _directory_rows(zip_code, coi_type)
+        if len(known) >= DIRECTORY_MIN_ROWS:
+            record_cache_hit("B", "directory", time.monotonic() - started)
+            text = _directory_table(known, zip_code) + "\n\n" + ASK_FOR_MORE_LINE
+            return iter([text]) if stream else text
+        if known:
+            cache = get_response_cache()
+            cached = cache.get(cache_key)
+            if cached is not None:
+                record_cache_hit("B", SEARCH_MODEL, time.monotonic() - started)
+                return iter([cached]) if stream else cached
+            head = _directory_table(known, zip_code) + "\n\n#### 🔎 New in this search\n\n"
+            new = run_next_batch(
+                {"ZIP code": zip_code, "COI type(s)": coi_type, "Extra context": extra_context},
+                COIExclusionIndex(known).digest(), FIRST_BATCH_ROWS - len(known), stream=stream, path="B",
+            )
+            if stream:
+                return _store_stream(cache, cache_key, _after(head, new))
+            if _is_cacheable(new):
+                cache.set(cache_key, head + new)
+            return head + new
+
+    user_input = (
+        "You are running PATH B — Quick COI Lookup.\n\n"
+        f"ZIP code: {zip_code}\n"
+        f"COI type(s): {coi_type}\n"
+        f"Extra context: {extra_context}\n\n"
+        + _geo_block(zip_code) +
+        "Follow the COI System Rules.\n"
+        "Skip the Intelligence Report.\n"
+        "Immediately perform browsing and return ONLY:\n"
+        "- First COI batch (20–25 results)\n"
+        "- Required COI table format\n\n"
+        "End with the required line about adding more COIs."
+    )
+
+    return _cached_completion(
+        cache_key, user_input, coi_token_budget(FIRST_BATCH_ROWS), stream, use_cache,
+        system_prompt=PATH_B_PROMPT, rows=FIRST_BATCH_ROWS, path="B", remember=_remember(zip_code, coi_type),
+    )
+
+
+# =========================================
+# PATH B — Multi-type / multi-ZIP fan-out
+# =========================================
+
+COI_TYPES = [
+    "CPA / Tax Advisor",
+    "Estate Planning Attorney",
+    "Immigration Attorney",
+    "Family Law / Divorce Attorney",
+    "Realtor",
+    "Mortgage Lender / Broker",
+    "Pediatrician / OB-GYN",
+    "School / Education Professional",
+    "Business Banker / RM",
+    "Business Consultant / Career Coach",
+    "Community / Cultural Organization",
+    "Other / Mixed COIs",
+]
+
+# Sub-queries per fan-out, and how many run at once. Keeping them equal means
+# a full fan-out finishes in about the time of its slowest single lookup.
+FANOUT_MAX_QUERIES = int(os.getenv("COI_FANOUT_MAX_QUERIES", "8"))
+FANOUT_MAX_CONCURRENCY = int(os.getenv("COI_FANOUT_MAX_CONCURRENCY", "8"))
+
+
+def parse_zip_list(text) -> list:
+    """
+    Split "07302, 07310 07030;07087" into unique ZIPs, keeping input order.
+    """
+    zips = []
+    for part in re.split(r"[\s,;]+", text or ""):
+        if part and part not in zips:
+            zips.append(part)
+    return zips
+
+
+def fanout_queries(zip_codes, coi_types) -> list:
+    """
+    The (zip, coi_type) sub-queries for a fan-out, capped at FANOUT_MAX_QUERIES.
+    """
+    return [(z, t) for z in zip_codes for t in coi_types][:FANOUT_MAX_QUERIES]
+
+
+def run_path_b_fanout(zip_codes, coi_types, extra_context, stream=False, use_cache=True):
+    """
+    One run_path_b_model call per (zip, coi_type) pair, run concurrently.
+
+    With stream=True, returns {(zip, coi_type): generator}; drain them with
+    interleave_streams(..., max_concurrency=FANOUT_MAX_CONCURRENCY).
+    Otherwise returns {(zip, coi_type): Future}, bounded the same way.
+    """
+    queries = fanout_queries(zip_codes, coi_types)
+    if stream:
+        return {
+            (z, t): run_path_b_model(z, t, extra_context, stream=True, use_cache=use_cache)
+            for z, t in queries
+        }
+    slots = threading.BoundedSemaphore(FANOUT_MAX_CONCURRENCY)
+    return {
+        (z, t): submit(_bounded, slots, run_path_b_model, z, t, extra_context, use_cache=use_cache)
+        for z, t in queries
+    }
+
+
+# =========================================
+# MORE COIs — Follow-up batches (both paths)
+# =========================================
+
+MAX_TOTAL_COIS = 125
+NEXT_BATCH_SIZE = 20
+
+
+def run_next_batch(context: dict, exclusion_digest: str, batch_size=NEXT_BATCH_SIZE, stream=False,
+                   path="more"):
+    """
+    Return the next batch of NEW COIs for an existing search.
+    Sends only the search context and a compact exclusion digest, never the prior
+    conversation, so every batch costs about the same. The new COIs are filed in
+    the directory under the context's ZIP and COI type.
+    """
+    context_lines = "\n".join(f"{label}: {value}" for label, value in context.items() if value)
+    user_input = (
+        "You are running a FOLLOW-UP COI batch (the advisor asked for more COIs).\n\n"
+        f"{context_lines}\n\n"
+        + _geo_block(context.get("ZIP code")) +
+        "Already returned — do NOT repeat any of these (name @ website):\n"
+        f"{exclusion_digest or '(none)'}\n\n"
+        "Follow the COI System Rules.\n"
+        "Skip the Intelligence Report.\n"
+        f"Perform browsing and return ONLY the next {batch_size} NEW real COIs.\n"
+        "Use the required COI table format.\n\n"
+        "End with the required line about adding more COIs."
+    )
+    result = _run_chat_completion(
+        user_input, max_completion_tokens=coi_token_budget(batch_size), stream=stream,
+        system_prompt=NEXT_BATCH_PROMPT, rows=batch_size, path=path,
+    )
+    return _remembered(result, _remember(context.get("ZIP code"), context.get("COI type(s)", "")), stream)
+
@@ -0,0 +1,306 @@
+"""
+Local US ZIP code centroid index.
+
+Backs two things without any API call:
+- validating a ZIP before we pay for a search
+- precomputing the nearby ZIPs / towns the model should broaden into,
+  instead of letting it spend browsing turns working them out
+
+The index is a packed binary file (data/us_zip_centroids.bin.gz) loaded lazily
+on first use into flat typed arrays (memoryviews over one bytes buffer, no
+per-ZIP Python objects). A coarse lat/lon grid is built at load time so radius
+and nearest-neighbor queries only scan a handful of cells.
+
+Rebuild the data file from the MIT-licensed `zipcodes` package dataset with:
+
+    python coi_geo.py build path/to/zips.json.bz2
+"""
+
+import bisect
+import gzip
+import math
+import os
+import re
+import struct
+import sys
+import threading
+from functools import lru_cache
+
+DATA_PATH = os.getenv(
+    "COI_ZIP_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "us_zip_centroids.bin.gz"),
+)
+
+MAGIC = b"ZIPC0001"
+_HEADER = struct.Struct("<8sII")  # magic, zip count, place count
+COORD_SCALE = 10_000              # lat/lon stored as int32 degrees * 1e4
+GRID_DEGREES = 0.25               # grid cell size for spatial queries
+EARTH_RADIUS_MILES = 3958.8
+
+NEARBY_RADIUS_MILES = float(os.getenv("COI_NEARBY_RADIUS_MILES", "10"))
+NEARBY_MAX_ZIPS = int(os.getenv("COI_NEARBY_MAX_ZIPS", "8"))
+
+_ZIP_FORMAT = re.compile(r"^\d{5}$")
+
+# ZIP kinds, from the dataset's zip_code_type. Only STANDARD ZIPs are offered as
+# neighbors; PO Box / single-organization / military ZIPs are still valid input.
+KIND_STANDARD, KIND_PO_BOX, KIND_UNIQUE, KIND_MILITARY = range(4)
+_KINDS = {"STANDARD": KIND_STANDARD, "PO BOX": KIND_PO_BOX, "UNIQUE": KIND_UNIQUE, "MILITARY": KIND_MILITARY}
+
+
+# =========================================
+# INDEX
+# =========================================
+
+class ZipIndex:
+    """
+    Sorted ZIP codes with parallel centroid / place arrays and a spatial grid.
+    """
+
+    __slots__ = ("_buffer", "zips", "lats", "lons", "place_ids", "kinds", "places", "_grid")
+
+    def __init__(self, buffer: bytes):
+        magic, count, place_count = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not a ZIP centroid index file")
+        self._buffer = buffer
+        view = memoryview(buffer)
+        offset = _HEADER.size
+        self.zips = view[offset:offset + 4 * count].cast("I")
+        offset += 4 * count
+        self.lats = view[offset:offset + 4 * count].cast("i")
+        offset += 4 * count
+        self.lons = view[offset:offset + 4 * count].cast("i")
+        offset += 4 * count
+        self.place_ids = view[offset:offset + 2 * count].cast("H")
+        offset += 2 * count
+        self.kinds = view[offset:offset + count]
+        offset += count
+        self.places = bytes(view[offset:]).decode("utf-8").split("\n")
+        if len(self.places) != place_count:
+            raise ValueError("corrupt ZIP centroid index file")
+
+        self._grid = {}
+        for i in range(count):
+            self._grid.setdefault(self._cell(self.lats[i], self.lons[i]), []).append(i)
+
+    def __len__(self):
+        return len(self.zips)
+
+    @staticmethod
+    def _cell(lat_e4, lon_e4):
+        step = GRID_DEGREES * COORD_SCALE
+        return (int(lat_e4 // step), int(lon_e4 // step))
+
+    def position(self, zip_code):
+        """
+        Array position of a 5-digit ZIP, or None if unknown.
+        """
+        if not _ZIP_FORMAT.match(zip_code or ""):
+            return None
+        target = int(zip_code)
+        i = bisect.bisect_left(self.zips, target)
+        if i < len(self.zips) and self.zips[i] == target:
+            return i
+        return None
+
+    def zip_at(self, i) -> str:
+        return f"{self.zips[i]:05d}"
+
+    def place_at(self, i) -> str:
+        return self.places[self.place_ids[i]]
+
+    def coords_at(self, i):
+        return self.lats[i] / COORD_SCALE, self.lons[i] / COORD_SCALE
+
+    def within_radius(self, lat, lon, radius_miles, kind=None):
+        """
+        [(miles, position)] of every ZIP centroid within radius, nearest first.
+        Pass kind=KIND_STANDARD to skip PO Box / unique / military ZIPs.
+        """
+        lat_span = math.degrees(radius_miles / EARTH_RADIUS_MILES)
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        lon_span = lat_span / cos_lat
+        lo_lat, lo_lon = self._cell((lat - lat_span) * COORD_SCALE, (lon - lon_span) * COORD_SCALE)
+        hi_lat, hi_lon = self._cell((lat + lat_span) * COORD_SCALE, (lon + lon_span) * COORD_SCALE)
+
+        # Cheap equirectangular prefilter in scaled integer degrees (slightly generous),
+        # exact haversine only for the survivors.
+        lat_e4, lon_e4 = lat * COORD_SCALE, lon * COORD_SCALE
+        limit_e4 = (lat_span * 1.01 * COORD_SCALE) ** 2
+        lats, lons, kinds = self.lats, self.lons, self.kinds
+
+        found = []
+        for cell_lat in range(lo_lat, hi_lat + 1):
+            for cell_lon in range(lo_lon, hi_lon + 1):
+                for i in self._grid.get((cell_lat, cell_lon), ()):
+                    if kind is not None and kinds[i] != kind:
+                        continue
+                    d_lat = lats[i] - lat_e4
+                    d_lon = (lons[i] - lon_e4) * cos_lat
+                    if d_lat * d_lat + d_lon * d_lon > limit_e4:
+                        continue
+                    miles = haversine_miles(lat, lon, *self.coords_at(i))
+                    if miles <= radius_miles:
+                        found.append((miles, i))
+        found.sort()
+        return found
+
+    def nearest(self, lat, lon, k, max_radius_miles=100.0, kind=None):
+        """
+        [(miles, position)] of the k nearest ZIP centroids, searching outward.
+        """
+        radius = 5.0
+        while True:
+            found = self.within_radius(lat, lon, radius, kind=kind)
+            if len(found) >= k or radius >= max_radius_miles:
+                return found[:k]
+            radius *= 2
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+_index = None
+_index_error = None
+_index_lock = threading.Lock()
+
+
+def get_zip_index():
+    """
+    The process-wide index, loaded on first use. None if the data file is unavailable.
+    """
+    global _index, _index_error
+    if _index is not None or _index_error is not None:
+        return _index
+    with _index_lock:
+        if _index is None and _index_error is None:
+            try:
+                with gzip.open(DATA_PATH, "rb") as f:
+                    _index = ZipIndex(f.read())
+            except (OSError, ValueError, struct.error) as e:
+                _index_error = e
+    return _index
+
+
+# =========================================
+# APP HELPERS
+# =========================================
+
+def validate_zip(zip_code):
+    """
+    Return None if the ZIP looks usable, else a short reason for the advisor.
+    Without the index file only the 5-digit format is checked.
+    """
+    zip_code = (zip_code or "").strip()
+    if not _ZIP_FORMAT.match(zip_code):
+        return f"“{zip_code}” is not a 5-digit ZIP code."
+    index = get_zip_index()
+    if index is not None and index.position(zip_code) is None:
+        return f"“{zip_code}” is not a known US ZIP code."
+    return None
+
+
+def place_name(zip_code) -> str:
+    """
+    "City, ST" for a ZIP, or "" if unknown.
+    """
+    index = get_zip_index()
+    position = index.position((zip_code or "").strip()) if index is not None else None
+    return index.place_at(position) if position is not None else ""
+
+
+@lru_cache(maxsize=4096)
+def nearby_zips(zip_code, radius_miles=NEARBY_RADIUS_MILES, limit=NEARBY_MAX_ZIPS):
+    """
+    ((zip, "City, ST", miles), ...) for ZIPs near zip_code, nearest first, excluding itself.
+    Falls back to the nearest neighbors when nothing lies inside the radius (rural ZIPs).
+    """
+    index = get_zip_index()
+    position = index.position((zip_code or "").strip()) if index is not None else None
+    if position is None:
+        return ()
+    lat, lon = index.coords_at(position)
+    found = index.within_radius(lat, lon, radius_miles, kind=KIND_STANDARD)
+    if len(found) <= 1:
+        found = index.nearest(lat, lon, limit + 1, kind=KIND_STANDARD)
+    return tuple(
+        (index.zip_at(i), index.place_at(i), round(miles, 1))
+        for miles, i in found
+        if i != position
+    )[:limit]
+
+
+def nearby_areas_prompt(zip_code) -> str:
+    """
+    Prompt line listing where to broaden the search, or "" if the ZIP is unknown.
+    """
+    nearby = nearby_zips((zip_code or "").strip())
+    if not nearby:
+        return ""
+    home = place_name(zip_code)
+    towns = []
+    for _zip, place, _miles in nearby:
+        if place != home and place not in towns:
+            towns.append(place)
+    zips = ", ".join(f"{z} ({miles} mi)" for z, _place, miles in nearby)
+    line = f"Main area: {home}. Nearby ZIPs to broaden into, nearest first: {zips}."
+    if towns:
+        line += f" Nearby towns: {'; '.join(towns)}."
+    return line
+
+
+# =========================================
+# BUILD
+# =========================================
+
+def build_index_file(source_path, out_path=DATA_PATH):
+    """
+    Pack the `zipcodes` package dataset (zips.json.bz2) into the binary index file.
+    Only active ZIPs with coordinates are kept.
+    """
+    import bz2
+    import json
+
+    with bz2.open(source_path, "rt", encoding="utf-8") as f:
+        rows = json.load(f)
+
+    entries = []
+    for row in rows:
+        if not row.get("active") or not row.get("lat") or not row.get("long"):
+            continue
+        entries.append((
+            int(row["zip_code"]),
+            round(float(row["lat"]) * COORD_SCALE),
+            round(float(row["long"]) * COORD_SCALE),
+            f"{row['city']}, {row['state']}",
+            _KINDS.get(row.get("zip_code_type"), KIND_STANDARD),
+        ))
+    entries.sort()
+
+    places = sorted({e[3] for e in entries})
+    place_ids = {place: i for i, place in enumerate(places)}
+    count = len(entries)
+    payload = b"".join((
+        _HEADER.pack(MAGIC, count, len(places)),
+        struct.pack(f"<{count}I", *(e[0] for e in entries)),
+        struct.pack(f"<{count}i", *(e[1] for e in entries)),
+        struct.pack(f"<{count}i", *(e[2] for e in entries)),
+        struct.pack(f"<{count}H", *(place_ids[e[3]] for e in entries)),
+        bytes(e[4] for e in entries),
+        "\n".join(places).encode("utf-8"),
+    ))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with gzip.GzipFile(out_path, "wb", mtime=0) as f:
+        f.write(payload)
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "build":
+        sys.exit("usage: python coi_geo.py build path/to/zips.json.bz2")
+    print(f"wrote {build_index_file(sys.argv[2])} ZIPs to {DATA_PATH}")
@@ -0,0 +1,221 @@
+"""
+Process-owned background jobs for model searches.
+
+A Streamlit rerun (any widget interaction, switching paths) restarts the script
+from the top, so a search run inline under st.spinner is either redone or tied
+to the script thread. Instead the UI submits the search here and keeps only
+the job id in st.session_state; the job keeps running on this process's pool,
+collecting partial text, and the UI polls it until it is done.
+
+JOB_WORKERS bounds how many searches run on the server at once; extra jobs
+wait in the pool's queue with status "queued".
+
+Job.cancel() stops a job: its streams leave the rate-limiter queue or close
+their HTTP responses, unless another session is still sharing the same
+upstream call (coi_singleflight).
+"""
+
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from coi_engine import interleave_streams
+from coi_ratelimit import current_session
+from coi_records import COIRecord, COITableParser
+from coi_singleflight import cancel_scope
+
+# =========================================
+# CONFIG
+# =========================================
+
+JOB_WORKERS = int(os.getenv("COI_JOB_WORKERS", "8"))
+# Sessions drop a job once they have collected its result; jobs nobody
+# collected (the session went away) are kept this long after finishing.
+JOB_TTL_SECONDS = float(os.getenv("COI_JOB_TTL_SECONDS", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+# =========================================
+# JOB
+# =========================================
+
+class Job:
+    """
+    One search: named delta streams drained together, with partial text per stream.
+    COI rows are parsed as deltas arrive (one COITableParser per stream), so live
+    views read row counts without re-parsing the text so far on every poll.
+    """
+
+    __slots__ = (
+        "id", "kind", "session", "status", "error", "_lock", "_parts", "_parsers", "_section_seconds",
+        "_cancel", "created", "started", "first_token", "finished",
+    )
+
+    def __init__(self, kind, names, session=""):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session = session
+        self.status = QUEUED
+        self.error = None
+        self._lock = threading.Lock()
+        self._parts = {name: [] for name in names}
+        self._parsers = {name: COITableParser() for name in names}
+        self._section_seconds = {}
+        self._cancel = threading.Event()
+        self.created = time.monotonic()
+        self.started = None
+        self.first_token = None
+        self.finished = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def cancel(self) -> bool:
+        """
+        Stop the job if it is still queued or running. Returns True if it was.
+        """
+        if self.done:
+            return False
+        self._cancel.set()
+        self.status = CANCELLED
+        self.finished = time.monotonic()
+        return True
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.created
+
+    def texts(self) -> dict:
+        """
+        {name: text so far}; complete once the job is done.
+        """
+        with self._lock:
+            return {name: "".join(parts) for name, parts in self._parts.items()}
+
+    def row_counts(self) -> dict:
+        """
+        {name: COI rows parsed so far}.
+        """
+        with self._lock:
+            return {name: len(parser.records) for name, parser in self._parsers.items()}
+
+    def records(self, name) -> list:
+        """
+        Copies of the COI rows parsed so far from one stream (callers may merge them).
+        """
+        with self._lock:
+            return [COIRecord.from_row(record.to_row()) for record in self._parsers[name].records]
+
+    def finished_sections(self) -> set:
+        with self._lock:
+            return set(self._section_seconds)
+
+    def timing(self) -> dict:
+        """
+        Time to first token, total and per-stream seconds, measured from job start.
+        """
+        start = self.started or self.created
+        total = (self.finished or time.monotonic()) - start
+        with self._lock:
+            sections = dict(self._section_seconds)
+        ttft = self.first_token - start if self.first_token is not None else total
+        return {"ttft": ttft, "total": total, "sections": sections}
+
+    def _append(self, name, delta):
+        with self._lock:
+            if self.first_token is None:
+                self.first_token = time.monotonic()
+            self._parts[name].append(delta)
+            self._parsers[name].feed(delta)
+
+    def _finish_section(self, name):
+        with self._lock:
+            self._parsers[name].close()
+            self._section_seconds[name] = time.monotonic() - (self.started or self.created)
+
+
+# =========================================
+# RUNNER
+# =========================================
+
+class JobRunner:
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="coi-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, kind, streams: dict, max_concurrency=None) -> Job:
+        """
+        Run {name: delta iterable} as one job and return it straight away.
+        The iterables should be lazy (e.g. run_path_b_model(..., stream=True)),
+        so nothing reaches the API before the job gets a worker.
+        """
+        self._prune()
+        job = Job(kind, streams, current_session())
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(contextvars.copy_context().run, self._run, job, streams, max_concurrency)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def drop(self, job_id):
+        """
+        Forget a job (its text and parsed rows) once its session has collected or cancelled it.
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _run(self, job, streams, max_concurrency):
+        job.started = time.monotonic()
+        job.status = RUNNING
+        if job._cancel.is_set():
+            job.status = CANCELLED
+            return
+        cancel_scope(job._cancel)
+        try:
+            for name, delta in interleave_streams(
+                streams, max_concurrency=max_concurrency, cancel=job._cancel
+            ):
+                if delta is None:
+                    job._finish_section(name)
+                else:
+                    job._append(name, delta)
+            if not job._cancel.is_set():
+                job.status = DONE
+        except Exception as e:
+            job.error = e
+            job.status = FAILED
+        finally:
+            job.finished = job.finished or time.monotonic()
+
+    def _prune(self):
+        cutoff = time.monotonic() - JOB_TTL_SECONDS
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.done and j.finished < cutoff]:
+                del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        self._prune()
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
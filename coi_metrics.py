@@ -0,0 +1,307 @@
+"""
+Per-call instrumentation for model calls.
+
+Every upstream call (and every response-cache hit) becomes one record:
+path, model, cache status, queue wait, time to first token, total time,
+prompt/completion tokens and the error class, if any. Records are
+
+- written as one JSON line each to the "coi.metrics" logger
+  (COI_METRICS_LOG: "-" for stderr, a file path, or empty to turn off),
+- aggregated into Prometheus-style counters and histograms, exposed as a
+  text file (COI_METRICS_FILE) and/or on http://COI_METRICS_HOST:COI_METRICS_PORT/metrics
+  (loopback only unless COI_METRICS_HOST says otherwise),
+- kept in a recent window for the p50/p95 summary in the admin panel.
+"""
+
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =========================================
+# CONFIG
+# =========================================
+
+METRICS_LOG = os.getenv("COI_METRICS_LOG", "-")
+METRICS_FILE = os.getenv("COI_METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("COI_METRICS_PORT", "0"))
+# Interface /metrics listens on; "0.0.0.0" exposes per-path traffic to the network.
+METRICS_HOST = os.getenv("COI_METRICS_HOST", "127.0.0.1")
+# The metrics file is rewritten at most this often.
+METRICS_FILE_SECONDS = float(os.getenv("COI_METRICS_FILE_SECONDS", "5"))
+# Recent records kept for percentiles.
+METRICS_WINDOW = int(os.getenv("COI_METRICS_WINDOW", "2000"))
+# Show the p50/p95 panel in the sidebar.
+ADMIN_PANEL = os.getenv("COI_ADMIN_PANEL", "") == "1"
+
+# Histogram buckets (seconds): search-model calls run from ~1s to well over a minute.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# Cache status of a record.
+HIT, MISS, REFRESH, UNCACHED = "hit", "miss", "refresh", "none"
+
+
+# =========================================
+# RECORDS
+# =========================================
+
+class CallTimer:
+    """
+    Times one model call. Call the hooks as the call progresses, then finish() once.
+    """
+
+    __slots__ = (
+        "path", "model", "cache", "started", "queue_wait", "ttft",
+        "prompt_tokens", "completion_tokens", "_finished",
+    )
+
+    def __init__(self, path, model, cache=UNCACHED):
+        self.path = path or "other"
+        self.model = model
+        self.cache = cache
+        self.started = time.monotonic()
+        self.queue_wait = 0.0
+        self.ttft = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self._finished = False
+
+    def granted(self, waited):
+        self.queue_wait = waited
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+    def usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+            self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    def finish(self, error=None):
+        if self._finished:
+            return
+        self._finished = True
+        total = time.monotonic() - self.started
+        get_metrics().record({
+            "ts": round(time.time(), 3),
+            "path": self.path,
+            "model": self.model,
+            "cache": self.cache,
+            "queue_wait": round(self.queue_wait, 4),
+            "ttft": round(self.ttft if self.ttft is not None else total, 4),
+            "total": round(total, 4),
+            "prompt_tokens": self.prompt_tokens or 0,
+            "completion_tokens": self.completion_tokens or 0,
+            "error": _error_class(error),
+        })
+
+
+def _error_class(error) -> str:
+    if error is None:
+        return ""
+    # A stream closed by its reader was abandoned, the same outcome as a cancel.
+    return "Cancelled" if isinstance(error, GeneratorExit) else type(error).__name__
+
+
+def record_cache_hit(path, model, seconds=0.0):
+    get_metrics().record({
+        "ts": round(time.time(), 3),
+        "path": path or "other",
+        "model": model,
+        "cache": HIT,
+        "queue_wait": 0.0,
+        "ttft": round(seconds, 4),
+        "total": round(seconds, 4),
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "error": "",
+    })
+
+
+def percentile(values, fraction, digits=2):
+    """
+    Nearest-rank percentile of a list, rounded (None if empty).
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(fraction * len(ordered)) - 1)], digits)
+
+
+# =========================================
+# METRICS
+# =========================================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _build_logger():
+    logger = logging.getLogger("coi.metrics")
+    if METRICS_LOG and not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr) if METRICS_LOG == "-" else logging.FileHandler(METRICS_LOG)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class Metrics:
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self._calls = {}        # (path, model, cache, error) -> count
+        self._tokens = {}       # (path, kind) -> tokens
+        self._histograms = {}   # (metric, path) -> [bucket counts..., sum, count]
+        self._file_written = 0.0
+        self._logger = _build_logger()
+
+    def record(self, record: dict):
+        if METRICS_LOG:
+            self._logger.info(json.dumps(record, ensure_ascii=False))
+        path = record["path"]
+        with self._lock:
+            self._recent.append(record)
+            key = (path, record["model"], record["cache"], record["error"])
+            self._calls[key] = self._calls.get(key, 0) + 1
+            for kind in ("prompt", "completion"):
+                self._tokens[(path, kind)] = self._tokens.get((path, kind), 0) + record[f"{kind}_tokens"]
+            if record["cache"] != HIT:
+                for metric in ("queue_wait", "ttft", "total"):
+                    self._observe(metric, path, record[metric])
+            write_file = METRICS_FILE and time.monotonic() - self._file_written >= METRICS_FILE_SECONDS
+            if write_file:
+                self._file_written = time.monotonic()
+        if write_file:
+            self.write_file()
+
+    def _observe(self, metric, path, value):
+        histogram = self._histograms.setdefault((metric, path), [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    # ---------- Exposition ----------
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            calls = dict(self._calls)
+            tokens = dict(self._tokens)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        lines = [
+            "# HELP coi_model_calls_total Model calls (and cache hits) by path, model, cache status and error class.",
+            "# TYPE coi_model_calls_total counter",
+        ]
+        for (path, model, cache, error), count in sorted(calls.items()):
+            lines.append(f"coi_model_calls_total{_labels(path=path, model=model, cache=cache, error=error)} {count}")
+        lines += [
+            "# HELP coi_model_tokens_total Tokens reported by the API, by path and kind.",
+            "# TYPE coi_model_tokens_total counter",
+        ]
+        for (path, kind), count in sorted(tokens.items()):
+            lines.append(f"coi_model_tokens_total{_labels(path=path, kind=kind)} {count}")
+        for metric, help_text in (
+            ("queue_wait", "Seconds waiting in the rate-limiter queue."),
+            ("ttft", "Seconds to the first token."),
+            ("total", "Seconds for the whole call."),
+        ):
+            name = f"coi_model_{metric}_seconds"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (hist_metric, path), histogram in sorted(histograms.items()):
+                if hist_metric != metric:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f"{name}_bucket{_labels(path=path, le=bound)} {count}")
+                lines.append(f"{name}_bucket{_labels(path=path, le='+Inf')} {histogram[-1]}")
+                lines.append(f"{name}_sum{_labels(path=path)} {histogram[-2]:.4f}")
+                lines.append(f"{name}_count{_labels(path=path)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path=None):
+        path = path or METRICS_FILE
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    # ---------- Summary ----------
+
+    def summary(self) -> list:
+        """
+        One row per path over the recent window: calls, errors, cache hits,
+        p50/p95 total and first-token seconds, p95 queue wait, token spend.
+        """
+        with self._lock:
+            recent = list(self._recent)
+        by_path = {}
+        for record in recent:
+            by_path.setdefault(record["path"], []).append(record)
+        rows = []
+        for path, records in sorted(by_path.items()):
+            calls = [r for r in records if r["cache"] != HIT]
+            totals = [r["total"] for r in calls]
+            ttfts = [r["ttft"] for r in calls]
+            waits = [r["queue_wait"] for r in calls]
+            rows.append({
+                "path": path,
+                "calls": len(calls),
+                "errors": sum(1 for r in calls if r["error"]),
+                "cache hits": len(records) - len(calls),
+                "p50 s": percentile(totals, 0.5),
+                "p95 s": percentile(totals, 0.95),
+                "p50 ttft s": percentile(ttfts, 0.5),
+                "p95 ttft s": percentile(ttfts, 0.95),
+                "p95 queue s": percentile(waits, 0.95),
+                "prompt tokens": sum(r["prompt_tokens"] for r in calls),
+                "completion tokens": sum(r["completion_tokens"] for r in calls),
+            })
+        return rows
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Process-wide metrics; also starts the /metrics endpoint when COI_METRICS_PORT is set.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            if METRICS_PORT:
+                server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+                threading.Thread(target=server.serve_forever, daemon=True, name="coi-metrics").start()
+        return _metrics
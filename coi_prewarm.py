@@ -0,0 +1,391 @@
+"""
+Off-peak warm-up of the response cache for the most-requested Path B lookups.
+
+    python coi_prewarm.py [--max-calls 40] [--max-tokens 300000] [--concurrency 2] [--dry-run]
+
+The app records every Path B lookup an advisor submits (ZIP, COI type, extra
+context) in a small usage table (COI_USAGE_DB, by default the cache's SQLite
+file). This job reads the last --days of that history, skips lookups the
+cache will still answer through the coming working day (--valid-hours) or
+the COI directory already covers, and refreshes the rest, most requested and
+stalest first, until --max-calls, --max-tokens or --deadline is reached.
+Lookups the directory covers only in part are warmed too: the app serves a
+cached answer for them before topping the directory's rows up.
+Fresh answers land in the shared SQLite tier of the response cache (and the
+directory), so the morning's first lookups are hits.
+
+The token budget is strict: a lookup only starts when the tokens already
+spent plus a worst-case reservation for every lookup in flight (truncation
+continuations included) stay within --max-tokens.
+
+The job runs in its own process with its own rate limiter: its calls do not
+join the app's fair queue, and they count against the app's RPM/TPM buckets
+only when COI_RATE_DB points both at the same SQLite file (it warns when it
+is unset). Keep --concurrency low if the app may be busy.
+
+Run it from cron before the morning peak, e.g.
+
+    0 5 * * 1-5  cd /srv/coi && COI_RATE_DB=/srv/coi/rate.sqlite3 python coi_prewarm.py --max-calls 40
+"""
+
+import argparse
+import contextvars
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from coi_cache import CACHE_DB_PATH, get_response_cache, normalize_input
+from coi_engine import (
+    FIRST_BATCH_ROWS,
+    MAX_CONTINUATIONS,
+    coi_token_budget,
+    directory_covers,
+    path_b_cache_key,
+    run_path_b_model,
+)
+from coi_metrics import get_metrics
+from coi_prompts import PATH_B_PROMPT
+from coi_ratelimit import RATE_DB_PATH, SEPARATE_LIMITS_WARNING, set_session
+from coi_report import estimate_tokens
+
+log = logging.getLogger("coi.prewarm")
+
+# =========================================
+# CONFIG
+# =========================================
+
+# Empty turns usage history (and so the warm-up) off.
+USAGE_DB_PATH = os.getenv("COI_USAGE_DB", CACHE_DB_PATH)
+# Lookups older than this are deleted when the warm-up runs.
+USAGE_KEEP_DAYS = float(os.getenv("COI_USAGE_KEEP_DAYS", "90"))
+
+PREWARM_SESSION = "prewarm"
+ERROR_MARK = "⚠️ Error while calling OpenAI"
+# The Path B user message around the extra context (instructions plus the nearby-areas block).
+LOOKUP_INPUT_TOKENS = 400
+
+
+# =========================================
+# USAGE HISTORY
+# =========================================
+
+class UsageLog:
+    """
+    SQLite table of submitted Path B lookups; safe to share across threads.
+    """
+
+    def __init__(self, db_path=USAGE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        """
+        One connection per thread; SQLite connections must not be shared across threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        try:
+            conn = self._connect()
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS lookups (
+                    zip_code TEXT NOT NULL,
+                    coi_type TEXT NOT NULL,
+                    context TEXT NOT NULL DEFAULT '',
+                    requested_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS lookups_requested ON lookups (requested_at);
+                """
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("usage history %s unusable (%s); not recording lookups", self.db_path, e)
+            self._local.conn = None
+            self.db_path = ""
+
+    def record(self, zip_code, coi_type, context=""):
+        """
+        Contexts are stored normalized like the cache key (normalize_input), so the
+        variants one cache entry answers count as one lookup and warm that entry.
+        """
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO lookups (zip_code, coi_type, context, requested_at) VALUES (?, ?, ?, ?)",
+                    ((zip_code or "").strip(), coi_type or "", normalize_input(context), time.time()),
+                )
+        except sqlite3.Error:
+            # Best effort: a lost row only makes the warm-up slightly less informed.
+            pass
+
+    def most_requested(self, days=14, limit=100, min_requests=1) -> list:
+        """
+        [{zip_code, coi_type, context, requests, last_requested}] over the last `days`,
+        most requested first. Types differing only in case count as one lookup
+        (contexts are normalized when recorded).
+        """
+        try:
+            rows = self._connect().execute(
+                """
+                SELECT zip_code, MAX(coi_type), context, COUNT(*) AS requests, MAX(requested_at)
+                FROM lookups WHERE requested_at >= ?
+                GROUP BY zip_code, LOWER(coi_type), context
+                HAVING requests >= ?
+                ORDER BY requests DESC, MAX(requested_at) DESC
+                LIMIT ?
+                """,
+                (time.time() - days * 24 * 3600, min_requests, limit),
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+        return [
+            {"zip_code": z, "coi_type": t, "context": c, "requests": n, "last_requested": last}
+            for z, t, c, n, last in rows
+        ]
+
+    def prune(self, days=USAGE_KEEP_DAYS) -> int:
+        try:
+            conn = self._connect()
+            with conn:
+                return conn.execute(
+                    "DELETE FROM lookups WHERE requested_at < ?", (time.time() - days * 24 * 3600,)
+                ).rowcount
+        except sqlite3.Error:
+            return 0
+
+
+_usage = None
+_usage_lock = threading.Lock()
+
+
+def get_usage_log():
+    """
+    Process-wide usage log, created lazily on first use; None when COI_USAGE_DB is
+    empty or cannot be opened.
+    """
+    global _usage
+    if not USAGE_DB_PATH:
+        return None
+    with _usage_lock:
+        if _usage is None:
+            _usage = UsageLog()
+        return _usage if _usage.db_path else None
+
+
+def record_lookup(zip_code, coi_type, context=""):
+    """
+    Note one submitted Path B lookup (no-op when usage history is off).
+    """
+    usage = get_usage_log()
+    if usage is not None:
+        usage.record(zip_code, coi_type, context)
+
+
+# =========================================
+# PLAN
+# =========================================
+
+def lookup_token_ceiling(context="") -> int:
+    """
+    Most tokens one Path B lookup can spend: the first call plus MAX_CONTINUATIONS
+    follow-ups, each re-sending the prompt and the answer so far.
+    """
+    prompt = estimate_tokens(PATH_B_PROMPT) + LOOKUP_INPUT_TOKENS + estimate_tokens(context)
+    answer = coi_token_budget(FIRST_BATCH_ROWS)
+    calls = 1 + MAX_CONTINUATIONS
+    return calls * (prompt + answer) + answer * MAX_CONTINUATIONS * (MAX_CONTINUATIONS + 1) // 2
+
+
+def plan(candidates, valid_hours=10.0, cache=None) -> tuple:
+    """
+    Split usage candidates into (to_warm, skipped). Lookups the cache will still
+    answer `valid_hours` from now, or the directory fully covers, are skipped.
+    The rest are ordered by requests x staleness (age / TTL, 1 when missing or expired).
+    """
+    cache = cache or get_response_cache()
+    now = time.time()
+    to_warm, skipped = [], []
+    for candidate in candidates:
+        item = dict(candidate)
+        stored_at = cache.stored_at(path_b_cache_key(item["zip_code"], item["coi_type"], item["context"]))
+        item["age_hours"] = None if stored_at is None else round((now - stored_at) / 3600, 1)
+        if stored_at is not None and now - stored_at + valid_hours * 3600 <= cache.ttl_seconds:
+            item["skip"] = "fresh in cache"
+        elif directory_covers(item["zip_code"], item["coi_type"], item["context"]):
+            item["skip"] = "covered by the directory"
+        if item.get("skip"):
+            skipped.append(item)
+            continue
+        staleness = 1.0 if stored_at is None else min(1.0, (now - stored_at) / cache.ttl_seconds)
+        item["priority"] = round(item["requests"] * staleness, 2)
+        to_warm.append(item)
+    to_warm.sort(key=lambda item: (-item["priority"], -item["requests"]))
+    return to_warm, skipped
+
+
+# =========================================
+# WARM-UP
+# =========================================
+
+def _tokens_spent() -> int:
+    """
+    Tokens the API reported for every call this process has made (recent window).
+    """
+    return sum(row["prompt tokens"] + row["completion tokens"] for row in get_metrics().summary())
+
+
+class WarmUp:
+    """
+    Refreshes planned lookups within a call, token, time and concurrency budget.
+    """
+
+    def __init__(self, items, max_calls=40, max_tokens=300_000, concurrency=2, deadline=None):
+        self.items = items
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline    # time.monotonic() after which no lookup starts
+        self.warmed = []
+        self.failed = []
+        self.stopped = ""
+        self._reserved = 0
+        self._started = 0
+        self._spent_before = _tokens_spent()
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+
+    @property
+    def tokens_spent(self) -> int:
+        return _tokens_spent() - self._spent_before
+
+    def _admit(self, item) -> bool:
+        """
+        Reserve the lookup's worst case, or record why the warm-up stops here.
+        While reservations for lookups in flight are what is short, wait for one to end.
+        """
+        ceiling = lookup_token_ceiling(item["context"])
+        with self._finished:
+            while True:
+                if self._started >= self.max_calls:
+                    self.stopped = f"call budget ({self.max_calls}) reached"
+                elif self.deadline is not None and time.monotonic() >= self.deadline:
+                    self.stopped = "deadline reached"
+                elif self.tokens_spent + ceiling > self.max_tokens:
+                    self.stopped = f"token budget ({self.max_tokens}) reached"
+                elif self.tokens_spent + self._reserved + ceiling > self.max_tokens:
+                    self._finished.wait()
+                    continue
+                else:
+                    self._reserved += ceiling
+                    self._started += 1
+                    return True
+                return False
+
+    def _warm(self, item, slots):
+        started = time.monotonic()
+        try:
+            text = run_path_b_model(item["zip_code"], item["coi_type"], item["context"], use_cache=False)
+        except Exception as e:
+            text = f"{ERROR_MARK}: {e}"
+        finally:
+            with self._finished:
+                self._reserved -= lookup_token_ceiling(item["context"])
+                self._finished.notify_all()
+            slots.release()
+        item["seconds"] = round(time.monotonic() - started, 1)
+        with self._lock:
+            if ERROR_MARK in text:
+                item["error"] = text[text.index(ERROR_MARK):][:200]
+                self.failed.append(item)
+            else:
+                self.warmed.append(item)
+
+    def run(self):
+        """
+        Warm items in order until done or a budget runs out. Blocks until every started lookup ends.
+        """
+        # One limiter session for the whole warm-up. Run from the CLI this is a
+        # separate process: the app's fair queue does not see these calls, and
+        # they share its RPM/TPM buckets only through COI_RATE_DB.
+        set_session(PREWARM_SESSION)
+        slots = threading.BoundedSemaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="coi-prewarm") as pool:
+            for item in self.items:
+                slots.acquire()
+                if not self._admit(item):
+                    slots.release()
+                    break
+                pool.submit(contextvars.copy_context().run, self._warm, item, slots)
+        return self
+
+
+# =========================================
+# CLI
+# =========================================
+
+def _describe(item) -> str:
+    age = "not cached" if item["age_hours"] is None else f"cached {item['age_hours']}h ago"
+    context = f" · “{item['context']}”" if item["context"] else ""
+    return f"{item['zip_code']} · {item['coi_type']}{context} — {item['requests']} requests, {age}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm the response cache for the most-requested Path B lookups.")
+    parser.add_argument("--days", type=float, default=14, help="usage history window")
+    parser.add_argument("--top", type=int, default=100, help="most-requested lookups considered")
+    parser.add_argument("--min-requests", type=int, default=2, help="ignore lookups requested fewer times")
+    parser.add_argument("--valid-hours", type=float, default=10,
+                        help="skip lookups whose cached answer stays valid this long")
+    parser.add_argument("--max-calls", type=int, default=40, help="lookups refreshed at most")
+    parser.add_argument("--max-tokens", type=int, default=300_000, help="tokens spent at most")
+    parser.add_argument("--concurrency", type=int, default=2, help="lookups in flight at once")
+    parser.add_argument("--deadline", type=float, default=0, help="minutes after which no lookup starts (0 = none)")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without calling the model")
+    args = parser.parse_args(argv)
+
+    usage = get_usage_log()
+    if usage is None or not get_response_cache().db_path:
+        sys.exit("The warm-up needs usage history and the SQLite cache tier (COI_USAGE_DB and COI_CACHE_DB).")
+    if not RATE_DB_PATH and not args.dry_run:
+        print(SEPARATE_LIMITS_WARNING, file=sys.stderr)
+    usage.prune()
+    to_warm, skipped = plan(usage.most_requested(args.days, args.top, args.min_requests), args.valid_hours)
+    print(f"{len(to_warm)} lookups to warm, {len(skipped)} skipped", file=sys.stderr)
+    for item in skipped:
+        print(f"  skip  {_describe(item)} ({item['skip']})", file=sys.stderr)
+    if args.dry_run:
+        for item in to_warm:
+            print(f"  warm  {_describe(item)} · priority {item['priority']}")
+        return 0
+
+    deadline = time.monotonic() + args.deadline * 60 if args.deadline else None
+    warm_up = WarmUp(to_warm, args.max_calls, args.max_tokens, args.concurrency, deadline).run()
+    for item in warm_up.warmed:
+        print(f"  warmed  {_describe(item)} · {item['seconds']}s")
+    for item in warm_up.failed:
+        print(f"  failed  {_describe(item)} · {item['error']}")
+    left = len(to_warm) - len(warm_up.warmed) - len(warm_up.failed)
+    print(
+        f"{len(warm_up.warmed)} warmed, {len(warm_up.failed)} failed, {left} left"
+        + (f" ({warm_up.stopped})" if warm_up.stopped else "")
+        + f" · {warm_up.tokens_spent} tokens",
+        file=sys.stderr,
+    )
+    return 1 if warm_up.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""
+Process-wide rate limiter for OpenAI calls.
+
+- Two token buckets: requests per minute and (estimated) tokens per minute.
+  A request is charged prompt tokens + max_completion_tokens up front; the
+  unused part is refunded when actual usage is known.
+- Fair queueing: waiting requests are served round-robin across sessions, so
+  one advisor's fan-out cannot starve everyone else.
+- Adaptive concurrency (AIMD): the in-flight limit halves on a 429 and
+  grows back by one after a window of successes. It halves once per
+  request (not per retry) and at most once per DECREASE_COOLDOWN_SECONDS,
+  so one burst of 429s is one decrease.
+- Optional cross-process budgets: set COI_RATE_DB to a SQLite file shared by
+  every worker process and the buckets live there instead of in memory.
+  Only the buckets are shared: the fair queue and the concurrency limit stay
+  per process, so a separate process (the coi_batch / coi_prewarm CLIs) never
+  queues behind the app's sessions.
+"""
+
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# =========================================
+# CONFIG
+# =========================================
+
+REQUESTS_PER_MINUTE = float(os.getenv("COI_RPM", "500"))
+TOKENS_PER_MINUTE = float(os.getenv("COI_TPM", "200000"))
+MAX_CONCURRENCY = int(os.getenv("COI_MAX_CONCURRENCY", "16"))
+RATE_DB_PATH = os.getenv("COI_RATE_DB", "")
+# Printed by the command-line jobs (coi_batch, coi_prewarm) when RATE_DB_PATH is unset.
+SEPARATE_LIMITS_WARNING = (
+    "warning: COI_RATE_DB is not set, so this process keeps its own rate limits: its calls are not "
+    "counted against the app's requests/tokens per minute and can cause 429s for advisors using the app."
+)
+
+# 429s within this long of the last decrease belong to the same burst.
+DECREASE_COOLDOWN_SECONDS = float(os.getenv("COI_DECREASE_COOLDOWN_SECONDS", "5"))
+
+# Seed for the queue ETA before any call has finished.
+DEFAULT_CALL_SECONDS = 20.0
+
+_session = contextvars.ContextVar("coi_session", default="")
+
+
+def set_session(session_id: str):
+    """
+    Tag calls made from the current context with a session id (for fair queueing).
+    """
+    _session.set(session_id or "")
+
+
+def current_session() -> str:
+    return _session.get()
+
+
+# =========================================
+# TOKEN BUCKETS
+# =========================================
+
+class LocalBuckets:
+    """
+    In-memory request + token buckets for one process. Callers hold the limiter lock.
+    """
+
+    def __init__(self, rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE):
+        self.capacity = (rpm, tpm)
+        self.rates = (rpm / 60.0, tpm / 60.0)
+        self.levels = list(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        for i in range(2):
+            self.levels[i] = min(self.capacity[i], self.levels[i] + elapsed * self.rates[i])
+
+    def try_take(self, tokens) -> float:
+        """
+        Take 1 request + tokens and return 0, or return the seconds until both are available.
+        """
+        self._refill()
+        need = (1.0, min(float(tokens), self.capacity[1]))
+        waits = [
+            (need[i] - self.levels[i]) / self.rates[i]
+            for i in range(2)
+            if self.levels[i] < need[i]
+        ]
+        if waits:
+            return max(waits)
+        self.levels[0] -= need[0]
+        self.levels[1] -= need[1]
+        return 0.0
+
+    def refund(self, tokens):
+        self._refill()
+        self.levels[1] = min(self.capacity[1], self.levels[1] + tokens)
+
+
+class SQLiteBuckets(LocalBuckets):
+    """
+    The same buckets, stored in a SQLite file so several worker processes share one budget.
+    """
+
+    def __init__(self, path, rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE):
+        super().__init__(rpm, tpm)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transact(self, update):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT requests, tokens, updated FROM buckets WHERE name = 'openai'"
+            ).fetchone()
+            now = time.time()
+            if row is None:
+                self.levels, self.updated = list(self.capacity), now
+            else:
+                self.levels, elapsed = [row[0], row[1]], max(0.0, now - row[2])
+                for i in range(2):
+                    self.levels[i] = min(self.capacity[i], self.levels[i] + elapsed * self.rates[i])
+            self.updated = time.monotonic()
+            result = update()
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated) VALUES ('openai', ?, ?, ?)",
+                (self.levels[0], self.levels[1], now),
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def try_take(self, tokens) -> float:
+        return self._transact(lambda: LocalBuckets.try_take(self, tokens))
+
+    def refund(self, tokens):
+        self._transact(lambda: LocalBuckets.refund(self, tokens))
+
+
+# =========================================
+# LIMITER
+# =========================================
+
+class _Waiter:
+    __slots__ = ("session", "tokens", "enqueued")
+
+    def __init__(self, session, tokens):
+        self.session = session
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+
+
+class Ticket:
+    """
+    A granted slot. Use as a context manager, or call release() yourself.
+    """
+
+    __slots__ = ("limiter", "tokens", "started", "waited", "_released", "_backed_off")
+
+    def __init__(self, limiter, tokens, waited):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.waited = waited
+        self.started = time.monotonic()
+        self._released = False
+        self._backed_off = False
+
+    def rate_limited(self):
+        """
+        Report a 429 for this request; only the first one (of its retries) backs the limiter off.
+        """
+        self.limiter.on_rate_limited(decrease=not self._backed_off)
+        self._backed_off = True
+
+    def release(self, actual_tokens=None, ok=True):
+        if self._released:
+            return
+        self._released = True
+        self.limiter._release(self, actual_tokens, ok)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(ok=exc_type is None)
+        return False
+
+
+class RateLimiter:
+
+    def __init__(self, buckets=None, max_concurrency=MAX_CONCURRENCY):
+        self._buckets = buckets or LocalBuckets()
+        self._cond = threading.Condition()
+        self._queues = {}          # session -> deque[_Waiter]
+        self._turns = deque()      # round-robin order of sessions with waiters
+        self._in_flight = 0
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self._successes = 0
+        self._last_decrease = None
+        self._avg_call_seconds = DEFAULT_CALL_SECONDS
+        self._stats = {"granted": 0, "queued": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    # ---------- Queue ----------
+
+    def _order(self):
+        """
+        Waiters in the order they will be served (round-robin across sessions).
+        """
+        queues = [self._queues[session] for session in self._turns]
+        order = []
+        depth = 0
+        while True:
+            layer = [queue[depth] for queue in queues if depth < len(queue)]
+            if not layer:
+                return order
+            order.extend(layer)
+            depth += 1
+
+    def _is_next(self, waiter):
+        return bool(self._turns) and self._queues[self._turns[0]][0] is waiter
+
+    def _dequeue(self, waiter):
+        queue = self._queues[waiter.session]
+        queue.popleft()
+        self._turns.popleft()
+        if queue:
+            self._turns.append(waiter.session)
+        else:
+            del self._queues[waiter.session]
+
+    def _remove(self, waiter):
+        queue = self._queues[waiter.session]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.session]
+            self._turns.remove(waiter.session)
+
+    def _eta(self, position, bucket_wait=0.0):
+        ahead = position + max(0, self._in_flight - self.limit + 1)
+        return bucket_wait + ahead * self._avg_call_seconds / max(1, self.limit)
+
+    def acquire(self, tokens, session=None, cancel=None):
+        """
+        Block until a request charged `tokens` may go out; fair across sessions.
+        Returns None instead of a Ticket if the `cancel` event is set while waiting.
+        """
+        session = current_session() if session is None else session
+        waiter = _Waiter(session, tokens)
+        with self._cond:
+            if session not in self._queues:
+                self._queues[session] = deque()
+                self._turns.append(session)
+            self._queues[session].append(waiter)
+            queued = False
+            while True:
+                if cancel is not None and cancel.is_set():
+                    self._remove(waiter)
+                    self._cond.notify_all()
+                    return None
+                if self._is_next(waiter) and self._in_flight < self.limit:
+                    bucket_wait = self._buckets.try_take(tokens)
+                    if bucket_wait == 0:
+                        self._dequeue(waiter)
+                        self._in_flight += 1
+                        waited = time.monotonic() - waiter.enqueued
+                        self._stats["granted"] += 1
+                        self._stats["wait_seconds"] += waited
+                        self._cond.notify_all()
+                        return Ticket(self, tokens, waited)
+                    timeout = min(bucket_wait, 1.0)
+                else:
+                    timeout = 1.0
+                if not queued:
+                    queued = True
+                    self._stats["queued"] += 1
+                self._cond.wait(min(timeout, 0.25) if cancel is not None else timeout)
+
+    def _release(self, ticket, actual_tokens, ok):
+        with self._cond:
+            self._in_flight -= 1
+            elapsed = time.monotonic() - ticket.started
+            self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * elapsed
+            if actual_tokens is not None and actual_tokens < ticket.tokens:
+                self._buckets.refund(ticket.tokens - actual_tokens)
+            if ok:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def on_rate_limited(self, decrease=True):
+        """
+        Count a 429 and apply the multiplicative decrease, unless decrease is False
+        or the last decrease was under DECREASE_COOLDOWN_SECONDS ago.
+        """
+        with self._cond:
+            self._stats["rate_limited"] += 1
+            now = time.monotonic()
+            if not decrease or (
+                self._last_decrease is not None and now - self._last_decrease < DECREASE_COOLDOWN_SECONDS
+            ):
+                return
+            self._last_decrease = now
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+    # ---------- Status ----------
+
+    def average_call_seconds(self) -> float:
+        with self._cond:
+            return self._avg_call_seconds
+
+    def queue_status(self, session=None):
+        """
+        (position, estimated seconds) of this session's first waiting request
+        (position 1 = next to go), or None if it has nothing queued.
+        """
+        session = current_session() if session is None else session
+        with self._cond:
+            for position, waiter in enumerate(self._order()):
+                if waiter.session == session:
+                    return position + 1, self._eta(position)
+        return None
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                waiting=sum(len(queue) for queue in self._queues.values()),
+                in_flight=self._in_flight,
+                limit=self.limit,
+            )
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            buckets = SQLiteBuckets(RATE_DB_PATH) if RATE_DB_PATH else LocalBuckets()
+            _limiter = RateLimiter(buckets)
+        return _limiter
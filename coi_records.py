@@ -0,0 +1,342 @@
+"""
+Structured COI records parsed from the model's mandatory COI table:
+
+| Name | Role/Specialty | Organization + Link | Public Contact | Why They Fit |
+
+Records use __slots__ so a full 125-row result set stays small in memory.
+The parser works on complete text or incrementally on streamed deltas, and
+skips anything that is not a usable COI row (headers, separators, the
+2-column report tables, prose, rows cut off mid-stream).
+"""
+
+import csv
+import io
+import re
+from urllib.parse import urlparse
+
+COI_COLUMNS = ("Name", "Role/Specialty", "Organization + Link", "Public Contact", "Why They Fit")
+# Flat columns for the results grid and the CSV export (organization and link split).
+EXPORT_COLUMNS = ("Name", "Role/Specialty", "Organization", "Link", "Public Contact", "Why They Fit", "ZIP")
+
+# Rows with fewer cells are not COI rows (the report tables have 2 columns).
+MIN_CELLS = 4
+
+_MD_LINK = re.compile(r"\[([^\]]*)\]\((<?)(\S+?)(>?)\)")
+_BARE_URL = re.compile(r"(https?://[^\s)<>|]+|www\.[^\s)<>|]+)", re.IGNORECASE)
+_SEPARATOR_CELL = re.compile(r"^:?-{2,}:?$")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+# =========================================
+# RECORD
+# =========================================
+
+class COIRecord:
+    """
+    One COI row. organization and link are split out of the "Organization + Link" cell.
+    zip_code is the lookup ZIP(s) the row came from, when known.
+    """
+
+    __slots__ = ("name", "role", "organization", "link", "contact", "why", "zip_code")
+
+    def __init__(self, name, role="", organization="", link="", contact="", why="", zip_code=""):
+        self.name = name
+        self.role = role
+        self.organization = organization
+        self.link = link
+        self.contact = contact
+        self.why = why
+        self.zip_code = zip_code
+
+    def __repr__(self):
+        return f"COIRecord({self.name!r}, {self.role!r}, {self.organization!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, COIRecord):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+
+    def __hash__(self):
+        return hash(self.to_row())
+
+    @property
+    def domain(self) -> str:
+        return link_domain(self.link)
+
+    def key(self) -> tuple:
+        """
+        Dedupe key: normalized name plus organization (or link domain when the name is shared).
+        """
+        return (normalize_name(self.name), normalize_name(self.organization) or self.domain)
+
+    def to_row(self) -> tuple:
+        return (self.name, self.role, self.organization, self.link, self.contact, self.why, self.zip_code)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def to_markdown(self) -> str:
+        org = f"[{self.organization or self.domain}]({self.link})" if self.link else self.organization
+        cells = (self.name, self.role, org, self.contact, self.why)
+        return "| " + " | ".join(cell.replace("|", "/") for cell in cells) + " |"
+
+
+def normalize_name(value) -> str:
+    return _NON_WORD.sub(" ", str(value or "").casefold()).strip()
+
+
+def link_domain(link) -> str:
+    if not link:
+        return ""
+    parsed = urlparse(link if "://" in link else "http://" + link)
+    host = (parsed.hostname or "").casefold()
+    return host[4:] if host.startswith("www.") else host
+
+
+# =========================================
+# PARSING
+# =========================================
+
+def _split_cells(line: str):
+    body = line.strip()
+    if body.startswith("|"):
+        body = body[1:]
+    if body.endswith("|"):
+        body = body[:-1]
+    return [cell.strip() for cell in body.split("|")]
+
+
+def _split_org_link(cell: str):
+    match = _MD_LINK.search(cell)
+    if match:
+        text, link = match.group(1).strip(), match.group(3).strip()
+        rest = (cell[:match.start()] + cell[match.end():]).strip(" -–—,:")
+        return (text or rest or link_domain(link)), link
+    match = _BARE_URL.search(cell)
+    if match:
+        link = match.group(1).rstrip(".,;")
+        rest = (cell[:match.start()] + cell[match.end():]).strip(" -–—,:()")
+        return (rest or link_domain(link)), link
+    return cell, ""
+
+
+def parse_coi_row(line: str):
+    """
+    Parse one markdown table line into a COIRecord, or None if it is not a COI row.
+    """
+    if line.count("|") < MIN_CELLS - 1:
+        return None
+    cells = _split_cells(line)
+    if len(cells) < MIN_CELLS:
+        return None
+    if all(_SEPARATOR_CELL.match(cell.replace(" ", "")) for cell in cells if cell):
+        return None
+    if cells[0].strip("* ").casefold() in ("name", ""):
+        return None
+    if len(cells) > len(COI_COLUMNS):
+        # Stray pipes inside the last cell: fold the overflow back into "Why They Fit".
+        cells = cells[:4] + [" / ".join(cells[4:])]
+    cells += [""] * (len(COI_COLUMNS) - len(cells))
+
+    name, role, org_cell, contact, why = cells
+    name = name.strip("* ")
+    if name in ("—", "-", "N/A"):
+        return None
+    organization, link = _split_org_link(org_cell)
+    return COIRecord(name, role, organization, link, contact, why)
+
+
+def _is_table_line(line: str) -> bool:
+    return line.count("|") >= MIN_CELLS - 1 and len(_split_cells(line)) >= MIN_CELLS
+
+
+def strip_coi_table(text: str) -> str:
+    """
+    The response without its COI table (rows, header, separator): the narrative around it.
+    """
+    kept = [line for line in (text or "").splitlines() if not _is_table_line(line)]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+
+
+def parse_coi_table(text: str) -> list:
+    """
+    Parse every COI row in a complete model response.
+    """
+    records = []
+    for line in (text or "").splitlines():
+        record = parse_coi_row(line)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+class COITableParser:
+    """
+    Incremental parser for streamed output: feed() deltas, get back rows as they complete.
+    """
+
+    __slots__ = ("_buffer", "records")
+
+    def __init__(self):
+        self._buffer = ""
+        self.records = []
+
+    def feed(self, delta: str) -> list:
+        self._buffer += delta
+        if "\n" not in delta:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        new = [record for record in map(parse_coi_row, lines) if record is not None]
+        self.records.extend(new)
+        return new
+
+    def close(self) -> list:
+        """
+        Flush the last line; it only counts if the row was closed with a trailing pipe.
+        """
+        line, self._buffer = self._buffer.strip(), ""
+        if not line.endswith("|"):
+            return []
+        record = parse_coi_row(line)
+        if record is None:
+            return []
+        self.records.append(record)
+        return [record]
+
+
+# =========================================
+# DEDUPE + EXPORT
+# =========================================
+
+def dedupe_records(records, seen=None) -> list:
+    """
+    Drop repeats by COIRecord.key(). Pass a shared `seen` set to dedupe across batches.
+    """
+    seen = set() if seen is None else seen
+    unique = []
+    for record in records:
+        key = record.key()
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(record)
+    return unique
+
+
+# Digest entries sent back to the model. Older entries are still excluded
+# server-side by the index, so the prompt stays roughly the same size per batch.
+DIGEST_MAX_ENTRIES = 80
+
+
+class COIExclusionIndex:
+    """
+    Everything already returned in a session, keyed by normalized name + organization
+    and name + link domain, so a COI matching on either counts as a repeat.
+    """
+
+    __slots__ = ("_keys", "_digest_entries")
+
+    def __init__(self, records=()):
+        self._keys = set()
+        self._digest_entries = []
+        self.add(records)
+
+    def __len__(self):
+        return len(self._digest_entries)
+
+    @staticmethod
+    def _record_keys(record):
+        name = normalize_name(record.name)
+        keys = [("org", name, normalize_name(record.organization))]
+        if record.domain:
+            keys.append(("domain", name, record.domain))
+        return keys
+
+    def add(self, records) -> list:
+        """
+        Index records and return only the ones not seen before (in input order).
+        """
+        new = []
+        for record in records:
+            keys = self._record_keys(record)
+            if any(key in self._keys for key in keys):
+                continue
+            self._keys.update(keys)
+            self._digest_entries.append(
+                f"{record.name} @ {record.domain}" if record.domain
+                else f"{record.name} @ {record.organization}"
+            )
+            new.append(record)
+        return new
+
+    def digest(self, max_entries=DIGEST_MAX_ENTRIES) -> str:
+        """
+        Compact "name @ domain" list of the most recent COIs, one per line.
+        """
+        return "\n".join(self._digest_entries[-max_entries:])
+
+
+def merge_records(batches) -> list:
+    """
+    Merge [(zip_code, records)] from several lookups into one deduplicated list.
+    A COI found under several types or ZIPs is kept once, with all its ZIPs listed.
+    """
+    merged = []
+    by_key = {}
+    for zip_code, records in batches:
+        for record in records:
+            keys = COIExclusionIndex._record_keys(record)
+            existing = next((by_key[key] for key in keys if key in by_key), None)
+            if existing is None:
+                record.zip_code = record.zip_code or zip_code
+                merged.append(record)
+                existing = record
+            elif zip_code and zip_code not in existing.zip_code.split(", "):
+                existing.zip_code = ", ".join(filter(None, (existing.zip_code, zip_code)))
+            for key in keys:
+                by_key.setdefault(key, existing)
+    return merged
+
+
+def records_to_markdown(records) -> str:
+    lines = [
+        "| " + " | ".join(COI_COLUMNS) + " |",
+        "|" + "|".join("---" for _ in COI_COLUMNS) + "|",
+    ]
+    lines.extend(record.to_markdown() for record in records)
+    return "\n".join(lines)
+
+
+def records_to_csv(records) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(record.to_row() for record in records)
+    return out.getvalue()
+
+
+def records_to_columns(records) -> dict:
+    """
+    {column: [values]} in EXPORT_COLUMNS order, ready for st.dataframe.
+    """
+    rows = [record.to_row() for record in records]
+    return {column: [row[i] for row in rows] for i, column in enumerate(EXPORT_COLUMNS)}
+
+
+def record_zip_codes(record) -> list:
+    return [zip_code for zip_code in record.zip_code.split(", ") if zip_code]
+
+
+def filter_records(records, roles=(), organization="", zip_codes=()) -> list:
+    """
+    Records matching every given filter: role in roles, organization containing
+    the text (case-insensitive), any of the record's ZIPs in zip_codes.
+    """
+    needle = organization.strip().casefold()
+    return [
+        record for record in records
+        if (not roles or record.role in roles)
+        and (not needle or needle in record.organization.casefold())
+        and (not zip_codes or any(z in zip_codes for z in record_zip_codes(record)))
+    ]
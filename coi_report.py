@@ -0,0 +1,126 @@
+"""
+Deterministic parts of the COI Intelligence Report, rendered locally.
+
+The CLIENT FOCUS OVERVIEW TABLE only echoes the Q1–Q6 answers, and the
+PRIORITY COI CATEGORIES TABLE comes from a fixed catalogue. Building both
+here saves the model from spending output tokens (and seconds) on them.
+"""
+
+import re
+
+# =========================================
+# TOKEN ESTIMATE
+# =========================================
+
+# ~4 characters per token is the usual rule of thumb for English text
+# (markdown tables run slightly denser, so this slightly under-counts).
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# =========================================
+# CLIENT FOCUS OVERVIEW TABLE
+# =========================================
+
+def _cell(value) -> str:
+    """
+    Single-line, pipe-safe table cell.
+    """
+    text = " ".join(str(value or "").split())
+    return text.replace("|", "/") or "—"
+
+
+def render_client_focus_table(q1_zip, q2_segments, q3_events, q4_comm, q5_background, q6_networks):
+    rows = [
+        ("Main Area", q1_zip),
+        ("Segments", q2_segments),
+        ("Life Events", q3_events),
+        ("Communities", q4_comm),
+        ("Background", q5_background),
+        ("Networks", q6_networks),
+    ]
+    lines = [
+        "#### 1) Client Focus Overview",
+        "",
+        "| Item | Summary |",
+        "|------|---------|",
+    ]
+    lines += [f"| {item} | {_cell(value)} |" for item, value in rows]
+    return "\n".join(lines)
+
+
+# =========================================
+# PRIORITY COI CATEGORIES TABLE
+# =========================================
+
+# (category, why high priority, always include, keywords matched against segments / events / communities)
+COI_CATEGORY_CATALOGUE = [
+    ("CPA / Tax Advisor", "Planning and major financial decisions", True,
+     ()),
+    ("Mortgage Lender / Broker", "Core during home purchase or relocation", False,
+     ("home", "house", "mortgage", "move", "moving", "relocat", "young famil", "mid-career")),
+    ("Realtor (family/relocation)", "Life events tied to moving, families", False,
+     ("home", "house", "move", "moving", "relocat", "downsiz", "famil")),
+    ("Estate Planning Attorney", "Protection + long-term planning", True,
+     ()),
+    ("Immigration Attorney", "Expats + relocation cases", False,
+     ("immigra", "expat", "visa", "relocat", "international")),
+    ("Pediatrician / OB-GYN", "Young families + trust relationships", False,
+     ("baby", "newborn", "pregnan", "young famil", "new parent", "childcare")),
+    ("School Counselor / Principal", "Parent networks + school transitions", False,
+     ("school", "education", "college", "parent", "famil")),
+    ("Business Banker / RM", "Business owners + professionals", False,
+     ("business", "entrepreneur", "owner", "self-employ", "startup", "professional")),
+    ("Business Consultant / Coach", "Job changes + career shifts", False,
+     ("job", "career", "layoff", "promotion", "new role")),
+    ("Community / Cultural Leader", "High-trust networks", False,
+     ("communit", "cultural", "faith", "church", "temple", "mosque", "lgbt", "african american",
+      "chinese", "korean", "latino", "hispanic", "south asian", "vietnamese", "immigra")),
+    ("Family Law / Divorce Attorney", "Divorce + blended-family planning", False,
+     ("divorce", "separation", "blended", "remarri")),
+    ("Equity Comp / HR Benefits Leader", "Stock comp + benefits decisions", False,
+     ("rsu", "stock", "equity", "ipo", "tech")),
+    ("Elder Law / Senior Care Advisor", "Retirement, eldercare + aging parents", False,
+     ("retire", "eldercare", "aging parent", "senior", "long-term care", "65+")),
+]
+
+# Fewer matches than this and the table is topped up from the catalogue order.
+MIN_PRIORITY_CATEGORIES = 5
+MAX_PRIORITY_CATEGORIES = 10
+
+
+def select_priority_categories(q2_segments, q3_events, q4_comm=""):
+    """
+    Return [(category, why)] for catalogue entries matching the advisor's segments,
+    life events and communities, always including the core categories.
+    """
+    haystack = " ".join(str(v or "") for v in (q2_segments, q3_events, q4_comm)).casefold()
+
+    selected = [
+        (category, why)
+        for category, why, always, keywords in COI_CATEGORY_CATALOGUE
+        if always or any(re.search(r"\b" + re.escape(keyword), haystack) for keyword in keywords)
+    ]
+    for category, why, _always, _keywords in COI_CATEGORY_CATALOGUE:
+        if len(selected) >= MIN_PRIORITY_CATEGORIES:
+            break
+        if (category, why) not in selected:
+            selected.append((category, why))
+    return selected[:MAX_PRIORITY_CATEGORIES]
+
+
+def render_priority_categories_table(q2_segments, q3_events, q4_comm=""):
+    lines = [
+        "#### 3) Priority COI Categories",
+        "",
+        "| COI Category | Why High Priority |",
+        "|--------------|-------------------|",
+    ]
+    lines += [
+        f"| {category} | {why} |"
+        for category, why in select_priority_categories(q2_segments, q3_events, q4_comm)
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,409 @@
+"""
+Near-duplicate detection for Path A intakes.
+
+Q2–Q6 are free text, so "Young Families; small business owners" and "small
+biz owners, young families" never share an exact cache key. Each answer is
+normalized into a set of tokens (case, punctuation, word order, common
+abbreviations, plurals and filler words ignored). Two intakes for the same
+ZIP are near-identical when every answer's token Jaccard similarity reaches
+SIMILARITY_THRESHOLD: one answer that really differs ("Former CPA" vs
+"Former nurse") keeps them apart however alike the rest is.
+
+Lookups go through MinHash signatures banded into an LSH table keyed by ZIP,
+so only a handful of candidates are scored exactly, however many intakes are
+indexed. No embedding service or extra dependency is involved.
+
+The index maps every intake to a canonical intake key: the first intake of its
+near-duplicate group. Path A builds its cache keys from that key, so a
+rephrased intake is served the earlier answers (see coi_engine).
+
+The response cache is shared on disk by every worker process, so the intakes
+behind its keys are too: each new intake's band keys are written to a SQLite
+file (COI_SIMILARITY_DB, the cache's file by default), and a lookup that finds
+nothing in memory checks there, so equivalent intakes handled by different
+workers, or before a restart, resolve to the same key. Hashes are blake2b, not
+the per-process salted hash(), so band keys mean the same in every process.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from coi_cache import CACHE_DB_PATH, CACHE_TTL_SECONDS
+
+log = logging.getLogger("coi.similarity")
+
+# =========================================
+# CONFIG
+# =========================================
+
+# Jaccard similarity every answer needs to reuse an earlier intake's results.
+# 1 reuses only intakes that normalize identically; above 1 turns reuse off.
+SIMILARITY_THRESHOLD = float(os.getenv("COI_SIMILARITY_THRESHOLD", "0.7"))
+SIMILARITY_MAX_ENTRIES = int(os.getenv("COI_SIMILARITY_MAX_ENTRIES", "50000"))
+# Shared intake index next to the response cache; empty keeps it in-process only.
+SIMILARITY_DB_PATH = os.getenv("COI_SIMILARITY_DB", CACHE_DB_PATH)
+
+# MinHash / LSH shape: BANDS x ROWS hash functions. A pair is a candidate when
+# all ROWS values of any band agree; for token-set Jaccard s that happens with
+# probability 1 - (1 - s^ROWS)^BANDS (0.89 at s=0.7, 0.99 at s=0.8).
+BANDS = 8
+ROWS = 4
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(20240601)
+_HASHES = [(_rng.randrange(1, _MERSENNE), _rng.randrange(_MERSENNE)) for _ in range(BANDS * ROWS)]
+
+
+# =========================================
+# NORMALIZATION
+# =========================================
+
+_WORD = re.compile(r"[^\W_]+")
+
+_STOPWORDS = frozenset(
+    "a an and or the of for with in at to on by from my our their his her who are is be "
+    "eg ie etc we also plus especially mostly mainly many some lots lot mix various going getting through".split()
+)
+
+# Abbreviations and variants advisors type, mapped to one spelling (before stemming).
+_SYNONYMS = {
+    "biz": "business", "businesses": "business", "smb": "small business", "smbs": "small business",
+    "w": "with", "kids": "children", "kid": "children", "child": "children",
+    "fam": "family", "fams": "family", "docs": "doctor", "doc": "doctor", "physicians": "doctor",
+    "physician": "doctor", "md": "doctor", "mds": "doctor", "profs": "professional", "pros": "professional",
+    "execs": "executive", "exec": "executive", "grads": "graduate", "grad": "graduate", "alum": "alumni",
+    "alumnus": "alumni", "alums": "alumni", "hnw": "high net worth", "uhnw": "ultra high net worth",
+    "preretirees": "pre retiree", "preretiree": "pre retiree", "retirees": "retiree", "retired": "retiree",
+    "biotech": "biotechnology", "tech": "technology", "techies": "technology", "realtors": "realtor",
+    "attys": "attorney", "atty": "attorney", "lawyers": "attorney", "lawyer": "attorney", "cpas": "cpa",
+    "accountants": "accountant", "newborn": "new baby", "newborns": "new baby", "babies": "baby",
+    "relocating": "relocation", "relocate": "relocation", "moving": "relocation", "move": "relocation",
+    "marriage": "married", "marrying": "married", "wedding": "married", "weddings": "married",
+    "divorced": "divorce", "divorcing": "divorce", "entrepreneurs": "business owner",
+    "entrepreneur": "business owner", "church": "faith", "churches": "faith", "religious": "faith",
+    "gen": "generation", "1st": "first", "2nd": "second",
+}
+
+
+def _stem(token) -> str:
+    """
+    Crude plural folding: families -> family, owners -> owner (business, class kept).
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def normalize_tokens(text) -> frozenset:
+    """
+    The set of normalized words in one free-text answer.
+    """
+    tokens = set()
+    for word in _WORD.findall(str(text or "").casefold().replace("&", " and ")):
+        for part in _SYNONYMS.get(word, word).split():
+            if len(part) > 1 and part not in _STOPWORDS:
+                tokens.add(sys.intern(_stem(part)))
+    return frozenset(tokens)
+
+
+def intake_fields(answers) -> tuple:
+    """
+    Normalized tokens of the Q2–Q6 answers, one sorted tuple per answer
+    (tuples take a fraction of a frozenset's memory in the index).
+    """
+    return tuple(tuple(sorted(normalize_tokens(answer))) for answer in answers)
+
+
+def intake_key(zip_code, answers) -> str:
+    """
+    Exact identity of an intake: ZIP plus each answer trimmed, whitespace-collapsed and case-folded.
+    """
+    raw = "\x1f".join([(zip_code or "").strip()] + [" ".join(str(a or "").split()).casefold() for a in answers])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def _jaccard(a, b) -> float:
+    if a == b:
+        return 1.0
+    shared = len(set(a).intersection(b))
+    return shared / (len(a) + len(b) - shared)
+
+
+def similarity(fields_a, fields_b, floor=0.0) -> float:
+    """
+    Similarity of two intakes: the lowest per-answer Jaccard of their normalized tokens.
+    Stops at the first answer below floor (the result is then below floor too).
+    """
+    lowest = 1.0
+    for a, b in zip(fields_a, fields_b):
+        lowest = min(lowest, _jaccard(a, b))
+        if lowest < floor:
+            break
+    return lowest
+
+
+def _stable_hash(*parts) -> bytes:
+    """
+    The same digest in every process (hash() is salted per process).
+    """
+    return hashlib.blake2b("\x1f".join(map(str, parts)).encode("utf-8"), digest_size=12).digest()
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(answer, token) -> int:
+    return int.from_bytes(_stable_hash(answer, token)[:8], "big") & _MERSENNE
+
+
+def _band_keys(zip_code, fields) -> list:
+    """
+    LSH bucket keys: MinHash signature bands over all (answer, token) pairs, scoped to the ZIP.
+    """
+    hashed = [_token_hash(i, token) for i, tokens in enumerate(fields) for token in tokens]
+    if not hashed:
+        return [_stable_hash(zip_code, "empty")]
+    signature = [min((a * h + b) % _MERSENNE for h in hashed) for a, b in _HASHES]
+    return [
+        _stable_hash(zip_code, band, *signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)
+    ]
+
+
+# =========================================
+# INDEX
+# =========================================
+
+class IntakeIndex:
+    """
+    LSH index of recent intakes: in-process (oldest dropped beyond max_entries),
+    backed by a SQLite file shared with other processes when db_path is set
+    (entries older than ttl_seconds, the cache's TTL, are dropped there).
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_entries=SIMILARITY_MAX_ENTRIES,
+                 db_path="", ttl_seconds=CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._entries = {}        # intake key -> (zip, fields)
+        self._order = deque()     # intake keys, oldest first
+        self._buckets = {}        # band key -> [intake keys]
+        self._stats = {"lookups": 0, "exact": 0, "similar": 0, "shared": 0}
+        if self.db_path:
+            self._init_db()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---------- SQLite tier ----------
+
+    def _connect(self):
+        """
+        One connection per thread; SQLite connections must not be shared across threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        try:
+            conn = self._connect()
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS intakes (
+                    key TEXT PRIMARY KEY,
+                    zip TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS intakes_stored_at ON intakes (stored_at);
+                CREATE TABLE IF NOT EXISTS intake_bands (
+                    band_key BLOB NOT NULL,
+                    intake_key TEXT NOT NULL,
+                    PRIMARY KEY (band_key, intake_key)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS intake_bands_intake ON intake_bands (intake_key);
+                """
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("intake index %s unusable (%s); matching intakes in this process only", self.db_path, e)
+            self.db_path = ""
+
+    def _disk_find(self, zip_code, fields, band_keys):
+        """
+        (intake key, fields) of the most similar intake other processes stored, or None.
+        """
+        if not self.db_path:
+            return None
+        try:
+            rows = self._connect().execute(
+                "SELECT DISTINCT i.key, i.fields FROM intake_bands b JOIN intakes i ON i.key = b.intake_key "
+                f"WHERE b.band_key IN ({','.join('?' * len(band_keys))}) AND i.zip = ? AND i.stored_at >= ?",
+                (*band_keys, zip_code, time.time() - self.ttl_seconds),
+            ).fetchall()
+        except sqlite3.Error:
+            return None
+        best, best_score = None, self.threshold
+        for key, stored in rows:
+            entry_fields = tuple(tuple(tokens) for tokens in json.loads(stored))
+            score = similarity(fields, entry_fields, best_score)
+            if score >= best_score:
+                best, best_score = (key, entry_fields), score
+        return best
+
+    def _disk_add(self, key, zip_code, fields, band_keys):
+        if not self.db_path:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR IGNORE INTO intakes (key, zip, fields, stored_at) VALUES (?, ?, ?, ?)",
+                (key, zip_code, json.dumps(fields, ensure_ascii=False), now),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO intake_bands (band_key, intake_key) VALUES (?, ?)",
+                [(band_key, key) for band_key in band_keys],
+            )
+            # Intakes whose cache entries have expired point at nothing worth reusing.
+            conn.execute(
+                "DELETE FROM intake_bands WHERE intake_key IN (SELECT key FROM intakes WHERE stored_at < ?)",
+                (now - self.ttl_seconds,),
+            )
+            conn.execute("DELETE FROM intakes WHERE stored_at < ?", (now - self.ttl_seconds,))
+            conn.commit()
+        except sqlite3.Error:
+            # Best effort, like the cache's disk tier: this process still matches it.
+            pass
+
+    # ---------- Lookups ----------
+
+    def _find(self, zip_code, fields, band_keys):
+        best, best_score = None, self.threshold
+        seen = set()
+        for band_key in band_keys:
+            for key in self._buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry_zip, entry_fields = self._entries[key]
+                if entry_zip != zip_code:
+                    continue  # a hash collision across ZIPs
+                score = similarity(fields, entry_fields, best_score)
+                if score >= best_score:
+                    best, best_score = key, score
+        return best, best_score
+
+    def find(self, zip_code, answers):
+        """
+        (intake key, score) of the most similar indexed intake for the same ZIP at or
+        above the threshold, or None.
+        """
+        zip_code = (zip_code or "").strip()
+        fields = intake_fields(answers)
+        band_keys = _band_keys(zip_code, fields)
+        with self._lock:
+            key, score = self._find(zip_code, fields, band_keys)
+        return None if key is None else (key, score)
+
+    def canonical(self, zip_code, answers) -> str:
+        """
+        The key to cache this intake's results under: its own, or that of an earlier
+        near-identical intake for the same ZIP. New intakes are indexed.
+        """
+        zip_code = (zip_code or "").strip()
+        own = intake_key(zip_code, answers)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if own in self._entries:
+                self._stats["exact"] += 1
+                return own
+        if self.threshold > 1:
+            return own
+        fields = intake_fields(answers)
+        band_keys = _band_keys(zip_code, fields)
+        with self._lock:
+            key, _score = self._find(zip_code, fields, band_keys)
+            if key is not None:
+                self._stats["similar"] += 1
+                return key
+        shared = self._disk_find(zip_code, fields, band_keys)
+        with self._lock:
+            if shared is not None:
+                key, entry_fields = shared
+                self._stats["exact" if key == own else "similar"] += 1
+                self._stats["shared"] += 1
+                self._add(key, zip_code, entry_fields, _band_keys(zip_code, entry_fields))
+                return key
+            key, _score = self._find(zip_code, fields, band_keys)  # added by another thread meanwhile
+            if key is not None:
+                self._stats["similar"] += 1
+                return key
+            self._add(own, zip_code, fields, band_keys)
+        self._disk_add(own, zip_code, fields, band_keys)
+        return own
+
+    def _add(self, key, zip_code, fields, band_keys):
+        if key in self._entries:
+            return
+        self._entries[key] = (zip_code, fields)
+        self._order.append(key)
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        while len(self._order) > self.max_entries:
+            self._evict(self._order.popleft())
+
+    def _evict(self, key):
+        zip_code, fields = self._entries.pop(key)
+        for band_key in _band_keys(zip_code, fields):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                continue
+            bucket.remove(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def add(self, zip_code, answers) -> str:
+        zip_code = (zip_code or "").strip()
+        key = intake_key(zip_code, answers)
+        fields = intake_fields(answers)
+        band_keys = _band_keys(zip_code, fields)
+        with self._lock:
+            self._add(key, zip_code, fields, band_keys)
+        self._disk_add(key, zip_code, fields, band_keys)
+        return key
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_intake_index() -> IntakeIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IntakeIndex(db_path=SIMILARITY_DB_PATH)
+        return _index
@@ -0,0 +1,211 @@
+"""
+Process-wide single-flight coalescing for model calls.
+
+When several sessions fire the same request at once (same normalized key),
+only the first one ("leader") reaches the API; the rest wait for and share
+its result. Streams are shared too: a background pump reads the one upstream
+stream into a buffer that every consumer replays from the start, so a late
+joiner still gets the whole text.
+
+Nothing is kept after a flight lands — that is the response cache's job —
+and errors are never handed on: a follower that has not received any output
+yet simply retries on its own when the leader fails.
+
+Streams are reference-counted. A consumer whose cancel scope is set (see
+cancel_scope) stops following; once the last consumer has gone, the flight's
+own cancel event tells produce() to stop and close the upstream request.
+"""
+
+import contextvars
+import threading
+
+# How often a cancellable follower wakes up to check its cancel event.
+CANCEL_POLL_SECONDS = 0.25
+
+_cancel = contextvars.ContextVar("coi_cancel", default=None)
+
+
+class Cancelled(Exception):
+    """
+    The consumer of a stream cancelled it (resubmit, path switch, ...).
+    """
+
+
+def cancel_scope(event):
+    """
+    Let streams consumed from the current context be cancelled by setting event.
+    Worker pools started with contextvars.copy_context() inherit the scope.
+    """
+    _cancel.set(event)
+
+
+def current_cancel_event():
+    return _cancel.get()
+
+# =========================================
+# FLIGHTS
+# =========================================
+
+
+class _Flight:
+    __slots__ = ("cond", "chunks", "result", "error", "done", "consumers", "cancel")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.consumers = 0
+        self.cancel = threading.Event()
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls by key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {
+            "leaders": 0,          # calls that actually went upstream
+            "coalesced": 0,        # calls that joined an in-flight leader
+            "error_retries": 0,    # followers that retried after the leader failed
+            "cancelled": 0,        # upstream streams stopped because every consumer left
+        }
+
+    def _join(self, key):
+        """
+        Return (flight, is_leader) for key, registering a new flight if none is in the air.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+                return flight, True
+            self._stats["coalesced"] += 1
+            return flight, False
+
+    def _land(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _retry(self):
+        with self._lock:
+            self._stats["error_retries"] += 1
+
+    # ---------- Blocking calls ----------
+
+    def call(self, key, fn):
+        """
+        Run fn() once per key at a time; concurrent callers with the same key share its return value.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                flight.result = fn()
+                return flight.result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                self._land(key, flight)
+
+        with flight.cond:
+            while not flight.done:
+                flight.cond.wait()
+        if flight.error is not None:
+            self._retry()
+            return self.call(key, fn)
+        return flight.result
+
+    # ---------- Streams ----------
+
+    def stream(self, key, produce, cancel=None):
+        """
+        Generator of deltas from produce(cancel_event) (a function returning an
+        iterator), shared by every concurrent caller with the same key.
+        Raises Cancelled once `cancel` (default: the current cancel scope) is set.
+        """
+        cancel = current_cancel_event() if cancel is None else cancel
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(
+                target=self._pump, args=(key, flight, produce), daemon=True, name="coi-flight"
+            ).start()
+        return self._follow(key, flight, produce, leader, cancel)
+
+    def _pump(self, key, flight, produce):
+        try:
+            for delta in produce(flight.cancel):
+                with flight.cond:
+                    flight.chunks.append(delta)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            self._land(key, flight)
+
+    def _follow(self, key, flight, produce, leader, cancel):
+        with flight.cond:
+            flight.consumers += 1
+        try:
+            sent = 0
+            while True:
+                with flight.cond:
+                    while sent >= len(flight.chunks) and not flight.done:
+                        if cancel is not None and cancel.is_set():
+                            raise Cancelled()
+                        flight.cond.wait(CANCEL_POLL_SECONDS if cancel is not None else None)
+                    pending = flight.chunks[sent:]
+                    finished = flight.done and sent + len(pending) >= len(flight.chunks)
+                for delta in pending:
+                    if cancel is not None and cancel.is_set():
+                        raise Cancelled()
+                    yield delta
+                sent += len(pending)
+                if not finished:
+                    continue
+                if flight.error is None:
+                    return
+                if leader or sent:
+                    # Our own request failed, or we already showed part of the text.
+                    raise flight.error
+                self._retry()
+                yield from self.stream(key, produce, cancel)
+                return
+        finally:
+            self._leave(flight)
+
+    def _leave(self, flight):
+        """
+        Drop a consumer; the last one out of an unfinished flight cancels it upstream.
+        """
+        with flight.cond:
+            flight.consumers -= 1
+            abandon = flight.consumers == 0 and not flight.done
+        if abandon and not flight.cancel.is_set():
+            flight.cancel.set()
+            with self._lock:
+                self._stats["cancelled"] += 1
+
+    # ---------- Metrics ----------
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
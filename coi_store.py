@@ -0,0 +1,184 @@
+"""
+Shared, content-addressed store for the results sessions display.
+
+Streamlit keeps st.session_state in memory for as long as a session lives, so
+every advisor used to carry full result strings and parsed COI lists. Now a
+session holds only short refs; the payloads live here once per process:
+
+- content-addressed: a ref is the SHA-256 of the payload, so identical
+  results (every cache hit, coalesced calls, the same COIs found for several
+  advisors) are stored once however many sessions show them;
+- compressed with zlib (COI tables shrink ~4x);
+- per-session slots: a session's new result for a slot ("path_b_result",
+  "path_a_records", ...) releases the one it replaces, and a payload is
+  dropped when no session refers to it any more;
+- a global budget (COI_RESULT_STORE_MB of compressed payloads): when a put
+  goes over it, whole sessions are evicted least recently active first, never
+  the session doing the put. get() then returns None and the app asks the
+  advisor to run the search again.
+
+Text a search is still streaming lives in its job (coi_jobs) until the session
+collects the result into this store; the job is dropped then, so apart from
+searches in flight, results take memory only here.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from coi_records import COIRecord
+
+# =========================================
+# CONFIG
+# =========================================
+
+RESULT_STORE_BYTES = int(float(os.getenv("COI_RESULT_STORE_MB", "64")) * 1024 * 1024)
+COMPRESS_LEVEL = 6
+
+
+# =========================================
+# STORE
+# =========================================
+
+class ResultStore:
+    """
+    Compressed payloads by content hash, referenced from per-session slots. Thread-safe.
+    """
+
+    def __init__(self, budget_bytes=RESULT_STORE_BYTES):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._blobs = {}               # ref -> [compressed bytes, raw size, sessions referring]
+        self._sessions = OrderedDict()  # session -> {slot: ref}, least recently active first
+        self._bytes = 0
+        self._raw_bytes = 0
+        self._stats = {"puts": 0, "shared": 0, "gets": 0, "expired": 0, "evicted_sessions": 0}
+
+    # ---------- Internals (lock held) ----------
+
+    def _release(self, ref):
+        blob = self._blobs.get(ref)
+        if blob is None:
+            return
+        blob[2] -= 1
+        if blob[2] <= 0:
+            del self._blobs[ref]
+            self._bytes -= len(blob[0])
+            self._raw_bytes -= blob[1]
+
+    def _evict(self, keep):
+        """
+        Drop whole sessions, least recently active first, until within budget.
+        """
+        while self._bytes > self.budget_bytes:
+            victim = next((session for session in self._sessions if session != keep), None)
+            if victim is None:
+                return
+            for ref in self._sessions.pop(victim).values():
+                self._release(ref)
+            self._stats["evicted_sessions"] += 1
+
+    def _touch(self, session) -> dict:
+        slots = self._sessions.get(session)
+        if slots is None:
+            slots = self._sessions[session] = {}
+        self._sessions.move_to_end(session)
+        return slots
+
+    # ---------- Public API ----------
+
+    def put(self, session, slot, value: str) -> str:
+        """
+        Store value as session's `slot` (replacing what the slot held) and return its ref.
+        """
+        raw = value.encode("utf-8")
+        ref = hashlib.sha256(raw).hexdigest()[:32]
+        compressed = None
+        if ref not in self._blobs:
+            compressed = zlib.compress(raw, COMPRESS_LEVEL)
+        with self._lock:
+            self._stats["puts"] += 1
+            slots = self._touch(session)
+            if slots.get(slot) == ref:
+                return ref
+            blob = self._blobs.get(ref)
+            if blob is None:
+                if compressed is None:  # dropped since the check above
+                    compressed = zlib.compress(raw, COMPRESS_LEVEL)
+                blob = self._blobs[ref] = [compressed, len(raw), 0]
+                self._bytes += len(compressed)
+                self._raw_bytes += len(raw)
+            else:
+                self._stats["shared"] += 1
+            blob[2] += 1
+            previous = slots.get(slot)
+            slots[slot] = ref
+            if previous is not None:
+                self._release(previous)
+            self._evict(keep=session)
+        return ref
+
+    def get(self, session, ref):
+        """
+        The value for ref, or None if it was evicted (or ref is empty).
+        """
+        if not ref:
+            return None
+        with self._lock:
+            self._stats["gets"] += 1
+            if session in self._sessions:
+                self._sessions.move_to_end(session)
+            blob = self._blobs.get(ref)
+            if blob is None:
+                self._stats["expired"] += 1
+                return None
+            compressed = blob[0]
+        return zlib.decompress(compressed).decode("utf-8")
+
+    def put_records(self, session, slot, records) -> str:
+        return self.put(session, slot, json.dumps([record.to_row() for record in records], ensure_ascii=False))
+
+    def get_records(self, session, ref):
+        """
+        The COIRecord list for ref, [] for no ref, or None if it was evicted.
+        """
+        if not ref:
+            return []
+        value = self.get(session, ref)
+        return None if value is None else [COIRecord.from_row(row) for row in json.loads(value)]
+
+    def discard(self, session, slot):
+        """
+        Empty one of session's slots.
+        """
+        with self._lock:
+            ref = self._sessions.get(session, {}).pop(slot, None)
+            if ref is not None:
+                self._release(ref)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                sessions=len(self._sessions), payloads=len(self._blobs),
+                bytes=self._bytes, raw_bytes=self._raw_bytes, budget_bytes=self.budget_bytes,
+            )
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """
+    Process-wide store, created lazily on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
@@ -0,0 +1,356 @@
+"""
+Background verification of the links (and phone numbers) in returned COI rows.
+
+The model is told to encourage verification, but a dead or invented
+"Organization + Link" URL used to reach advisors unchecked. Every link shown
+in the results grid is now checked in the background:
+
+- one asyncio loop on a daemon thread runs every check, through one pooled
+  httpx.AsyncClient (COI_VERIFY_MAX_CONNECTIONS) with short timeouts
+  (COI_VERIFY_TIMEOUT) and at most COI_VERIFY_PER_HOST checks per host;
+- HEAD first, then a GET whose body is never read when HEAD is refused or
+  fails other than by timing out (plenty of servers mishandle HEAD);
+- redirects are followed here, hop by hop, not by httpx: every hop's
+  domain is resolved first, a name that does not resolve is reported dead,
+  and names resolving to private or loopback addresses are not fetched at
+  all (the URLs come from the model). The connection goes to the address
+  that was checked (Host header and TLS SNI keep the name), so DNS cannot
+  change its answer in between;
+- results are cached by URL in process (COI_VERIFY_TTL_HOURS; timeouts and
+  server errors are retried after RETRY_TRANSIENT_SECONDS), so the same link
+  is checked once for every session.
+
+check() never blocks: it returns what is known and schedules the rest, so
+the grid renders straight away and fills its badges in as checks finish.
+Phone numbers are checked locally: 555-01xx numbers are reserved as
+fictional and other 555 exchange numbers almost always are.
+"""
+
+import asyncio
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+# =========================================
+# CONFIG
+# =========================================
+
+VERIFY_LINKS = os.getenv("COI_VERIFY_LINKS", "1") == "1"
+VERIFY_TIMEOUT = float(os.getenv("COI_VERIFY_TIMEOUT", "5"))
+VERIFY_PER_HOST = int(os.getenv("COI_VERIFY_PER_HOST", "2"))
+VERIFY_MAX_CONNECTIONS = int(os.getenv("COI_VERIFY_MAX_CONNECTIONS", "20"))
+VERIFY_TTL_SECONDS = float(os.getenv("COI_VERIFY_TTL_HOURS", "24")) * 3600
+VERIFY_CACHE_ENTRIES = int(os.getenv("COI_VERIFY_CACHE_ENTRIES", "10000"))
+# Let checks reach private / loopback addresses (local stand-in servers only).
+VERIFY_ALLOW_PRIVATE = os.getenv("COI_VERIFY_ALLOW_PRIVATE", "") == "1"
+
+# Timeouts, connection failures and 5xx may clear up: checked again after this.
+RETRY_TRANSIENT_SECONDS = 600
+MAX_REDIRECTS = 5
+USER_AGENT = "Mozilla/5.0 (compatible; coi-link-check/1.0)"
+
+# Check outcomes.
+OK, BLOCKED, DEAD, UNREACHABLE, INVALID = "ok", "blocked", "dead", "unreachable", "invalid"
+BADGES = {OK: "✅", BLOCKED: "🔒", DEAD: "❌", UNREACHABLE: "⚠️", INVALID: "❌"}
+PENDING_BADGE = "⏳"
+# Sites that answer bots with these still exist (999 is LinkedIn's).
+_BLOCKED_CODES = {401, 403, 429, 999}
+
+# "mailto:", "tel:" ... but not "example.com:8080".
+_OTHER_SCHEME = re.compile(r"^[a-z][a-z0-9+.-]*:(?!\d)", re.IGNORECASE)
+_PHONE = re.compile(r"\(?\b(\d{3})\)?[\s.-]*(\d{3})[\s.-]*(\d{4})\b")
+
+
+# =========================================
+# RESULTS
+# =========================================
+
+class LinkCheck:
+    """
+    Outcome of checking one URL: status (OK, BLOCKED, DEAD, UNREACHABLE, INVALID),
+    the last HTTP status code (0 if none), a short detail and the final URL.
+    """
+
+    __slots__ = ("status", "code", "detail", "final_url", "checked_at")
+
+    def __init__(self, status, code=0, detail="", final_url="", checked_at=None):
+        self.status = status
+        self.code = code
+        self.detail = detail
+        self.final_url = final_url
+        self.checked_at = time.time() if checked_at is None else checked_at
+
+    def __repr__(self):
+        return f"LinkCheck({self.status!r}, {self.code}, {self.detail!r})"
+
+    @property
+    def transient(self) -> bool:
+        return self.status == UNREACHABLE
+
+    @property
+    def badge(self) -> str:
+        return f"{BADGES[self.status]} {self.detail or self.code or self.status}"
+
+
+def normalize_url(link) -> str:
+    """
+    The URL to fetch for a link cell ("www.x.com/a" -> "https://www.x.com/a"), or "" if it is not web.
+    """
+    link = (link or "").strip()
+    if not link:
+        return ""
+    if "://" not in link:
+        if _OTHER_SCHEME.match(link):
+            return ""
+        link = "https://" + link
+    parsed = urlparse(link)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return ""
+    return link
+
+
+def contact_issue(contact) -> str:
+    """
+    A short warning for a phone number that is almost certainly fictional, else "".
+    """
+    for _area, exchange, line in _PHONE.findall(contact or ""):
+        if exchange == "555" and line != "1212":
+            return "☎️ 555 number"
+    return ""
+
+
+def _classify(response, final_url) -> LinkCheck:
+    code = response.status_code
+    if code < 400:
+        return LinkCheck(OK, code, "", final_url)
+    if code in _BLOCKED_CODES:
+        return LinkCheck(BLOCKED, code, f"{code}", final_url)
+    if code >= 500:
+        return LinkCheck(UNREACHABLE, code, f"{code}", final_url)
+    return LinkCheck(DEAD, code, f"{code}", final_url)
+
+
+def _private(address) -> bool:
+    ip = ipaddress.ip_address(address)
+    return ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved or ip.is_multicast
+
+
+# =========================================
+# VERIFIER
+# =========================================
+
+class LinkVerifier:
+    """
+    Checks URLs on a background event loop and caches the outcomes by URL.
+    Safe to call from any thread.
+    """
+
+    def __init__(self, timeout=VERIFY_TIMEOUT, per_host=VERIFY_PER_HOST,
+                 max_connections=VERIFY_MAX_CONNECTIONS, ttl_seconds=VERIFY_TTL_SECONDS,
+                 max_entries=VERIFY_CACHE_ENTRIES, allow_private=VERIFY_ALLOW_PRIVATE):
+        self.timeout = timeout
+        self.per_host = max(1, per_host)
+        self.max_connections = max(1, max_connections)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.allow_private = allow_private
+        self._results = OrderedDict()   # url -> LinkCheck
+        self._pending = {}              # url -> concurrent.futures.Future
+        # Reentrant: a check that is already done runs its callback inside check().
+        self._lock = threading.RLock()
+        self._loop = None
+        self._client = None
+        self._hosts = {}                # host -> asyncio.Semaphore (loop thread only)
+        self._stats = {"checked": 0, "in_flight": 0, "max_host_in_flight": 0}
+        self._status_counts = {status: 0 for status in BADGES}
+        self._host_in_flight = {}
+
+    # ---------- Loop ----------
+
+    def _ensure_loop(self):
+        """
+        Start the event loop thread and its HTTP client once (call with the lock held).
+        """
+        if self._loop is not None:
+            return
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True, name="coi-verify").start()
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 3.0)),
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            follow_redirects=False,
+            headers={"User-Agent": USER_AGENT},
+        )
+        self._loop = loop
+
+    # ---------- Checks ----------
+
+    def _blocked(self, address) -> bool:
+        return not self.allow_private and _private(address)
+
+    async def _resolve(self, url):
+        """
+        (address to connect to, None) if the URL's host may be fetched,
+        else (None, the LinkCheck that ends the check).
+        """
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return None, LinkCheck(DEAD, 0, "no such domain")
+        except OSError:
+            return None, LinkCheck(UNREACHABLE, 0, "DNS error")
+        if not infos:
+            return None, LinkCheck(DEAD, 0, "no such domain")
+        if any(self._blocked(info[4][0]) for info in infos):
+            return None, LinkCheck(INVALID, 0, "private address")
+        return infos[0][4][0], None
+
+    async def _request(self, method, url):
+        """
+        method on url, following redirects hop by hop; every hop is resolved and
+        vetted by _resolve and connects to the address it vetted. Returns a LinkCheck.
+        """
+        for _hop in range(MAX_REDIRECTS + 1):
+            address, ended = await self._resolve(url)
+            if ended is not None:
+                return ended
+            parsed = urlparse(url)
+            request = self._client.build_request(
+                method, httpx.URL(url).copy_with(host=address),
+                headers={"Host": parsed.netloc.rpartition("@")[2]},
+                extensions={"sni_hostname": parsed.hostname},
+            )
+            response = await self._client.send(request, stream=True)
+            await response.aclose()
+            location = response.headers.get("location")
+            if not response.is_redirect or not location:
+                return _classify(response, url)
+            url = urljoin(url, location)
+            if urlparse(url).scheme not in ("http", "https") or not urlparse(url).hostname:
+                return LinkCheck(DEAD, response.status_code, "bad redirect", url)
+        return LinkCheck(DEAD, 0, "redirect loop", url)
+
+    async def _fetch(self, url) -> LinkCheck:
+        try:
+            result = await self._request("HEAD", url)
+            if result.status == OK or not result.code:
+                return result
+        except httpx.TimeoutException:
+            return LinkCheck(UNREACHABLE, 0, "timeout")
+        except httpx.HTTPError:
+            pass
+        try:
+            return await self._request("GET", url)
+        except httpx.TimeoutException:
+            return LinkCheck(UNREACHABLE, 0, "timeout")
+        except httpx.HTTPError as e:
+            return LinkCheck(UNREACHABLE, 0, type(e).__name__)
+
+    async def _check(self, url) -> LinkCheck:
+        host = urlparse(url).hostname.casefold()
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.per_host)
+        async with semaphore:
+            with self._lock:
+                self._host_in_flight[host] = self._host_in_flight.get(host, 0) + 1
+                self._stats["max_host_in_flight"] = max(self._stats["max_host_in_flight"], self._host_in_flight[host])
+            try:
+                return await self._fetch(url)
+            finally:
+                with self._lock:
+                    self._host_in_flight[host] -= 1
+
+    def _done(self, url, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = LinkCheck(UNREACHABLE, 0, type(e).__name__)
+        with self._lock:
+            self._pending.pop(url, None)
+            self._stats["in_flight"] -= 1
+            self._stats["checked"] += 1
+            self._status_counts[result.status] += 1
+            self._results[url] = result
+            self._results.move_to_end(url)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    # ---------- Public API ----------
+
+    def _fresh(self, result) -> bool:
+        age = time.time() - result.checked_at
+        return age <= (RETRY_TRANSIENT_SECONDS if result.transient else self.ttl_seconds)
+
+    def check(self, links) -> dict:
+        """
+        {link: LinkCheck, or None while pending} for every link. Links not checked
+        recently are scheduled; never blocks. Links that are not web URLs come back INVALID.
+        """
+        out = {}
+        with self._lock:
+            for link in links:
+                if not link or link in out:
+                    continue
+                url = normalize_url(link)
+                if not url:
+                    out[link] = LinkCheck(INVALID, 0, "not a web link")
+                    continue
+                result = self._results.get(url)
+                if result is not None and self._fresh(result):
+                    out[link] = result
+                    continue
+                if url not in self._pending:
+                    self._ensure_loop()
+                    future = asyncio.run_coroutine_threadsafe(self._check(url), self._loop)
+                    self._pending[url] = future
+                    self._stats["in_flight"] += 1
+                    future.add_done_callback(lambda f, url=url: self._done(url, f))
+                out[link] = None
+        return out
+
+    def check_all(self, links, timeout=None) -> dict:
+        """
+        Blocking check(): waits (up to timeout seconds) for every pending link.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            results = self.check(links)
+            if all(result is not None for result in results.values()):
+                return results
+            if deadline is not None and time.monotonic() >= deadline:
+                return results
+            time.sleep(0.05)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(self._status_counts)
+            stats["cached"] = len(self._results)
+        return stats
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """
+    Process-wide verifier, created lazily on first use; None when COI_VERIFY_LINKS is not "1".
+    """
+    global _verifier
+    if not VERIFY_LINKS:
+        return None
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = LinkVerifier()
+        return _verifier